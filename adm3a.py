@@ -0,0 +1,163 @@
+# This is free and unencumbered software released into the public domain.
+#
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a compiled
+# binary, for any purpose, commercial or non-commercial, and by any
+# means.
+#
+# In jurisdictions that recognize copyright laws, the author or authors
+# of this software dedicate any and all copyright interest in the
+# software to the public domain. We make this dedication for the benefit
+# of the public at large and to the detriment of our heirs and
+# successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to this
+# software under copyright law.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# For more information, please refer to <https://unlicense.org>
+
+"""Screen model of an 80x24 Lear Siegler ADM-3A terminal.
+
+Keeps the character cells and the cursor, and tracks which rows changed since
+the last time a front end drew the screen, so that front ends only redraw what
+changed. Scrolling rotates a ring of rows rather than moving the cells."""
+
+
+from typing import Set, Tuple
+
+
+class ADM3A_Screen:
+
+    cols = 80
+    rows = 24
+
+    def __init__(self):
+        self.cells: bytearray = bytearray(b' ' * (self.cols * self.rows))
+        self.top: int = 0       # Row of self.cells shown at the top of the screen
+        self.cursor: int = 0    # Cursor position on screen, 80 * row + col
+        self.esc_sequence: bytes = b''
+
+        self.dirty: Set[int] = set(range(self.rows))    # Screen rows to redraw
+        self.scrolled: int = 0  # Rows scrolled up since the last redraw
+
+
+    def putch(self, ch: int) -> bool:
+        # Returns False for characters the ADM-3A doesn't handle.
+        ch = ch & 0b01111111
+        if ch == 27:      # Esc
+            self.esc_sequence = b'\x1b'
+        elif len(self.esc_sequence) > 0:
+            self.esc_sequence += bytes([ch])
+            if not self.esc_sequence.startswith(b'\x1b='):
+                self.esc_sequence = b''
+            elif len(self.esc_sequence) >= 4:
+                y = self.esc_sequence[2] - 0x20
+                x = self.esc_sequence[3] - 0x20
+                self.move_cursor(self.cols * y + x)
+                self.esc_sequence = b''
+
+        elif ch == 8:         # ^H
+            self.move_cursor(self.cursor - 1)
+        elif ch == 10:         # ^J, \n
+            if self.cursor + self.cols >= self.cols * self.rows - 1:
+                self.scroll()
+                self.move_cursor(self.cols * (self.rows - 1))
+            else:
+                self.move_cursor(self.cursor + self.cols)
+        elif ch == 11:         # ^K
+            self.move_cursor(self.cursor - self.cols)
+        elif ch == 12:         # ^L
+            self.move_cursor(self.cursor + 1)
+        elif ch == 13:      # \r
+            self.move_cursor(self.cursor // self.cols * self.cols)
+        elif ch == 26:      # ^Z
+            self.clear()
+        elif ch == 30:      # Home
+            self.move_cursor(0)
+
+        elif 32 <= ch < 127: # Printable
+            if self.cursor >= self.cols * self.rows - 1:
+                self.scroll()
+                self.move_cursor(self.cols * (self.rows - 1))
+            row, col = divmod(self.cursor, self.cols)
+            self.cells[self.cols * ((self.top + row) % self.rows) + col] = ch
+            self.dirty.add(row)
+            self.cursor += 1
+        else:
+            return False
+        return True
+
+
+    def write(self, data: bytes) -> None:
+        for ch in data:
+            self.putch(ch)
+
+
+    def move_cursor(self, pos: int) -> None:
+        pos = min(max(pos, 0), self.cols * self.rows - 1)
+        self.dirty.add(self.cursor // self.cols)
+        self.dirty.add(pos // self.cols)
+        self.cursor = pos
+
+
+    def scroll(self) -> None:
+        # Blank the top row and make it the bottom row.
+        start = self.cols * self.top
+        self.cells[start:start + self.cols] = b' ' * self.cols
+        self.top = (self.top + 1) % self.rows
+        self.dirty = {row - 1 for row in self.dirty if row > 0}
+        self.dirty.add(self.rows - 1)
+        self.scrolled += 1
+
+
+    def clear(self) -> None:
+        self.cells[:] = b' ' * (self.cols * self.rows)
+        self.top = 0
+        self.cursor = 0
+        self.dirty = set(range(self.rows))
+
+
+    def row(self, row: int) -> bytes:
+        start = self.cols * ((self.top + row) % self.rows)
+        return bytes(self.cells[start:start + self.cols])
+
+
+    def text(self) -> str:
+        return '\n'.join(self.row(row).decode(encoding='ascii').rstrip()
+                         for row in range(self.rows))
+
+
+    def take_changes(self) -> Tuple[Set[int], int]:
+        # Returns the rows to redraw and the number of rows scrolled since the
+        # last call, and starts tracking changes afresh.
+        dirty, scrolled = self.dirty, self.scrolled
+        self.dirty = set()
+        self.scrolled = 0
+        return dirty, scrolled
+
+
+if __name__ == '__main__':
+    screen = ADM3A_Screen()
+    screen.write(b'\x1aHello\r\nworld')
+    assert screen.row(0).rstrip() == b'Hello'
+    assert screen.row(1).rstrip() == b'world'
+    assert screen.cursor == 85
+
+    screen.write(b'\x1b=' + bytes([0x20 + 23, 0x20]) + b'bottom\r\n')
+    assert screen.row(22).rstrip() == b'bottom'
+    assert screen.row(0).rstrip() == b'world'
+    assert screen.cursor == 80 * 23
+    dirty, scrolled = screen.take_changes()
+    assert scrolled == 1
+    assert 23 in dirty and 22 in dirty
+
+    screen.write(b'\x1eX')
+    assert screen.row(0).rstrip() == b'Xorld'
+    assert screen.take_changes() == ({0, 23}, 0)
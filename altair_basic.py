@@ -29,19 +29,21 @@ Good enough to run 4K BASIC, 8K BASIC, and Extended BASIC."""
 
 
 import argparse
-from typing import Optional
+from typing import BinaryIO, Optional
 
 from kbhit import KBHit
 
+from altair_math import MBF_Math
+from altair_program import load_program
 from virtual8080 import Virtual8080
-from virtual_device import VirtualDevice
+from virtual_device import ConsoleDevice
+from warp import file_fingerprint, load_snapshot, save_snapshot, warp_until
 
 
-class AltairWithTerminal(VirtualDevice):
+class AltairWithTerminal(ConsoleDevice):
 
     def __init__(self):
-        self.input_buffer: bytes = b''
-        self.output_char: int = -1
+        super().__init__()
 
     def get_input(self, port_addr: int) -> int:
         if port_addr == 0xff:
@@ -53,7 +55,7 @@ class AltairWithTerminal(VirtualDevice):
             return 0b00000000
         elif port_addr == 0x10:
             # Status register
-            input_ready = 1 if len(self.input_buffer) > 0 else 0
+            input_ready = 1 if self.input_queue.ready() else 0
             output_ready = 1
             status = 0b00000000
             status = status | (input_ready << 0)
@@ -61,9 +63,8 @@ class AltairWithTerminal(VirtualDevice):
             return status
         elif port_addr == 0x11:
             # I/O register
-            if len(self.input_buffer) > 0:
-                ch = self.input_buffer[0]
-                self.input_buffer = self.input_buffer[1:]
+            ch = self.input_queue.pop()
+            if ch is not None:
                 return ch
             return 0  # Okay?
         else:
@@ -75,41 +76,86 @@ class AltairWithTerminal(VirtualDevice):
             pass
         elif port_addr == 0x11:
             # I/O register
-            self.output_char = value & 0b01111111
-
-
-def console_run(program_file: str, autorun_file: Optional[str] = None, init_str: str = ''):
+            self.put_output(value & 0b01111111)
+
+
+def start_basic(program_file: str,
+                init_str: Optional[str] = None,
+                fast_math: bool = False,
+                verify_math: bool = False,
+                warp_prompt: Optional[str] = None,
+                snapshot_file: Optional[str] = None) -> Virtual8080:
+    # A machine running BASIC, with BASIC's questions at start answered with
+    # init_str, if given. With warp_prompt, it boots flat out until BASIC
+    # shows the prompt, or starts from snapshot_file, made there the first
+    # time.
     vm = Virtual8080()
     vm.io = AltairWithTerminal()
-    with open(program_file, 'rb') as pf:
-        program = pf.read()
-    vm.load(program)
-
+    vm.load_file(program_file)
+    if fast_math or verify_math:
+        MBF_Math(vm, verify=verify_math).install()
+
+    vm.halted = False
+    snapshot_key = [warp_prompt, program_file, file_fingerprint(program_file), init_str]
+    restored = (snapshot_file is not None
+                and load_snapshot(snapshot_file, snapshot_key, vm) is not None)
+    if not restored and init_str is not None:
+        vm.io.input_queue.push(init_str.encode(encoding='ascii'))
+    if not restored and warp_prompt is not None:
+        if warp_until(vm, warp_prompt.encode('ascii')) and snapshot_file is not None:
+            save_snapshot(snapshot_file, snapshot_key, vm, bytes(vm.io.output_buffer), {})
+    return vm
+
+
+def console_run(program_file: str,
+                autorun_file: Optional[str] = None,
+                init_str: str = '',
+                batch_size: int = 10000,
+                fast_math: bool = False,
+                verify_math: bool = False,
+                type_program: bool = False,
+                warp_prompt: Optional[str] = None,
+                snapshot_file: Optional[str] = None):
+    answer = autorun_file is not None or warp_prompt is not None
+    vm = start_basic(program_file, init_str if answer else None,
+                     fast_math=fast_math, verify_math=verify_math,
+                     warp_prompt=warp_prompt, snapshot_file=snapshot_file)
+
+    def type_in(f: BinaryIO) -> None:
+        vm.io.input_queue.stream(f, translate=bytes.maketrans(b'\n', b'\r'), delete=b'\r')
+
+    # The program is stored straight into memory once BASIC first says OK,
+    # unless it's to be typed in.
+    waiting_for_ok = False
     if autorun_file is not None:
-        init_buffer = init_str
-        with open(autorun_file, 'r') as af:
-            for line in af.readlines():
-                init_buffer += line.replace('\n', '\r')
-        vm.io.input_buffer = init_buffer.encode(encoding='ascii')
+        if type_program:
+            type_in(open(autorun_file, 'rb'))
+        else:
+            waiting_for_ok = True
+    seen = b''
+
+    def on_input(keys: bytes) -> None:
+        # Enter sends CR and a NUL; ESC sends ^C to break.
+        vm.io.input_queue.push(keys.replace(b'\n', b'\r\x00').replace(b'\x1b', b'\x03'))
 
     kb = KBHit()
+    kb.start_reader(on_input)
     try:
-        vm.halted = False
         while not vm.halted:
-            ch = vm.io.output_char
-            if ch != -1 and ch != 13:
-                print(bytes([ch]).decode(encoding='ascii'), end='', flush=True)
-            vm.io.output_char = -1
-            if kb.kbhit():
-                ch = ord(kb.getch())
-                if ch == 10:
-                    vm.io.input_buffer += bytes([13, 0])
-                elif ch == 27:
-                    # Break on ESC
-                    vm.io.input_buffer += bytes([3])
-                else:
-                    vm.io.input_buffer += bytes([ch])
-            vm.step()
+            vm.run_for(batch_size)
+            if len(vm.io.output_buffer) > 0:
+                out = vm.io.drain_output().replace(b'\r', b'')
+                print(out.decode(encoding='ascii'), end='', flush=True)
+                if waiting_for_ok:
+                    seen = seen[-1:] + out
+                    if b'OK' in seen:
+                        waiting_for_ok = False
+                        with open(autorun_file, 'rb') as af:
+                            direct = load_program(vm, af.read())
+                        if direct is None:
+                            type_in(open(autorun_file, 'rb'))
+                        else:
+                            vm.io.input_queue.push(direct)
     finally:
         kb.set_normal_term()
 
@@ -129,10 +175,27 @@ if __name__ == '__main__':
     parser.add_argument('-f', '--autorun_file',
                         type=str, default=None,
                         help='File (BASIC) to run on startup')
+    parser.add_argument('--fast-math', action='store_true',
+                        help='Run floating point addition, multiplication and division in Python')
+    parser.add_argument('--verify-math', action='store_true',
+                        help='Like --fast-math, but also run the 8080 code and check they agree')
+    parser.add_argument('--type-program', action='store_true',
+                        help='Type the -f program in line by line instead of storing it in memory')
+    parser.add_argument('--warp-until', metavar='PROMPT', nargs='?', const='OK', default=None,
+                        help='run flat out until BASIC shows PROMPT (OK if not given)')
+    parser.add_argument('--snapshot', metavar='FILE', default=None,
+                        help='start from the snapshot in FILE, or boot with --warp-until '
+                             'and save one to FILE at the prompt')
     parser.set_defaults(version=('altair_basic_bin/8kbas.bin', '65529\r\rY\r'))
     args = parser.parse_args()
 
     ### Terminal interface
     program = args.version[0]
     init = args.version[1]
-    console_run(program, autorun_file=args.autorun_file, init_str=init)
+    warp_prompt = args.warp_until
+    if args.snapshot is not None and warp_prompt is None:
+        warp_prompt = 'OK'
+    console_run(program, autorun_file=args.autorun_file, init_str=init,
+                fast_math=args.fast_math, verify_math=args.verify_math,
+                type_program=args.type_program, warp_prompt=warp_prompt,
+                snapshot_file=args.snapshot)
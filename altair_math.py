@@ -0,0 +1,350 @@
+# This is free and unencumbered software released into the public domain.
+#
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a compiled
+# binary, for any purpose, commercial or non-commercial, and by any
+# means.
+#
+# In jurisdictions that recognize copyright laws, the author or authors
+# of this software dedicate any and all copyright interest in the
+# software to the public domain. We make this dedication for the benefit
+# of the public at large and to the detriment of our heirs and
+# successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to this
+# software under copyright law.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# For more information, please refer to <https://unlicense.org>
+
+"""Altair BASIC's single precision arithmetic run in Python.
+
+Numbers are in Microsoft Binary Format: an exponent byte biased by 128
+(0 for zero), then a 24-bit mantissa whose top bit, always 1, is replaced
+by the sign. The floating point accumulator (FAC) holds one operand, low
+byte first, and BCDE the other, with the exponent in B."""
+
+
+from typing import Dict, List, Optional, Tuple
+
+from virtual8080 import Virtual8080, parity
+
+
+# Entry points of FADD, FMULT and FDIV in each BASIC. SQR, SIN, LOG and the
+# other functions are built from these, so they get faster too.
+MBF_ENTRY_POINTS: Dict[str, Tuple[int, int, int]] = {
+    '8K BASIC': (0x1221, 0x135b, 0x13b9),
+    'Extended BASIC': (0x28c9, 0x2a00, 0x2a5b),
+}
+
+# The start of each routine, with None for addresses and for the operands
+# FMULT and FDIV write into their own code
+FADD_SIGNATURE: List[Optional[int]] = [
+    0x78, 0xb7, 0xc8, 0x3a, None, None, 0xb7, 0xca, None, None, 0x90, 0xd2, None, None,
+    0x2f, 0x3c]
+FMULT_SIGNATURE: List[Optional[int]] = [
+    0xef, 0xc8, 0x2e, 0x00, 0xcd, None, None, 0x79, 0x32, None, None, 0xeb, 0x22, None,
+    None, 0x01, 0x00, 0x00, 0x50, 0x58, 0x21, None, None, 0xe5, 0x21, None, None, 0xe5,
+    0xe5, 0x21, None, None, 0x7e, 0x23, 0xb7, 0xca, None, None, 0xe5, 0xeb, 0x1e, 0x08,
+    0x1f, 0x57, 0x79, 0xd2, None, None]
+FDIV_SIGNATURE: List[Optional[int]] = [
+    0xef, 0xca, None, None, 0x2e, 0xff, 0xcd, None, None, 0x34, 0x34, 0x2b, 0x7e, 0x32,
+    None, None, 0x2b, 0x7e, 0x32, None, None, 0x2b, 0x7e, 0x32, None, None, 0x41, 0xeb,
+    0xaf, 0x4f, 0x57, 0x5f, 0x32, None, None, 0xe5, 0xc5, 0x7d, 0xd6, None, 0x6f, 0x7c,
+    0xde, None, 0x67, 0x78, 0xde, None, 0x47, 0x3e, None, 0xde, 0x00, 0x3f, 0xd2, None,
+    None]
+
+# What a routine leaves behind: new register values and memory writes. The
+# return to the caller is left to whoever applies it.
+Result = Tuple[Dict[str, int], Dict[int, int]]
+
+
+def logic_flags(value: int, flags: int) -> int:
+    # Flags after ORA or XRA leaves value in A
+    return ((flags & 0b00101010) | (value & 0x80) | ((1 if value == 0 else 0) << 6)
+            | (parity(value) << 2))
+
+
+def compare_flags(a: int, immed: int, flags: int) -> int:
+    # Flags after CPI immed with a in A
+    diff = a - immed
+    result = diff % 256
+    return ((flags & 0b00101010) | (result & 0x80) | ((1 if result == 0 else 0) << 6)
+            | ((0 if (a & 0x0f) < (immed & 0x0f) else 1) << 4) | (parity(result) << 2)
+            | (1 if diff < 0 else 0))
+
+
+class MBF_Math:
+    """Runs BASIC's FADD, FMULT and FDIV in Python when they're called.
+
+    The routines are computed as the 8080 code computes them, down to
+    truncating, rounding and leaving the same registers and flags. Anything
+    unusual, such as an overflow, an underflow or a zero result, is left to
+    the 8080 code. With verify set, the 8080 code is run after every call as
+    well, and an Exception is raised if the results differ at all."""
+
+    def __init__(self, vm: Virtual8080, verify: bool = False):
+        self.vm = vm
+        self.verify: bool = verify
+        self.basic: Optional[str] = None
+        self.fac: int = 0
+        self.fadd_entry: int = 0
+        self.fmult_entry: int = 0
+        self.fdiv_entry: int = 0
+        self.multiplicand_hi: int = 0       # Operands FMULT writes into its loop
+        self.multiplicand_lo: int = 0
+        self.divisor: Tuple[int, int, int] = (0, 0, 0)      # Operands FDIV writes, high first
+        self.dividend_ext: int = 0
+        self.calls: Dict[str, int] = {'fadd': 0, 'fmult': 0, 'fdiv': 0}
+
+
+    def matches(self, addr: int, signature: List[Optional[int]]) -> bool:
+        code = self.vm.memory[addr:addr + len(signature)]
+        return len(code) == len(signature) and all(
+            expected is None or expected == actual for expected, actual in zip(signature, code))
+
+
+    def word(self, addr: int) -> int:
+        return (self.vm.memory[addr + 1] << 8) | self.vm.memory[addr]
+
+
+    def install(self) -> Optional[str]:
+        # Hook the routines of whichever BASIC is loaded, returning its name,
+        # or None if none of them are.
+        for basic, (fadd, fmult, fdiv) in MBF_ENTRY_POINTS.items():
+            if not (self.matches(fadd, FADD_SIGNATURE) and self.matches(fmult, FMULT_SIGNATURE)
+                    and self.matches(fdiv, FDIV_SIGNATURE)):
+                continue
+            self.fac = self.word(fadd + 4) - 3
+            if self.word(fmult + 30) != self.fac:
+                continue
+            self.basic = basic
+            self.fadd_entry, self.fmult_entry, self.fdiv_entry = fadd, fmult, fdiv
+            self.multiplicand_hi = self.word(fmult + 9)
+            self.multiplicand_lo = self.word(fmult + 13)
+            self.divisor = (self.word(fdiv + 14), self.word(fdiv + 19), self.word(fdiv + 24))
+            self.dividend_ext = self.word(fdiv + 33)
+            self.vm.pc_hooks[fadd] = lambda: self.run('fadd', self.fadd)
+            self.vm.pc_hooks[fmult] = lambda: self.run('fmult', self.fmult)
+            self.vm.pc_hooks[fdiv] = lambda: self.run('fdiv', self.fdiv)
+            self.vm.hooked_op = None
+            return basic
+        return None
+
+
+    def run(self, name: str, routine) -> None:
+        result = routine()
+        if result is None:
+            return      # Run the 8080 code
+        self.calls[name] += 1
+        if self.verify:
+            self.check(name, result)
+            return
+        registers, writes = result
+        self.vm.registers.update(registers)
+        memory = self.vm.memory
+        for addr, value in writes.items():
+            memory[addr] = value
+        self.vm.return_from_sub()
+
+
+    def check(self, name: str, result: Result) -> None:
+        # Run the 8080 code to its return, and compare where it left the
+        # registers and memory with result. The stack below the return
+        # address is scratch space and isn't compared.
+        vm = self.vm
+        registers = dict(vm.registers)
+        memory = bytearray(vm.memory)
+        sp = registers['sp']
+        registers.update(result[0])
+        for addr, value in result[1].items():
+            memory[addr] = value
+        registers['pc'] = (memory[sp + 1] << 8) | memory[sp]
+        registers['sp'] = sp + 2
+
+        inputs = ' '.join(f'{r}={vm.registers[r]:02x}' for r in 'bcde')
+        inputs += ' FAC=' + bytes(vm.memory[self.fac:self.fac + 4]).hex()
+        for _ in range(100000):
+            if vm.registers['pc'] == registers['pc'] and vm.registers['sp'] == sp + 2:
+                break
+            vm.execute()
+        else:
+            raise Exception(f'{name.upper()} {inputs}: the 8080 code did not return')
+        differences = [f'{r}={vm.registers[r]:x} (Python {value:x})'
+                       for r, value in registers.items() if vm.registers[r] != value]
+        if vm.memory[:sp - 64] != memory[:sp - 64] or vm.memory[sp:] != memory[sp:]:
+            differences += [f'({addr:04x})={vm.memory[addr]:02x} (Python {memory[addr]:02x})'
+                            for addr in range(len(memory))
+                            if not sp - 64 <= addr < sp and vm.memory[addr] != memory[addr]]
+        if differences:
+            raise Exception(f'{name.upper()} {inputs}: ' + ', '.join(differences))
+
+
+    ##
+    ## The routines, each returning None to leave the call to the 8080 code
+    ##
+
+    def fadd(self) -> Optional[Result]:
+        # FAC = FAC + BCDE
+        vm = self.vm
+        registers = vm.registers
+        fac = self.fac
+        b = registers['b']
+        if b == 0:
+            return {'a': 0, 'f': logic_flags(0, registers['f'])}, {}
+        fe, fd, fc, fx = vm.memory[fac:fac + 4]
+        c, d, e = registers['c'], registers['d'], registers['e']
+        if fx == 0:
+            return ({'a': 0, 'f': logic_flags(0, registers['f']), 'd': b, 'e': c},
+                    {fac: e, fac + 1: d, fac + 2: c, fac + 3: b})
+
+        # Line up the smaller operand with the larger, keeping the bits
+        # shifted out of it in an extension byte.
+        shift = fx - b
+        if shift < 0:
+            if shift <= -25:
+                return None
+            shift = -shift
+            fe, fd, fc, fx, e, d, c = e, d, c, b, fe, fd, fc
+        elif shift >= 25:
+            return {'a': shift, 'f': compare_flags(shift, 25, registers['f'])}, {}
+        fac_mantissa = ((fc | 0x80) << 16) | (fd << 8) | fe
+        sign = ((fc & 0x80) ^ 0x80) | ((fc | 0x80) >> 1)    # Top bit set for positive
+        window = ((((c | 0x80) << 16) | (d << 8) | e) << 8) >> shift
+
+        if (c ^ fc) & 0x80 == 0:
+            total = (fac_mantissa << 8) + window
+            if total > 0xffffffff:
+                fx += 1
+                if fx > 0xff:
+                    return None
+                total >>= 1
+            return self.rounded(fx, total >> 8, total & 0xff, sign)
+        total = (fac_mantissa << 8) - window
+        if total < 0:
+            total = -total
+            sign ^= 0xff
+        return self.normalized(fx, total, sign)
+
+
+    def fmult(self) -> Optional[Result]:
+        # FAC = FAC * BCDE
+        vm = self.vm
+        registers = vm.registers
+        fac = self.fac
+        fe, fd, fc, fx = vm.memory[fac:fac + 4]
+        if fx == 0:
+            return {'a': 0, 'f': logic_flags(0, registers['f'])}, {}
+        b, c, d, e = registers['b'], registers['c'], registers['d'], registers['e']
+        if b == 0:
+            return self.zero(self.fmult_entry + 7)
+        exp = fx + b - 0x80
+        if not 0 < exp <= 0xff:
+            return None
+        sign = self.product_sign(fc, c)
+
+        # The product of the mantissas, added up a bit at a time in a
+        # 32-bit window, dropping what's shifted out of it
+        multiplicand = ((c | 0x80) << 16) | (d << 8) | e
+        product = (multiplicand * (((fc | 0x80) << 16) | (fd << 8) | fe)) >> 16
+        result = self.normalized(exp, product, sign)
+        if result is not None:
+            result[1].update({self.multiplicand_hi: c | 0x80,
+                              self.multiplicand_lo: e, self.multiplicand_lo + 1: d})
+        return result
+
+
+    def fdiv(self) -> Optional[Result]:
+        # FAC = BCDE / FAC
+        vm = self.vm
+        registers = vm.registers
+        fac = self.fac
+        fe, fd, fc, fx = vm.memory[fac:fac + 4]
+        if fx == 0:
+            return None     # Division by zero error
+        b, c, d, e = registers['b'], registers['c'], registers['d'], registers['e']
+        if b == 0:
+            return self.zero(self.fdiv_entry + 9)
+        exp = b - fx + 0x7f
+        if not 0 < exp <= 0xff - 2:
+            return None
+        exp += 2
+        sign = self.product_sign(fc, c)
+
+        # Restoring division, a quotient bit at a time until its top bit is
+        # set, with the next bit for rounding
+        divisor = ((fc | 0x80) << 16) | (fd << 8) | fe
+        dividend = ((c | 0x80) << 16) | (d << 8) | e
+        quotient = 0
+        while True:
+            bit = 1 if dividend >= divisor else 0
+            if bit:
+                dividend -= divisor
+            if quotient & 0x800000:
+                break
+            quotient = (quotient << 1) | bit
+            dividend = (dividend << 1) & 0xffffffff
+            if quotient == 0:
+                exp -= 1
+                if exp == 0:
+                    return None
+        result = self.rounded(exp, quotient, bit << 7, sign)
+        if result is not None:
+            hi, mid, lo = self.divisor
+            result[1].update({hi: fc | 0x80, mid: fd, lo: fe, self.dividend_ext: dividend >> 24})
+        return result
+
+
+    ##
+    ## Shared tails of the routines
+    ##
+
+    def product_sign(self, fc: int, c: int) -> int:
+        # The byte FMULT and FDIV keep after the FAC, with the top bit set if
+        # the result is positive
+        return (((fc & 0x80) ^ 0x80) | ((fc | 0x80) >> 1)) ^ ((c & 0x80) | ((c | 0x80) >> 1))
+
+
+    def zero(self, hl: int) -> Result:
+        # Zero times or divided by anything
+        return ({'a': 0, 'f': logic_flags(0, self.vm.registers['f']), 'h': hl >> 8, 'l': hl & 0xff},
+                {self.fac + 3: 0})
+
+
+    def normalized(self, exp: int, window: int, sign: int) -> Optional[Result]:
+        # Shift a 32-bit result left until its top bit is set, then round.
+        if window == 0:
+            return None
+        while window < 0x80000000:
+            window <<= 1
+            exp -= 1
+        if exp <= 0:
+            return None
+        return self.rounded(exp, window >> 8, window & 0xff, sign)
+
+
+    def rounded(self, exp: int, mantissa: int, extension: int, sign: int) -> Optional[Result]:
+        # Round up if the top bit of the extension is set and store the
+        # result in the FAC, as the routines all finish. That leaves the
+        # exponent and high byte in BC and DE both.
+        if extension & 0x80:
+            mantissa += 1
+            if mantissa > 0xffffff:
+                mantissa = 0x800000
+                exp += 1
+                if exp > 0xff:
+                    return None
+        c = (sign & 0x80) ^ (mantissa >> 16)
+        d = (mantissa >> 8) & 0xff
+        e = mantissa & 0xff
+        fac = self.fac
+        registers = {'a': c, 'b': exp, 'c': c, 'd': exp, 'e': c,
+                     'h': (fac + 4) >> 8, 'l': (fac + 4) & 0xff,
+                     'f': logic_flags(c, self.vm.registers['f'])}
+        return registers, {fac: e, fac + 1: d, fac + 2: c, fac + 3: exp, fac + 4: sign}
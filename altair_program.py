@@ -0,0 +1,294 @@
+# This is free and unencumbered software released into the public domain.
+#
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a compiled
+# binary, for any purpose, commercial or non-commercial, and by any
+# means.
+#
+# In jurisdictions that recognize copyright laws, the author or authors
+# of this software dedicate any and all copyright interest in the
+# software to the public domain. We make this dedication for the benefit
+# of the public at large and to the detriment of our heirs and
+# successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to this
+# software under copyright law.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# For more information, please refer to <https://unlicense.org>
+
+"""Load BASIC programs straight into Altair BASIC's memory.
+
+Lines are tokenized as BASIC would tokenize them when typed, and stored
+the way BASIC stores them: each line is a link to the next line, the line
+number, the tokenized text and a 0, in order from the start of the program,
+and a 0 link ends the program."""
+
+
+from typing import Dict, List, Optional, Tuple
+
+from virtual8080 import Virtual8080
+
+
+# Where each BASIC keeps its program and the pointers past it (to the
+# variables, the arrays and the end of the arrays), and how it tokenizes.
+# 4K and 8K BASIC have a keyword table, with the first letter of each
+# keyword marked by the top bit, and tokens numbered from 80H in its order.
+# Extended BASIC also turns numbers into binary, so its own CRUNCH routine
+# is run instead, which leaves the line in a buffer.
+BASIC_PROGRAM_LAYOUTS: Dict[str, Dict[str, int]] = {
+    '4K BASIC': {'keywords': 0x0051, 'txttab': 0x011c, 'vartab': 0x016f,
+                 'arytab': 0x0171, 'strend': 0x0173},
+    '8K BASIC': {'keywords': 0x0073, 'txttab': 0x01d6, 'vartab': 0x024b,
+                 'arytab': 0x024d, 'strend': 0x024f},
+    'Extended BASIC': {'crunch': 0x0a66, 'crunch_buffer': 0x04c1, 'txttab': 0x04bf,
+                       'vartab': 0x075b, 'arytab': 0x075d, 'strend': 0x075f},
+}
+
+# Start of Extended BASIC's CRUNCH
+CRUNCH_SIGNATURE = bytes([0xaf, 0x32, 0x06, 0x07, 0x32, 0x05, 0x07, 0x01, 0x3b, 0x01, 0x11,
+                          0xc1, 0x04])
+
+MAX_LINE_NUMBER = 65529
+
+
+def word(vm: Virtual8080, addr: int) -> int:
+    return (vm.memory[addr + 1] << 8) | vm.memory[addr]
+
+
+def set_word(vm: Virtual8080, addr: int, value: int) -> None:
+    vm.memory[addr] = value & 0xff
+    vm.memory[addr + 1] = value >> 8
+
+
+def identify_basic(vm: Virtual8080) -> Optional[str]:
+    # Which BASIC is loaded, if it's one in BASIC_PROGRAM_LAYOUTS
+    for basic, layout in BASIC_PROGRAM_LAYOUTS.items():
+        if 'keywords' in layout:
+            if bytes(vm.memory[layout['keywords']:layout['keywords'] + 3]) == b'\xc5ND':
+                return basic
+        elif bytes(vm.memory[layout['crunch']:layout['crunch'] + len(CRUNCH_SIGNATURE)]) == CRUNCH_SIGNATURE:
+            return basic
+    return None
+
+
+def read_keywords(vm: Virtual8080, addr: int) -> List[bytes]:
+    # The table ends with 80H, an empty keyword
+    keywords: List[bytes] = []
+    while vm.memory[addr] != 0x80:
+        if vm.memory[addr] & 0x80:
+            keywords.append(b'')
+        keywords[-1] += bytes([vm.memory[addr] & 0x7f])
+        addr += 1
+    return keywords
+
+
+def edit_line(line: bytes, basic: str) -> Optional[bytes]:
+    # The line as BASIC reads it from the terminal, which ignores most
+    # control characters and drops anything past the end of its buffer.
+    # @ starts the line over and _ rubs out a character, as do ^U and DEL
+    # in 8K and Extended BASIC. None if the line has a character that does
+    # more than edit it, like ^C.
+    four_k = basic == '4K BASIC'
+    extended = basic == 'Extended BASIC'
+    kept = b'\a\t' if extended else b'' if four_k else b'\a'
+    out = bytearray()
+    for c in line:
+        c &= 0x7f
+        if c == 0x03 and not four_k or c == 0x01 and extended:
+            return None
+        elif c == 0x40 or (c == 0x15 and not four_k):
+            out.clear()
+        elif c == 0x5f or (c == 0x7f and not four_k):
+            del out[-1:]
+        elif (c < 0x20 and c not in kept) or (four_k and c >= 0x7d):
+            continue
+        elif len(out) < (254 if extended else 71):
+            out.append(c)
+    return bytes(out)
+
+
+def split_line_number(line: bytes, whitespace: bytes) -> Tuple[Optional[int], bytes]:
+    # The line number at the start of line, skipping whitespace as BASIC
+    # does, and the text after its last digit, or None and line if it
+    # doesn't start with one BASIC would take.
+    i = 0
+    while i < len(line) and line[i] in whitespace:
+        i += 1
+    if i == len(line) or not 0x30 <= line[i] <= 0x39:
+        return None, line
+    number = 0
+    end = i
+    while i < len(line) and (0x30 <= line[i] <= 0x39 or line[i] in whitespace):
+        if line[i] in whitespace:
+            i += 1
+            continue
+        number = number * 10 + line[i] - 0x30
+        if number > MAX_LINE_NUMBER:
+            return None, line
+        i += 1
+        end = i
+    return number, line[end:]
+
+
+def crunch(text: bytes, keywords: List[bytes], basic: str) -> bytes:
+    # Tokenize a line's text as 4K or 8K BASIC's CRUNCH does. Spaces are
+    # kept, strings are copied as they are, and so is the rest of a line
+    # after REM. 8K BASIC also copies DATA up to the next colon, turns ? into
+    # PRINT and capitalizes letters. 4K BASIC allows spaces inside every
+    # keyword, 8K BASIC only in GOTO.
+    eight_k = basic == '8K BASIC'
+    data_token = 0x80 + keywords.index(b'DATA')
+    rem_token = 0x80 + keywords.index(b'REM')
+    goto_token = 0x80 + keywords.index(b'GOTO')
+    print_token = 0x80 + keywords.index(b'PRINT')
+    out = bytearray()
+    in_data = False
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == 0x22:   # "
+            end = text.find(b'"', i + 1)
+            end = len(text) if end < 0 else end + 1
+            out += text[i:end]
+            i = end
+            continue
+
+        if c == 0x20 or (eight_k and (in_data or 0x30 <= c <= 0x3b)):
+            token = c
+            i += 1
+        elif eight_k and c == 0x3f:     # ?
+            token = print_token
+            i += 1
+        else:
+            if eight_k and 0x61 <= c <= 0x7a:
+                c &= 0x5f
+            token, i = c, i + 1
+            for n, keyword in enumerate(keywords):
+                if keyword[0] != c:
+                    continue
+                j = i - 1
+                for k in keyword[1:]:
+                    j += 1
+                    if not eight_k or n + 0x80 == goto_token:
+                        while j < len(text) and text[j] == 0x20:
+                            j += 1
+                    actual = text[j] if j < len(text) else 0
+                    if eight_k and actual >= 0x61:
+                        actual &= 0x5f
+                    if actual != k:
+                        break
+                else:
+                    token, i = 0x80 + n, j + 1
+                    break
+
+        out.append(token)
+        if eight_k and token == 0x3a:   # :
+            in_data = False
+        elif eight_k and token == data_token:
+            in_data = True
+        elif token == rem_token:
+            out += text[i:]
+            break
+    return bytes(out)
+
+
+def rom_crunch(vm: Virtual8080, layout: Dict[str, int], text: bytes) -> Optional[bytes]:
+    # Tokenize a line's text with BASIC's own CRUNCH, called with the text
+    # in free memory past the program. None if BASIC reports an error, as
+    # for a line number that's too big, which is taken back off the console.
+    # Memory is left as CRUNCH leaves it.
+    registers = dict(vm.registers)
+    output = vm.io.output_buffer
+    output_len = len(output)
+    addr = word(vm, layout['vartab']) + 0x100
+    vm.memory[addr:addr + len(text) + 1] = list(text) + [0]
+    sp = registers['sp'] - 2
+    set_word(vm, sp, addr)
+    vm.registers.update(h=addr >> 8, l=addr & 0xff, sp=sp, pc=layout['crunch'])
+    result = None
+    while len(output) == output_len:
+        if vm.registers['pc'] == addr and vm.registers['sp'] == sp + 2:
+            length = ((vm.registers['b'] << 8) | vm.registers['c']) - 5
+            start = layout['crunch_buffer']
+            result = bytes(vm.memory[start:start + length])
+            break
+        vm.execute()
+    del output[output_len:]
+    vm.registers.update(registers)
+    return result
+
+
+def tokenize_program(vm: Virtual8080, basic: str,
+                     source: bytes) -> Optional[Tuple[Dict[int, bytes], bytes]]:
+    # The tokenized text of each numbered line in source, and the direct
+    # lines after them, or None if a line can't be stored as typing it
+    # would. A direct line before a numbered one, such as NEW, has to run
+    # before the lines after it are stored, so that's None too. Running
+    # Extended BASIC's CRUNCH leaves its buffers changed.
+    layout = BASIC_PROGRAM_LAYOUTS[basic]
+    keywords = read_keywords(vm, layout['keywords']) if 'keywords' in layout else []
+    whitespace = b' \t' if basic == 'Extended BASIC' else b' '
+    lines: Dict[int, bytes] = {}
+    direct = b''
+    for line in source.replace(b'\r', b'').split(b'\n'):
+        edited = edit_line(line, basic)
+        if edited is None:
+            return None
+        number, text = split_line_number(edited, whitespace)
+        if number is None:
+            if line.strip(whitespace):
+                direct += line + b'\r'
+            continue
+        if len(direct) > 0:
+            return None
+        if basic == 'Extended BASIC':
+            # BASIC skips one space after the line number
+            crunched = rom_crunch(vm, layout, text[1:] if text.startswith(b' ') else text)
+            if crunched is None:
+                return None
+        else:
+            crunched = crunch(text.lstrip(b' '), keywords, basic)
+        if crunched.lstrip(whitespace):
+            lines[number] = crunched
+        else:
+            lines.pop(number, None)     # A bare line number deletes the line
+    return lines, direct
+
+
+def load_program(vm: Virtual8080, source: bytes) -> Optional[bytes]:
+    # Store the numbered lines of source as BASIC's program, and return the
+    # other lines, such as RUN, to be typed in. BASIC must be waiting at its
+    # prompt with no program. Returns None, and leaves memory alone, if the
+    # loaded BASIC isn't one we know, a line can't be stored as typing it
+    # would, or the program doesn't fit.
+    basic = identify_basic(vm)
+    if basic is None:
+        return None
+    layout = BASIC_PROGRAM_LAYOUTS[basic]
+    memory = bytes(vm.memory)
+    tokenized = tokenize_program(vm, basic, source)
+    vm.memory[:] = memory
+    if tokenized is None:
+        return None
+    lines, direct = tokenized
+
+    start = word(vm, layout['txttab'])
+    image = bytearray()
+    for number in sorted(lines):
+        link = start + len(image) + 4 + len(lines[number]) + 1
+        image += bytes([link & 0xff, link >> 8, number & 0xff, number >> 8]) + lines[number] + b'\0'
+    image += b'\0\0'
+    end = start + len(image)
+    if end + 0x100 > vm.registers['sp']:
+        return None
+    vm.memory[start:end] = image
+    for pointer in ('vartab', 'arytab', 'strend'):
+        set_word(vm, layout[pointer], end)
+    return direct
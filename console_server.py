@@ -0,0 +1,333 @@
+# This is free and unencumbered software released into the public domain.
+#
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a compiled
+# binary, for any purpose, commercial or non-commercial, and by any
+# means.
+#
+# In jurisdictions that recognize copyright laws, the author or authors
+# of this software dedicate any and all copyright interest in the
+# software to the public domain. We make this dedication for the benefit
+# of the public at large and to the detriment of our heirs and
+# successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to this
+# software under copyright law.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# For more information, please refer to <https://unlicense.org>
+
+"""A telnet server giving each connection its own machine.
+
+Every session runs in one asyncio event loop, with a Scheduler giving the
+machines turns. A machine waiting for a key is parked until one arrives, so
+it costs nothing but its memory."""
+
+
+import argparse
+import asyncio
+import io
+import time
+import traceback
+from typing import Callable, List, Optional
+
+from scheduler import ScheduledVM, Scheduler
+from virtual8080 import Virtual8080
+
+
+IAC, SB, SE, WILL, WONT, DO, DONT = 255, 250, 240, 251, 252, 253, 254
+TELNET_ECHO, TELNET_SGA = 1, 3
+
+
+class TelnetFilter:
+    """Takes telnet commands out of what a client sends, and turns its line
+    endings (CR LF, CR NUL or LF) into CR."""
+
+    def __init__(self):
+        self.command: bytes = b''   # Command being received
+        self.after_cr: bool = False
+
+    def feed(self, data: bytes) -> bytes:
+        keys = bytearray()
+        for ch in data:
+            if len(self.command) > 0:
+                self.command += bytes([ch])
+                if self.command == bytes([IAC, IAC]):
+                    keys.append(IAC)
+                elif self.command[1] == SB:
+                    # Subnegotiation runs until IAC SE
+                    if not self.command.endswith(bytes([IAC, SE])):
+                        continue
+                elif self.command[1] in (WILL, WONT, DO, DONT) and len(self.command) < 3:
+                    continue
+                self.command = b''
+            elif ch == IAC:
+                self.command = bytes([ch])
+            elif self.after_cr and ch in (0, 10):
+                self.after_cr = False
+            else:
+                self.after_cr = ch == 13
+                keys.append(13 if ch == 10 else ch)
+        return bytes(keys)
+
+
+class ServerSession:
+    """A machine for one connection, with what's needed to put it on the
+    network: keys() turns what the user types into what the machine expects,
+    and screen() turns the machine's output into what their terminal shows."""
+
+    def __init__(self,
+                 vm: Virtual8080,
+                 keys: Callable[[bytes], bytes] = lambda data: data,
+                 screen: Callable[[bytes], bytes] = lambda data: data,
+                 close: Callable[[], None] = lambda: None):
+        self.vm: Virtual8080 = vm
+        self.keys = keys
+        self.screen = screen
+        self.close = close
+
+
+def basic_session(program_file: str, init_str: str, **options) -> ServerSession:
+    # BASIC, with its questions at start answered with init_str. options are
+    # passed on to start_basic().
+    from altair_basic import start_basic
+
+    vm = start_basic(program_file, init_str, **options)
+    # Enter sends CR and a NUL, and ESC ^C to break, as at the console
+    return ServerSession(vm, keys=lambda data: data.replace(b'\r', b'\r\x00').replace(b'\x1b', b'\x03'))
+
+
+def cpm_session(disk_images: List[Optional[str]], **machine_options) -> ServerSession:
+    # CP/M, with its screen's ADM-3A control codes translated to ANSI.
+    # Images that aren't given any other way are used as overlay:IMAGE, so
+    # each session's writes stay its own. machine_options are passed on to
+    # CPM_Machine.
+    from cpm import CPM_Machine
+    from cpm_console import CPM_Console
+
+    disk_images = [image if image is None or ':' in image else 'overlay:' + image
+                   for image in disk_images]
+    vm = Virtual8080()
+    vm.io = CPM_Machine(vm, disk_images, **machine_options)
+    vm.halted = False
+    vm.io.warp()
+    terminal = CPM_Console(out=io.BytesIO())
+    terminal.ansi = True
+
+    def screen(data: bytes) -> bytes:
+        for ch in data:
+            terminal.putch(ch)
+        text = bytes(terminal.out_buffer)
+        terminal.out_buffer.clear()
+        return text
+    return ServerSession(vm, keys=lambda data: data.replace(b'\x7f', b'\x08'),
+                         screen=screen, close=vm.io.close)
+
+
+class ConsoleServer:
+
+    input_high_water = 4096         # Stop reading from a client with this much typed ahead
+    output_high_water = 65536       # Pause a machine with this much output unsent
+
+    def __init__(self,
+                 new_session: Callable[[], ServerSession],
+                 max_sessions: int = 32,
+                 max_steps: Optional[int] = None,
+                 quota: Optional[int] = None,
+                 idle_timeout: Optional[float] = None):
+        # Each session stops after max_steps instructions, or idle_timeout
+        # seconds waiting for a key, and runs at most quota instructions a
+        # second, if given.
+        self.new_session = new_session
+        self.max_sessions: int = max_sessions
+        self.max_steps: Optional[int] = max_steps
+        self.quota: Optional[int] = quota
+        self.idle_timeout: Optional[float] = idle_timeout
+        self.sessions: List[ServerSession] = []
+        self.starting: int = 0      # Sessions being made
+        self.scheduler: Scheduler = Scheduler()
+
+
+    async def serve(self, host: str, port: int) -> None:
+        server = await asyncio.start_server(self.handle, host, port)
+        scheduler_task = asyncio.ensure_future(self.scheduler.run_async())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            scheduler_task.cancel()
+
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        writer.transport.set_write_buffer_limits(high=self.output_high_water)
+        if len(self.sessions) + self.starting >= self.max_sessions:
+            writer.write(b'Too many sessions, try again later.\r\n')
+            await self.hang_up(writer)
+            return
+        # Ask telnet clients to send each key as it's typed, and not to echo
+        writer.write(bytes([IAC, WILL, TELNET_ECHO, IAC, WILL, TELNET_SGA]))
+        # Making a session can mean booting it to the prompt, so it's done
+        # on another thread while the other sessions go on
+        self.starting += 1
+        try:
+            session = await asyncio.get_event_loop().run_in_executor(None, self.new_session)
+        except Exception:
+            traceback.print_exc()
+            writer.write(b'Could not start a session.\r\n')
+            await self.hang_up(writer)
+            return
+        finally:
+            self.starting -= 1
+        self.sessions.append(session)
+        try:
+            await self.run(session, reader, writer)
+        except ConnectionError:
+            pass
+        finally:
+            self.sessions.remove(session)
+            session.close()
+            await self.hang_up(writer)
+
+
+    async def run(self, session: ServerSession,
+                  reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # The scheduler runs the machine; this waits for it to finish, the
+        # client to hang up, or the session to time out.
+        vm = session.vm
+        input_queue = vm.io.input_queue
+        finished: asyncio.Future = asyncio.get_event_loop().create_future()
+
+        def on_slice(machine: ScheduledVM, reason: str) -> None:
+            output = vm.io.drain_output()
+            if len(output) > 0:
+                writer.write(session.screen(output))
+            if reason in ('halted', 'done'):
+                if not finished.done():
+                    finished.set_result(reason)
+            elif writer.transport.get_write_buffer_size() > self.output_high_water:
+                self.scheduler.pause(machine)
+                asyncio.ensure_future(self.resume_after_drain(machine, writer))
+
+        machine = self.scheduler.add(vm, str(writer.get_extra_info('peername')),
+                                     quota=self.quota, budget=self.max_steps,
+                                     on_slice=on_slice)
+
+        async def read_keys() -> None:
+            telnet = TelnetFilter()
+            while True:
+                data = await reader.read(4096)
+                if len(data) == 0:
+                    break
+                input_queue.push(session.keys(telnet.feed(data)))
+                self.scheduler.wake(machine)
+                while len(input_queue) > self.input_high_water:
+                    await asyncio.sleep(0.05)
+
+        reader_task = asyncio.ensure_future(read_keys())
+        try:
+            while not finished.done() and not reader_task.done():
+                timeout = self.idle_timeout
+                if timeout is not None and machine.state == 'idle':
+                    timeout -= time.monotonic() - machine.idle_since
+                    if timeout <= 0:
+                        writer.write(b'\r\nSession timed out.\r\n')
+                        break
+                await asyncio.wait([finished, reader_task], timeout=timeout,
+                                   return_when=asyncio.FIRST_COMPLETED)
+            if finished.done() and finished.result() == 'done':
+                writer.write(b'\r\nSession instruction budget used up.\r\n')
+        finally:
+            reader_task.cancel()
+            self.scheduler.remove(machine)
+
+
+    async def resume_after_drain(self, machine: ScheduledVM, writer: asyncio.StreamWriter) -> None:
+        # Paused machines go on once their client has caught up
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        self.scheduler.resume(machine)
+
+
+    async def hang_up(self, writer: asyncio.StreamWriter) -> None:
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on')
+    parser.add_argument('--port', type=int, default=8023,
+                        help='port to listen on')
+    basic_ver = parser.add_mutually_exclusive_group()
+    basic_ver.add_argument('-4', '--4k', action='store_const', dest='version',
+                           const=('altair_basic_bin/4kbas40.bin', '\r\rY\r'),
+                           help='serve 4K BASIC')
+    basic_ver.add_argument('-8', '--8k', action='store_const', dest='version',
+                           const=('altair_basic_bin/8kbas.bin', '\r\rY\r'),
+                           help='serve 8K BASIC (the default)')
+    basic_ver.add_argument('-e', '--extended', action='store_const', dest='version',
+                           const=('altair_basic_bin/exbas.bin', '\rY\r'),
+                           help='serve Extended BASIC')
+    parser.add_argument('--memory-size', type=int, default=65529,
+                        help="BASIC's answer to MEMORY SIZE?")
+    parser.add_argument('--fast-math', action='store_true',
+                        help="run BASIC's floating point arithmetic in Python")
+    for d in range(ord('a'), ord('a') + 16):
+        parser.add_argument(f'-d{chr(d)}', f'--drive_{chr(d)}', type=str, default=None,
+                            help=f'serve CP/M, with this disk image for drive {chr(d)}')
+    parser.add_argument('--fast-bios', action='store_true',
+                        help="run the CP/M 2.2 BIOS's console and disk routines in Python")
+    parser.add_argument('--warp-until', metavar='PROMPT', nargs='?', const='', default=None,
+                        help='start each session by running flat out until the machine '
+                             'shows PROMPT (OK for BASIC, A> for CP/M, if not given)')
+    parser.add_argument('--snapshot', metavar='FILE', default=None,
+                        help='start sessions from the snapshot in FILE, made at the prompt '
+                             'by the first')
+    parser.add_argument('--max-sessions', type=int, default=32,
+                        help='most sessions at once')
+    parser.add_argument('--max-steps', type=int, default=None,
+                        help='end a session after this many instructions')
+    parser.add_argument('--quota', type=int, default=None,
+                        help='run each session at most this many instructions a second')
+    parser.add_argument('--idle-timeout', type=float, default=None,
+                        help='end a session after this many seconds waiting for a key')
+    parser.set_defaults(version=('altair_basic_bin/8kbas.bin', '\r\rY\r'))
+    args = parser.parse_args()
+
+    disk_images = [getattr(args, f'drive_{chr(d)}')
+                   for d in range(ord('a'), ord('a') + 16)]
+    cpm = any(image is not None for image in disk_images)
+    warp_prompt = args.warp_until
+    if args.snapshot is not None and warp_prompt is None:
+        warp_prompt = ''
+    if warp_prompt == '':
+        warp_prompt = 'A>' if cpm else 'OK'
+
+    def new_session() -> ServerSession:
+        if cpm:
+            return cpm_session(disk_images, bios_hooks=args.fast_bios,
+                               warp_prompt=warp_prompt, snapshot_file=args.snapshot)
+        return basic_session(args.version[0], str(args.memory_size) + args.version[1],
+                             fast_math=args.fast_math, warp_prompt=warp_prompt,
+                             snapshot_file=args.snapshot)
+
+    server = ConsoleServer(new_session, max_sessions=args.max_sessions,
+                           max_steps=args.max_steps, quota=args.quota,
+                           idle_timeout=args.idle_timeout)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -29,49 +29,120 @@ Emulated machine has 16 8" 250 KB floppy disk drives and an ADM-3A terminal."""
 
 
 import argparse
-from datetime import date, datetime, timedelta
 import os
-import time
-from typing import Dict, List, Optional, Tuple
-
-os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
-import pygame
-from pygame.constants import KEYDOWN, KMOD_CTRL, KMOD_SHIFT, QUIT
-from pygame.freetype import Font
-from pygame.rect import Rect
-from pygame.surface import Surface
-
-from virtual8080 import Virtual8080
-from virtual_device import VirtualDevice
-from cpm_disk import CPM_Disk
-
-
-class CPM_Machine(VirtualDevice):
-
-    def __init__(self, vm: Virtual8080, disk_images: List[str] = []):
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from virtual8080 import Virtual8080, parity
+from virtual_device import ConsoleDevice
+from cpm_disk import (CPM_Disk, DiskFlusher, DISK_FORMATS, OverlayDisk, RamDisk,
+                      RECORD_SIZE, make_skew_table)
+from cpm_hostdir import HostDirDisk
+from warp import file_fingerprint, load_snapshot, save_snapshot, warp_until
+
+
+# BIOS jump table entries that can be run in Python, with the code in
+# pyemu-cpm-cbios.asm that the entry must jump to (None matches any byte).
+BIOS_FAST_PATHS: List[Tuple[int, List[Optional[int]], str]] = [
+    (2, [0xdb, 0x00, 0xc9], 'fast_const'),
+    (3, [0xdb, 0x01, 0xe6, 0x7f, 0xc9], 'fast_conin'),
+    (4, [0x79, 0xd3, 0x01, 0xc9], 'fast_conout'),
+    (9, [0x21, 0x00, 0x00, 0x79, 0xfe, 0x10, 0xd0, 0xd3, 0xfa, 0xdb, 0xf5, 0xb7,
+         0xca, None, None, 0x3c, 0xc0, 0x79, 0x6f, 0x26, 0x00, 0x29, 0x29, 0x29,
+         0x29, 0x11, None, None, 0x19, 0xc9], 'fast_seldsk'),
+    (10, [0x79, 0xd3, 0xfb, 0xc9], 'fast_settrk'),
+    (11, [0x79, 0xd3, 0xfc, 0xc9], 'fast_setsec'),
+    (12, [0x79, 0xd3, 0xfe, 0x78, 0xd3, 0xfd, 0xc9], 'fast_setdma'),
+    (13, [0x3e, 0x00, 0xd3, 0xf9, 0xdb, 0xf9, 0xc9], 'fast_read'),
+    (14, [0x3e, 0x01, 0xd3, 0xf9, 0xdb, 0xf9, 0xc9], 'fast_write'),
+]
+
+
+def parse_size(size: str) -> int:
+    # '4M' -> 4194304, '250K' -> 256000, '1000' -> 1000
+    multiplier = {'K': 1024, 'M': 1024 * 1024}.get(size[-1:].upper(), 1)
+    if multiplier > 1:
+        size = size[:-1]
+    return int(size) * multiplier
+
+
+class CPM_Machine(ConsoleDevice):
+
+    def __init__(self,
+                 vm: Virtual8080,
+                 disk_images: List[str] = [],
+                 disk_formats: List[str] = [],
+                 flush_policy: str = 'immediate',
+                 flush_interval: float = 1.0,
+                 fsync: bool = False,
+                 bios_hooks: bool = False,
+                 warp_prompt: Optional[str] = None,
+                 snapshot_file: Optional[str] = None):
+        super().__init__()
         self.vm: Virtual8080 = vm
 
-        self.input_buffer: bytes = b''
-        self.output_char: int = -1
-
         self.bank_size: int = 0xF0 << 8
         self.current_bank: int = 0
-        self.memory_banks: Dict[int, List[int]] = {self.current_bank: [0 for _ in range(self.bank_size)]}
+        # Banks other than the selected one; each is made when first used
+        self.memory_banks: Dict[int, bytearray] = {}
 
         self.dma_bank: int = self.current_bank
         self.dma_addr: int = 0
         self.disk_controller_error: int = 0
+        self.sector_count: int = 1      # Sectors moved by a multi-sector command; 0 = rest of track
+        self.interleave: int = 0        # Skew applied by multi-sector commands; 0 = none
+        # Run the BIOS's console and disk routines in Python, once CP/M has
+        # started and they've been checked against BIOS_FAST_PATHS
+        self.bios_hooks: bool = bios_hooks
+        self.bios_hooks_checked: bool = False
+
+        # Run flat out until CP/M shows warp_prompt, or start from
+        # snapshot_file, made at the prompt the first time.
+        self.warp_prompt: Optional[str] = warp_prompt
+        self.snapshot_file: Optional[str] = snapshot_file
 
         self.cpm_epoch = datetime(1977, 12, 31)
         self.clock_delta: timedelta = timedelta(days=10227)  # 28 years ago
 
         self.current_drive: int = 0
         self.drive_status: List[Dict[str, int]] = [{'track': 0, 'sector': 0} for _ in range(16)]
+        # Images are opened when their drive is first used.
+        self.disk_specs: List[Optional[Tuple[str, str]]] = [None for _ in range(16)]
         self.disk_image: List[Optional[CPM_Disk]] = [None for _ in range(16)]
+        self.open_disks: List[CPM_Disk] = []
+        # Drives whose format the BIOS has read from port 0xf5. Only a BIOS
+        # that does that has disk parameters for anything but the floppy.
+        self.formats_read: Set[int] = set()
         for i, fn in enumerate(disk_images):
             if fn is not None:
-                self.drive_status[i] = {'track': 0, 'sector': 0}
-                self.disk_image[i] = CPM_Disk(fn, 128, 26, 77, 1, write_protect=False)
+                disk_format = 'ibm-3740'
+                if i < len(disk_formats) and disk_formats[i] is not None:
+                    disk_format = disk_formats[i]
+                elif fn.startswith('ram:'):
+                    # ram:SIZE[,DUMP] is a floppy in memory, the only format
+                    # the shipped BIOSes can use, so SIZE can't be more
+                    sector_size, sectors_per_track, num_tracks, _ = DISK_FORMATS[disk_format]
+                    if (parse_size(fn[len('ram:'):].partition(',')[0])
+                            > sector_size * sectors_per_track * num_tracks):
+                        raise ValueError('%s: RAM disks are 250K floppies' % fn)
+                if disk_format not in DISK_FORMATS:
+                    raise ValueError(disk_format)
+                image_file = fn
+                if fn.startswith('overlay:'):
+                    image_file = fn[len('overlay:'):].partition(',')[0]
+                if fn.startswith('dir:'):
+                    if not os.path.isdir(fn[len('dir:'):]):
+                        raise NotADirectoryError(fn[len('dir:'):])
+                elif not fn.startswith('ram:') and not os.path.isfile(image_file):
+                    raise FileNotFoundError(image_file)
+                self.disk_specs[i] = (fn, disk_format)
+        self.flush_policy: str = flush_policy
+        self.fsync: bool = fsync
+        self.disks_dirty: bool = False
+        self.flusher: Optional[DiskFlusher] = None
+        if flush_policy == 'background':
+            self.flusher = DiskFlusher(self.open_disks, flush_interval)
+            self.flusher.start()
 
         boot_sector = self.read_disk(0, 0, 1)
         self.vm.load(boot_sector)
@@ -81,14 +152,180 @@ class CPM_Machine(VirtualDevice):
             if bank_num == self.current_bank:
                 return
             if bank_num not in self.memory_banks:
-                self.memory_banks[bank_num] = [0 for _ in range(self.bank_size)]
+                self.memory_banks[bank_num] = bytearray(self.bank_size)
             self.memory_banks[self.current_bank] = self.vm.memory[:self.bank_size]
             self.vm.memory[:self.bank_size] = self.memory_banks[bank_num]
             self.current_bank = bank_num
 
 
-    def read_disk(self, drive_num: int, track: int, sector: int) -> bytes:
+    def warp(self) -> None:
+        # Called by the front end before it starts running the machine
+        if self.snapshot_file is not None:
+            device = load_snapshot(self.snapshot_file, self.snapshot_key(), self.vm)
+            if device is not None:
+                self.restore_state(device)
+                return
+        if self.warp_prompt is None:
+            return
+        if warp_until(self.vm, self.warp_prompt.encode('ascii')) and self.snapshot_file is not None:
+            self.flush_disks()
+            save_snapshot(self.snapshot_file, self.snapshot_key(), self.vm,
+                          bytes(self.output_buffer), self.save_state())
+
+
+    def snapshot_key(self) -> List:
+        # The drives and what's on them, so a snapshot isn't used with
+        # different disks than it was made with, whose directories CP/M may
+        # have read already.
+        key: List = [self.warp_prompt]
+        for spec in self.disk_specs:
+            if spec is None:
+                key.append(None)
+                continue
+            image_file, disk_format = spec
+            files = [image_file]
+            if image_file.startswith('overlay:'):
+                files = image_file[len('overlay:'):].split(',')
+            elif image_file.startswith('dir:'):
+                files = [image_file[len('dir:'):]]
+            elif image_file.startswith('ram:'):
+                files = image_file[len('ram:'):].split(',')[1:]
+            key.append([image_file, disk_format] + [file_fingerprint(name) for name in files])
+        return key
+
+
+    def save_state(self) -> Dict:
+        return {
+            'memory_banks': {str(bank): bytes(memory).hex()
+                             for bank, memory in self.memory_banks.items()
+                             if bank != self.current_bank},
+            'current_bank': self.current_bank,
+            'dma_bank': self.dma_bank,
+            'dma_addr': self.dma_addr,
+            'disk_controller_error': self.disk_controller_error,
+            'sector_count': self.sector_count,
+            'interleave': self.interleave,
+            'current_drive': self.current_drive,
+            'drive_status': self.drive_status,
+            'formats_read': sorted(self.formats_read),
+        }
+
+
+    def restore_state(self, state: Dict) -> None:
+        # The selected bank's banked memory is in vm.memory
+        self.memory_banks = {int(bank): bytearray.fromhex(memory)
+                             for bank, memory in state['memory_banks'].items()}
+        self.current_bank = state['current_bank']
+        self.memory_banks[self.current_bank] = self.vm.memory[:self.bank_size]
+        for name in ('dma_bank', 'dma_addr', 'disk_controller_error', 'sector_count',
+                     'interleave', 'current_drive', 'drive_status'):
+            setattr(self, name, state[name])
+        self.formats_read = set(state.get('formats_read', []))
+
+
+    def bank_memory(self, bank_num: int) -> bytearray:
+        # Where the banked memory of bank_num is kept while it's selected or not.
+        if bank_num == self.current_bank:
+            return self.vm.memory
+        if bank_num not in self.memory_banks:
+            self.memory_banks[bank_num] = bytearray(self.bank_size)
+        return self.memory_banks[bank_num]
+
+
+    def dma_store(self, data: memoryview) -> None:
+        # Copy data to [dma] in the DMA bank, without switching banks.
+        addr = self.dma_addr
+        data = data[:65536 - addr]
+        banked = max(0, min(len(data), self.bank_size - addr))
+        if banked > 0:
+            self.bank_memory(self.dma_bank)[addr:addr + banked] = data[:banked]
+        if banked < len(data):
+            self.vm.memory[addr + banked:addr + len(data)] = data[banked:]
+
+
+    def dma_load(self, length: int) -> bytes:
+        # Copy length bytes from [dma] in the DMA bank, without switching banks.
+        addr = self.dma_addr
+        length = min(length, 65536 - addr)
+        banked = max(0, min(length, self.bank_size - addr))
+        return (bytes(self.bank_memory(self.dma_bank)[addr:addr + banked])
+                + bytes(self.vm.memory[addr + banked:addr + length]))
+
+
+    def disk(self, drive_num: int) -> Optional[CPM_Disk]:
+        # The drive's disk, opening its image on first use.
+        if drive_num >= len(self.disk_image):
+            return None
         drive = self.disk_image[drive_num]
+        spec = self.disk_specs[drive_num]
+        if drive is None and spec is not None:
+            image_file, disk_format = spec
+            if image_file.startswith('overlay:'):
+                # overlay:BASE keeps writes in memory, overlay:BASE,DELTA in a file
+                base_file, _, delta_file = image_file[len('overlay:'):].partition(',')
+                drive = OverlayDisk(base_file, *DISK_FORMATS[disk_format],
+                                    delta_file=delta_file or None,
+                                    flush_policy=self.flush_policy, fsync=self.fsync)
+            elif image_file.startswith('dir:'):
+                drive = HostDirDisk(image_file[len('dir:'):], disk_format,
+                                    flush_policy=self.flush_policy, fsync=self.fsync)
+            elif image_file.startswith('ram:'):
+                dump_file = image_file[len('ram:'):].partition(',')[2]
+                drive = RamDisk(*DISK_FORMATS[disk_format], dump_file=dump_file or None)
+            else:
+                drive = CPM_Disk(image_file, *DISK_FORMATS[disk_format], write_protect=False,
+                                 flush_policy=self.flush_policy, fsync=self.fsync)
+            self.disk_image[drive_num] = drive
+            self.open_disks.append(drive)
+        return drive
+
+
+    def transfer_disk(self) -> Optional[CPM_Disk]:
+        # The current drive's disk, if sectors can be moved to and from it.
+        # A BIOS that hasn't read the drive's format takes it for a floppy
+        # and has room for 128 bytes, so bigger sectors would overrun its
+        # buffer.
+        drive = self.disk(self.current_drive)
+        if drive is None:
+            return None
+        if drive.sector_size != RECORD_SIZE and self.current_drive not in self.formats_read:
+            return None
+        return drive
+
+
+    def transfer_sectors(self, write: bool) -> int:
+        # Move sector_count sectors (or the rest of the track) starting at the
+        # current track/sector, continuing onto the next track as needed. The
+        # track, sector and DMA registers are left just past the last sector.
+        # Returns the controller status.
+        drive = self.transfer_disk()
+        if drive is None:
+            return 0xff
+        status = self.drive_status[self.current_drive]
+        spt = drive.sectors_per_track
+        skew_table = make_skew_table(spt, self.interleave) if self.interleave > 1 else None
+        count = self.sector_count
+        if count == 0:
+            count = spt - status['sector'] + 1
+        for _ in range(count):
+            if not 1 <= status['sector'] <= spt or status['track'] >= drive.num_tracks:
+                return 0xff
+            sector = status['sector'] if skew_table is None else skew_table[status['sector'] - 1]
+            if write:
+                self.write_disk(self.current_drive, status['track'], sector,
+                                self.dma_load(drive.sector_size))
+            else:
+                self.dma_store(self.read_disk(self.current_drive, status['track'], sector))
+            self.dma_addr = (self.dma_addr + drive.sector_size) & 0xffff
+            status['sector'] += 1
+            if status['sector'] > spt:
+                status['sector'] = 1
+                status['track'] += 1
+        return 0x00
+
+
+    def read_disk(self, drive_num: int, track: int, sector: int) -> memoryview:
+        drive = self.disk(drive_num)
         if drive is not None:
             return drive.get_sector(track, sector)
         else:
@@ -96,28 +333,227 @@ class CPM_Machine(VirtualDevice):
 
 
     def write_disk(self, drive_num: int, track: int, sector: int, sector_data: bytes) -> None:
-        drive = self.disk_image[drive_num]
+        drive = self.disk(drive_num)
         if drive is not None:
             drive.set_sector(track, sector, sector_data)
-            drive.save_image()
+            self.disks_dirty = True
+
+
+    def flush_disks(self) -> None:
+        for drive in self.open_disks:
+            drive.flush()
+        self.disks_dirty = False
+
+
+    def idle(self) -> None:
+        # CP/M is waiting for a key
+        if self.disks_dirty and self.flush_policy == 'idle':
+            self.flush_disks()
+
+
+    def drive_format(self) -> int:
+        # Format of the current drive, as an index into DISK_FORMATS
+        spec = self.disk_specs[self.current_drive] if self.current_drive < 16 else None
+        if spec is None:
+            return 0xff
+        self.formats_read.add(self.current_drive)
+        return list(DISK_FORMATS).index(spec[1])
+
+
+    def disk_command(self, command: int) -> None:
+        # A host file that can't be read or written, such as a read-only
+        # file on a dir: drive, is a disk error for CP/M to report.
+        try:
+            self.run_disk_command(command)
+        except OSError:
+            self.disk_controller_error = 0xff  # Error
+
+
+    def run_disk_command(self, command: int) -> None:
+        if command == 0:
+            # Read current drive/track/sector into [dma]
+            if self.transfer_disk() is not None:
+                self.dma_store(self.read_disk(self.current_drive,
+                                              self.drive_status[self.current_drive]['track'],
+                                              self.drive_status[self.current_drive]['sector']))
+                self.disk_controller_error = 0x00  # OK
+            else:
+                self.disk_controller_error = 0xff  # Error
+        elif command == 1:
+            # Write [dma] to current drive/track/sector
+            drive = self.transfer_disk()
+            if drive is not None:
+                self.write_disk(self.current_drive,
+                                self.drive_status[self.current_drive]['track'],
+                                self.drive_status[self.current_drive]['sector'],
+                                self.dma_load(drive.sector_size))
+                self.disk_controller_error = 0x00  # OK
+            else:
+                self.disk_controller_error = 0xff  # Error
+        elif command == 2:
+            # Read sector_count sectors from current drive/track/sector into [dma]
+            self.disk_controller_error = self.transfer_sectors(write=False)
+        elif command == 3:
+            # Write sector_count sectors from [dma] to current drive/track/sector
+            self.disk_controller_error = self.transfer_sectors(write=True)
+        elif command in (4, 5):
+            # Commit (4) or discard (5) the current drive's overlay
+            drive = self.disk(self.current_drive)
+            if isinstance(drive, OverlayDisk):
+                if command == 4:
+                    drive.commit()
+                else:
+                    drive.discard()
+                self.disk_controller_error = 0x00  # OK
+            else:
+                self.disk_controller_error = 0xff  # Error
+        else:
+            raise Exception
+
+
+    def install_bios_hooks(self) -> None:
+        # Hook the BIOS entries whose code is exactly what the fast paths
+        # stand in for. Any other BIOS, such as CP/M 3's, is left alone.
+        self.bios_hooks_checked = True
+        memory = self.vm.memory
+        bios = ((memory[0x0002] << 8) | memory[0x0001]) - 3
+        if memory[0x0000] != 0xc3 or bios < 0:
+            return
+        for entry, signature, name in BIOS_FAST_PATHS:
+            addr = bios + 3 * entry
+            if memory[addr] != 0xc3:
+                continue
+            routine = (memory[addr + 2] << 8) | memory[addr + 1]
+            code = memory[routine:routine + len(signature)]
+            if all(expected is None or expected == actual
+                   for expected, actual in zip(signature, code)) and len(code) == len(signature):
+                fast_path = getattr(self, name)
+                self.vm.pc_hooks[addr] = lambda fast_path=fast_path, routine=routine: fast_path(routine)
+
+
+    ##
+    ## BIOS fast paths, leaving the registers, flags and devices as the
+    ## routines in pyemu-cpm-cbios.asm would, then returning
+    ##
+
+    def fast_const(self, routine: int) -> None:
+        self.vm.registers['a'] = 0xff if self.input_queue.ready() else 0x00
+        self.vm.return_from_sub()
+
+
+    def fast_conin(self, routine: int) -> None:
+        c = self.input_queue.pop()
+        if c is None:
+            return      # Wait in the BIOS's own code
+        vm = self.vm
+        result = c & 0x7f
+        vm.registers['a'] = result
+        vm.set_flag_sign(0)
+        vm.set_flag_zero(1 if result == 0 else 0)
+        vm.set_flag_auxcarry(1)
+        vm.set_flag_parity(parity(result))
+        vm.set_flag_carry(0)
+        vm.return_from_sub()
+
+
+    def fast_conout(self, routine: int) -> None:
+        c = self.vm.registers['c']
+        self.vm.registers['a'] = c
+        self.put_output(c)
+        self.vm.return_from_sub()
+
+
+    def fast_seldsk(self, routine: int) -> None:
+        vm = self.vm
+        registers = vm.registers
+        registers['h'] = registers['l'] = 0
+        c = registers['c']
+        registers['a'] = c
+        result = (c - 16) % 256     # cpi 16
+        vm.set_flag_sign(result >> 7)
+        vm.set_flag_zero(1 if result == 0 else 0)
+        vm.set_flag_auxcarry(1)
+        vm.set_flag_parity(parity(result))
+        vm.set_flag_carry(1 if c < 16 else 0)
+        if c >= 16:
+            vm.return_from_sub()
+            return
+        self.current_drive = c
+        registers['a'] = self.drive_format()
+        vm.op[0xb7](vm)             # ora a
+        if registers['a'] != 0:
+            vm.op[0x3c](vm)         # inr a
+            if registers['a'] != 0:
+                vm.return_from_sub()
+                return
+        registers['a'] = registers['l'] = c
+        for _ in range(4):
+            vm.op[0x29](vm)         # dad h
+        registers['d'] = vm.memory[routine + 27]
+        registers['e'] = vm.memory[routine + 26]
+        vm.op[0x19](vm)             # dad d
+        vm.return_from_sub()
+
+
+    def fast_settrk(self, routine: int) -> None:
+        c = self.vm.registers['c']
+        self.vm.registers['a'] = c
+        status = self.drive_status[self.current_drive]
+        status['track'] = (status['track'] & 0xff00) | c
+        self.vm.return_from_sub()
+
+
+    def fast_setsec(self, routine: int) -> None:
+        c = self.vm.registers['c']
+        self.vm.registers['a'] = c
+        self.drive_status[self.current_drive]['sector'] = c
+        self.vm.return_from_sub()
+
+
+    def fast_setdma(self, routine: int) -> None:
+        registers = self.vm.registers
+        registers['a'] = registers['b']
+        self.dma_addr = (registers['b'] << 8) | registers['c']
+        self.vm.return_from_sub()
+
+
+    def fast_read(self, routine: int) -> None:
+        self.disk_command(0)
+        self.vm.registers['a'] = self.disk_controller_error
+        self.vm.return_from_sub()
+
+
+    def fast_write(self, routine: int) -> None:
+        self.disk_command(1)
+        self.vm.registers['a'] = self.disk_controller_error
+        self.vm.return_from_sub()
+
+
+    def close(self) -> None:
+        if self.flusher is not None:
+            self.flusher.stop()
+            self.flusher = None
+        for drive in self.open_disks:
+            drive.close()
 
 
     def get_input(self, port_addr: int) -> Optional[int]:
+        if port_addr <= 1 and self.bios_hooks and not self.bios_hooks_checked:
+            # CP/M is up and asking for a key, so the BIOS is in place
+            self.install_bios_hooks()
         if port_addr == 0:
             # Console status
-            if len(self.input_buffer) > 0:
+            if self.input_queue.ready():
                 return 0xff
             else:
                 return 0x00
         elif port_addr == 1:
             # Console input
-            if len(self.input_buffer) > 0:
-                c = self.input_buffer[0]
-                self.input_buffer = self.input_buffer[1:]
-                return c
-            else:
+            c = self.input_queue.pop()
+            if c is None:
                 self.vm.registers['pc'] -= 2  # Loop again with same PC
-                return None
+                self.idle()
+            return c
         elif port_addr == 2:
             # List device status
             return 1  # Ready
@@ -153,6 +589,9 @@ class CPM_Machine(VirtualDevice):
         elif port_addr == 0x20:
             # Get currently selected bank
             return self.current_bank
+        elif port_addr == 0xf5:
+            # Format of the current drive, as an index into DISK_FORMATS
+            return self.drive_format()
         elif port_addr == 0xf9:
             # Disk error status
             return self.disk_controller_error
@@ -165,7 +604,7 @@ class CPM_Machine(VirtualDevice):
     def send_output(self, port_addr: int, value: int) -> None:
         if port_addr == 1:
             # Console output
-            self.output_char = value
+            self.put_output(value)
             return
         elif port_addr == 3:
             # List device output
@@ -236,48 +675,31 @@ class CPM_Machine(VirtualDevice):
             # Bank select
             self.select_bank(value)
             return
+        elif port_addr == 0xf6:
+            # Track select, high byte
+            status = self.drive_status[self.current_drive]
+            status['track'] = (value << 8) | (status['track'] & 0x00ff)
+            return
+        elif port_addr == 0xf7:
+            # Interleave for multi-sector commands
+            self.interleave = value
+            return
+        elif port_addr == 0xf8:
+            # Sector count for multi-sector commands
+            self.sector_count = value
+            return
         elif port_addr == 0xf9:
-            # Disk read/write commands
-            if value == 0:
-                # Read current drive/track/sector into [dma]
-                orig_bank = self.current_bank
-                self.select_bank(self.dma_bank)
-                if self.disk_image[self.current_drive] is not None:
-                    data = self.read_disk(self.current_drive,
-                                          self.drive_status[self.current_drive]['track'],
-                                          self.drive_status[self.current_drive]['sector'])
-                    data_len = min(65536 - self.dma_addr, len(data))
-                    for i in range(data_len):
-                        self.vm.memory[self.dma_addr + i] = data[i]
-                    self.disk_controller_error = 0x00  # OK
-                else:
-                    self.disk_controller_error = 0xff  # Error
-                self.select_bank(orig_bank)
-                return
-            elif value == 1:
-                # Write [dma] to current drive/track/sector
-                orig_bank = self.current_bank
-                self.select_bank(self.dma_bank)
-                drive = self.disk_image[self.current_drive]
-                if drive is not None:
-                    sector_size = drive.sector_size
-                    sector_data = bytes(self.vm.memory[self.dma_addr:self.dma_addr+sector_size])
-                    self.write_disk(self.current_drive,
-                                    self.drive_status[self.current_drive]['track'],
-                                    self.drive_status[self.current_drive]['sector'],
-                                    sector_data)
-                    self.disk_controller_error = 0x00  # OK
-                else:
-                    self.disk_controller_error = 0xff  # Error
-                self.select_bank(orig_bank)
-                return
+            # Disk commands
+            self.disk_command(value)
+            return
         elif port_addr == 0xfa:
             # Disk drive select
             self.current_drive = value
             return
         elif port_addr == 0xfb:
             # Track select
-            self.drive_status[self.current_drive]['track'] = value
+            status = self.drive_status[self.current_drive]
+            status['track'] = (status['track'] & 0xff00) | value
             return
         elif port_addr == 0xfc:
             # Sector select
@@ -298,189 +720,56 @@ class CPM_Machine(VirtualDevice):
         raise Exception
 
 
-class CPM_TTY:
-
-    background = (0, 0, 0)
-    foreground = (200, 200, 200)
-    margin = 5
-
-    shift_keymap = {
-        ord('`'): ord('~'),
-        ord('1'): ord('!'),
-        ord('2'): ord('@'),
-        ord('3'): ord('#'),
-        ord('4'): ord('$'),
-        ord('5'): ord('%'),
-        ord('6'): ord('^'),
-        ord('7'): ord('&'),
-        ord('8'): ord('*'),
-        ord('9'): ord('('),
-        ord('0'): ord(')'),
-        ord('-'): ord('_'),
-        ord('='): ord('+'),
-        ord('['): ord('{'),
-        ord(']'): ord('}'),
-        ord(';'): ord(':'),
-        ord("'"): ord('"'),
-        ord(','): ord('<'),
-        ord('.'): ord('>'),
-        ord('/'): ord('?'),
-    }
-
-    def __init__(self, disk_images: List[str] = []):
-        self.disk_images: List[str] = disk_images
-
-        self.buffer: bytearray = bytearray([32 for _ in range(80 * 24)])
-        self.cursor: int = 0
-        self.esc_sequence: bytes = b''
-
-        pygame.init()
-        pygame.display.set_caption('CP/M')
-        pygame.key.set_repeat(1000, 100)
-
-        self.screen: Surface = pygame.display.set_mode(
-            (80 * 10 + 2 * self.margin, 24 * 20 + 2 * self.margin))
-        self.font: Font = Font('BmPlus_Rainbow100_re_80.otb', 24)
-        self.blink_rate: int = 750
-
-
-    def putch(self, ch: int) -> None:
-        ## ADM-3A cursor control
-        ch = ch & 0b01111111
-        if ch == 27:      # Esc
-            self.esc_sequence = b'\x1b'
-        elif len(self.esc_sequence) > 0:
-            self.esc_sequence += bytes([ch])
-            if self.esc_sequence.startswith(b'\x1b=') and len(self.esc_sequence) >= 4:
-                y = self.esc_sequence[2] - 0x20
-                x = self.esc_sequence[3] - 0x20
-                self.cursor = 80 * y + x
-                self.esc_sequence = b''
-
-        elif ch == 8:         # ^H
-            self.cursor = max(0, self.cursor - 1)
-        elif ch == 10:         # ^J, \n
-            self.cursor = self.cursor + 80
-            if self.cursor >= 80 * 24 - 1:
-                self.buffer = self.buffer[80:] + bytearray([32 for _ in range(80)])
-                self.cursor = 80 * 23
-        elif ch == 11:         # ^K
-            self.cursor = max(0, self.cursor - 80)
-        elif ch == 12:         # ^L
-            self.cursor = min(80 * 24 - 1, self.cursor + 1)
-        elif ch == 13:      # \r
-            self.cursor = self.cursor // 80 * 80
-        elif ch == 26:      # ^Z
-            self.buffer = bytearray([32 for _ in range(80 * 24)])
-            self.cursor = 0
-        elif ch == 30:      # Home
-            self.cursor = 0
-
-        elif 32 <= ch < 127: # Printable
-            if self.cursor >= 80 * 24 - 1:
-                self.buffer = self.buffer[80:] + bytearray([32 for _ in range(80)])
-                self.cursor = 80 * 23
-            self.buffer[self.cursor] = ch
-            self.cursor += 1
-        else:
-            # print(f'{ch} {ch & 0x7f}')
-            print(chr(ch & 0x7f), end='', flush=True)
-
-
-    def render_buffer(self) -> List[Tuple[Surface, Rect]]:
-        cursor_on = (time.time_ns() // 1000000 // self.blink_rate) % 2 == 0
-        curs_col = self.cursor % 80
-        curs_row = self.cursor // 80
-
-        # Render the cursor
-        if cursor_on:
-            surface, rect = self.font.render(bytes([self.buffer[80*curs_row+curs_col]]),
-                                             fgcolor=self.background,
-                                             bgcolor=self.foreground)
-        else:
-            surface, rect = self.font.render(bytes([self.buffer[80*curs_row+curs_col]]),
-                                             fgcolor=self.foreground,
-                                             bgcolor=self.background)
-        rect.topleft = (curs_col * 10 + self.margin, curs_row * 20 + self.margin)
-        rect.size = surface.get_size()
-        blits = [(surface, rect)]
-
-        # Render rows up to the cursor row
-        for row in range(0, curs_row):
-            surface, rect = self.font.render(bytes(self.buffer[80*row:80*row+80]),
-                                             fgcolor=self.foreground)
-            rect.topleft = (self.margin, row * 20 + self.margin)
-            rect.size = surface.get_size()
-            blits += [(surface, rect)]
-
-        # Render the cursor row, but not the cursor
-        surface, rect = self.font.render(bytes(self.buffer[80*curs_row:80*curs_row+curs_col]),
-                                         fgcolor=self.foreground)
-        rect.topleft = (self.margin, curs_row * 20 + self.margin)
-        rect.size = surface.get_size()
-        blits += [(surface, rect)]
-        surface, rect = self.font.render(bytes(self.buffer[80*curs_row+curs_col+1:80*curs_row+80]),
-                                         fgcolor=self.foreground)
-        rect.topleft = ((curs_col + 1) * 10 + self.margin, curs_row * 20 + self.margin)
-        rect.size = surface.get_size()
-        blits += [(surface, rect)]
-
-        # Render rows after the cursor row
-        for row in range(curs_row+1, 24):
-            surface, rect = self.font.render(bytes(self.buffer[80*row:80*row+80]),
-                                             fgcolor=self.foreground)
-            rect.topleft = (self.margin, row * 20 + self.margin)
-            rect.size = surface.get_size()
-            blits += [(surface, rect)]
-        return blits
-
-
-    def run(self) -> None:
-        vm = Virtual8080()
-        vm.io = CPM_Machine(vm, self.disk_images)
-
-        work_ms = 1000 // 60    # Allow ~17ms of emulation time to maintain ~60fps.
-        vm.halted = False
-        while not vm.halted:
-            work_until = pygame.time.get_ticks() + work_ms
-            while pygame.time.get_ticks() < work_until:
-                if not vm.halted:
-                    vm.step()
-                ch = vm.io.output_char
-                if ch != -1:
-                    self.putch(ch)
-                    vm.io.output_char = -1
-
-            for event in pygame.event.get():
-                if event.type == QUIT:
-                    vm.halted = True
-                
-                if event.type == KEYDOWN:
-                    if 0 <= event.key <= 255: 
-                        key = event.key
-                        if 97 <= key <= 122 and event.mod & KMOD_SHIFT: # A-Z
-                            key -= 32
-                        elif event.mod & KMOD_SHIFT:                    # Other
-                            if key in self.shift_keymap.keys():
-                                key = self.shift_keymap[key]
-                        elif 97 <= key <= 122 and event.mod & KMOD_CTRL: # ^A - ^Z
-                            key -= 96
-                        vm.io.input_buffer += bytes([key])
-
-            self.screen.fill(self.background)
-            self.screen.blits(self.render_buffer())
-            pygame.display.update()
-
-        pygame.quit()
-
-
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     for d in range(ord('a'), ord('a') + 16):
         parser.add_argument(f'-d{chr(d)}', f'--drive_{chr(d)}', type=str, default=None,
                             help=f'disk image for drive {chr(d)}')
+        parser.add_argument(f'--format_{chr(d)}', choices=DISK_FORMATS, default=None,
+                            help=f'format of drive {chr(d)} (default ibm-3740)')
+    parser.add_argument('--headless', action='store_true',
+                        help='run on stdin/stdout instead of a PyGame window')
+    parser.add_argument('--flush', choices=CPM_Disk.flush_policies, default='immediate',
+                        help='when to write changed sectors to the disk images')
+    parser.add_argument('--flush-interval', type=float, default=1.0,
+                        help='seconds between background flushes')
+    parser.add_argument('--fsync', action='store_true',
+                        help='fsync disk images after writing changed sectors')
+    parser.add_argument('--fast-bios', action='store_true',
+                        help="run the CP/M 2.2 BIOS's console and disk routines in Python")
+    parser.add_argument('--warp-until', metavar='PROMPT', nargs='?', const='A>', default=None,
+                        help='run flat out until CP/M shows PROMPT (A> if not given)')
+    parser.add_argument('--snapshot', metavar='FILE', default=None,
+                        help='start from the snapshot in FILE, or boot with --warp-until '
+                             'and save one to FILE at the prompt')
+    parser.add_argument('--worker', choices=['none', 'thread', 'process'], default='none',
+                        help='run the emulator on its own thread or process, '
+                             'apart from the PyGame window')
+    parser.add_argument('--fps', type=int, default=60,
+                        help='target frame rate of the PyGame window')
+    parser.add_argument('--cpu-budget', type=float, default=1.0,
+                        help='fraction of a host CPU to use, from 0 to 1 (PyGame window only)')
     args = parser.parse_args()
 
-    tty = CPM_TTY(disk_images=[getattr(args, f'drive_{chr(d)}')
-                               for d in range(ord('a'), ord('a') + 16)])
-    tty.run()
+    disk_images = [getattr(args, f'drive_{chr(d)}')
+                   for d in range(ord('a'), ord('a') + 16)]
+    disk_formats = [getattr(args, f'format_{chr(d)}')
+                    for d in range(ord('a'), ord('a') + 16)]
+    warp_prompt = args.warp_until
+    if args.snapshot is not None and warp_prompt is None:
+        warp_prompt = 'A>'
+    if args.headless:
+        from cpm_console import CPM_Console
+        CPM_Console(disk_images=disk_images, disk_formats=disk_formats,
+                    flush_policy=args.flush,
+                    flush_interval=args.flush_interval, fsync=args.fsync,
+                    bios_hooks=args.fast_bios, warp_prompt=warp_prompt,
+                    snapshot_file=args.snapshot).run()
+    else:
+        from cpm_tty import CPM_TTY
+        CPM_TTY(disk_images=disk_images, worker=args.worker,
+                frame_rate=args.fps, cpu_budget=args.cpu_budget,
+                disk_formats=disk_formats,
+                flush_policy=args.flush, flush_interval=args.flush_interval,
+                fsync=args.fsync, bios_hooks=args.fast_bios, warp_prompt=warp_prompt,
+                snapshot_file=args.snapshot).run()
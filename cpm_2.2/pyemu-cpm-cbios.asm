@@ -33,6 +33,8 @@ dtrack	equ disk+2	;track port
 dsect	equ disk+3	;sector port
 ddmahi	equ disk+4	;DMA address (high) port
 ddmalo	equ disk+5	;DMA address (low) port
+dcount	equ disk-1	;sector count port for multi-sector commands
+dfmt	equ disk-4	;drive format port: 0 = ibm-3740, 0ffh = no drive
 ;
 ;	jump vector for individual subroutines
 	jmp	boot		;cold start
@@ -100,62 +102,26 @@ prmsg:	;print message at h,l to 0
 	inx	h
 	jmp	prmsg
 ;
-wboot:	;simplest case is to read the disk until all sectors loaded
+wboot:	;read the ccp and bdos with one multi-sector command
 	lxi	sp,80h		;use space below buffer for stack
 	mvi	c,0		;select disk 0
 	call	seldsk
 	call	home		;go to track 00
 ;
-	mvi	b,nsects	;b counts # of sectors to load
-	mvi	c,0		;c has the current track number
-	mvi	d,2		;d has the next sector to read
-;	note that we begin by reading track 0, sector 2 since sector 1
-;	contains the cold start loader, which is skipped in a warm start
-	lxi	h,ccp		;base of cp/m (initial load point)
-load1:	;load one more sector
-	push	b	;save sector count, current track
-	push	d	;save next sector to read
-	push	h	;save dma address
-	mov	c,d	;get sector address to register c
-	call	setsec	;set sector address from register c
-	pop	b	;recall dma address to b,c
-	push	b	;replace on stack for later recall
-	call	setdma	;set dma address from b,c
-;
-;	drive set to 0, track set, sector set, dma address set
-	call	rddsk
+;	begin with track 0, sector 2 since sector 1 contains the cold
+;	start loader, which is skipped in a warm start
+	mvi	c,2
+	call	setsec
+	lxi	b,ccp		;base of cp/m (initial load point)
+	call	setdma
+	mvi	a,nsects	;number of sectors to load
+	out	dcount
+	mvi	a,2		;"read sectors" command, continues onto track 1
+	out	dcom
+	in	dstat
 	cpi	00h	;any errors?
 	jnz	wboot	;retry the entire boot if an error occurs
 ;
-;	no error, move to next sector
-	pop	h	;recall dma address
-	lxi	d,128	;dma=dma+128
-	dad	d	;new dma address is in h,l
-	pop	d	;recall sector address
-	pop	b	;recall number of sectors remaining, and current trk
-	dcr	b	;sectors=sectors-1
-	jz	gocpm	;transfer to cp/m if all have been loaded
-;
-;	more sectors remain to load, check for track change
-	inr	d
-	mov	a,d	;sector=27?, if so, change tracks
-	cpi	27
-	jc	load1	;carry generated if sector<27
-;
-;	end of current track, go to next track
-	mvi	d,1	;begin with first sector of next track
-	inr	c	;track=track+1
-;
-;	save register state, and change tracks
-	push	b
-	push	d
-	push	h
-	call	settrk	;track address set from register c
-	pop	h
-	pop	d
-	pop	b
-	jmp	load1	;for another sector
-;
 ;	end of load operation, set parameters and go to cp/m
 gocpm:
 	mvi	a,0c3h	;c3 is a jmp instruction
@@ -227,6 +193,12 @@ seldsk:	;select disk given by register C
 	rnc		;no carry if 16, 17...
 ;	disk number is in the proper range
 	out	ddisk
+	in	dfmt	;only 8" floppies fit in this bios
+	ora	a
+	jz	seld1
+	inr	a	;no drive at all gives a read error later, as before
+	rnz		;a hard disk format is a select error
+seld1:	mov	a,c
 ;	compute proper disk parameter header address
 	mov	l,a	;L=disk number 0,1,2,3
 	mvi	h,0	;high order zero
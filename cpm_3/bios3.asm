@@ -38,6 +38,8 @@ dsect	equ disk+3	;sector port
 ddmahi	equ disk+4	;DMA address (high) port
 ddmalo	equ disk+5	;DMA address (low) port
 ddmabk	equ disk+6	;DMA bank port
+dtrkhi	equ disk-3	;track port (high byte)
+dfmt	equ disk-4	;drive format port: 0 = ibm-3740, 1 = hd4m, 2 = hd8m
 ;
 bdos	equ 5
 ;
@@ -98,6 +100,14 @@ tblchr	db	'PYGAME'
 	cseg
 ;
 dpbstd	dpb	128,26,77,1024,64,2
+dpbhd4	dpb	512,32,256,4096,1024,0,0	;fixed: no directory checks
+dpbhd8	dpb	512,32,512,4096,1024,0,0
+;
+;	translate table and dpb by drive format
+nfmts	equ	3
+tblfmt	dw	tbltrn,dpbstd
+	dw	tblhd,dpbhd4
+	dw	tblhd,dpbhd8
 ;
 	dseg
 ;
@@ -105,25 +115,28 @@ tbldrv	dw	dph0,dph1,dph2,dph3
 	dw	dph4,dph5,dph6,dph7
 	dw	dph8,dph9,dpha,dphb
 	dw	dphc,dphd,dphe,dphf
-;
-dph0	dph	tbltrn,dpbstd
-dph1	dph	tbltrn,dpbstd
-dph2	dph	tbltrn,dpbstd
-dph3	dph	tbltrn,dpbstd
-dph4	dph	tbltrn,dpbstd
-dph5	dph	tbltrn,dpbstd
-dph6	dph	tbltrn,dpbstd
-dph7	dph	tbltrn,dpbstd
-dph8	dph	tbltrn,dpbstd
-dph9	dph	tbltrn,dpbstd
-dpha	dph	tbltrn,dpbstd
-dphb	dph	tbltrn,dpbstd
-dphc	dph	tbltrn,dpbstd
-dphd	dph	tbltrn,dpbstd
-dphe	dph	tbltrn,dpbstd
-dphf	dph	tbltrn,dpbstd
+;	seldsk points each dph at its drive's format on the first select.
+;	The check and allocation vector sizes fit the largest format.
+;
+dph0	dph	tbltrn,dpbstd,16,514
+dph1	dph	tbltrn,dpbstd,16,514
+dph2	dph	tbltrn,dpbstd,16,514
+dph3	dph	tbltrn,dpbstd,16,514
+dph4	dph	tbltrn,dpbstd,16,514
+dph5	dph	tbltrn,dpbstd,16,514
+dph6	dph	tbltrn,dpbstd,16,514
+dph7	dph	tbltrn,dpbstd,16,514
+dph8	dph	tbltrn,dpbstd,16,514
+dph9	dph	tbltrn,dpbstd,16,514
+dpha	dph	tbltrn,dpbstd,16,514
+dphb	dph	tbltrn,dpbstd,16,514
+dphc	dph	tbltrn,dpbstd,16,514
+dphd	dph	tbltrn,dpbstd,16,514
+dphe	dph	tbltrn,dpbstd,16,514
+dphf	dph	tbltrn,dpbstd,16,514
 ;
 tbltrn	skew	26,6,1
+tblhd	skew	32,1,1	;no skew, but sectors numbered from 1
 ;
 ;	fcb for ccp.com
 ;
@@ -311,67 +324,72 @@ devini:
 ;
 home:	;move to the track 00 position of current drive
 ;	translate this call into a settrk call with parameter 00
-	mvi	c,0	;select track 0
+	lxi	b,0	;select track 0
 	call	settrk
 	ret
 ;
-seldsk:	;select disk given by register C
+seldsk:	;select disk given by register C, E bit 0 = 0 on first select
 	mov	a,c
+	cpi	16
+	lxi	h,0
+	rnc		;only drives A-P
 	out	ddisk
+	mov	b,e	;B = first select flag
+;
+	in	dfmt	;format of the drive, 0ffh if none
+	cpi	nfmts
+	jc	seld1
+	xra	a	;no drive: use the floppy format
+seld1:	add	a	;*2
+	add	a	;*4 (size of each tblfmt entry)
+	mov	e,a
+	mvi	d,0
+	lxi	h,tblfmt
+	dad	d	;HL=.tblfmt(format)
+	mov	e,m
+	inx	h
+	mov	d,m	;DE = translate table
+	inx	h
+	mov	a,m
+	inx	h
+	mov	h,m
+	mov	l,a	;HL = dpb
+	push	h	;save dpb
+;
+	push	d	;save translate table
+	mov	l,c
+	mvi	h,0
+	dad	h	;*2
+	lxi	d,tbldrv
+	dad	d	;HL=.tbldrv(drive)
+	mov	a,m
+	inx	h
+	mov	h,m
+	mov	l,a	;HL = dph
+	pop	d	;DE = translate table
+	mov	a,b
+	rrc
+	jc	seld2	;logged in before, dph is already set up
 ;
-	lxi	h,dph0
-	cpi	0
-	rz
-	lxi	h,dph1
-	cpi	1
-	rz
-	lxi	h,dph2
-	cpi	2
-	rz
-	lxi	h,dph3
-	cpi	3
-	rz
-	lxi	h,dph4
-	cpi	4
-	rz
-	lxi	h,dph5
-	cpi	5
-	rz
-	lxi	h,dph6
-	cpi	6
-	rz
-	lxi	h,dph7
-	cpi	7
-	rz
-	lxi	h,dph8
-	cpi	8
-	rz
-	lxi	h,dph9
-	cpi	9
-	rz
-	lxi	h,dpha
-	cpi	10
-	rz
-	lxi	h,dphb
-	cpi	11
-	rz
-	lxi	h,dphc
-	cpi	12
-	rz
-	lxi	h,dphd
-	cpi	13
-	rz
-	lxi	h,dphe
-	cpi	14
-	rz
-	lxi	h,dphf
-	cpi	15
-	rz
-;
-	lxi	h,0
+;	first select: point the dph at the tables for the drive's format
+	mov	m,e
+	inx	h
+	mov	m,d	;translate table
+	lxi	d,11
+	dad	d	;HL=.dph+12
+	pop	d	;DE = dpb
+	mov	m,e
+	inx	h
+	mov	m,d
+	lxi	d,-13
+	dad	d	;HL = dph
+	ret
+seld2:	pop	d	;discard dpb
 	ret
 ;
-settrk:	;set track given by register c
+settrk:	;set track given by registers bc
+	mov	a,b
+	out	dtrkhi
 	mov	a,c
 	out	dtrack
 	ret
@@ -0,0 +1,761 @@
+# This is free and unencumbered software released into the public domain.
+#
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a compiled
+# binary, for any purpose, commercial or non-commercial, and by any
+# means.
+#
+# In jurisdictions that recognize copyright laws, the author or authors
+# of this software dedicate any and all copyright interest in the
+# software to the public domain. We make this dedication for the benefit
+# of the public at large and to the detriment of our heirs and
+# successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to this
+# software under copyright law.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# For more information, please refer to <https://unlicense.org>
+
+"""Run a CP/M .COM program without booting CP/M.
+
+    python cpm_bdos.py PROG.COM [ARGUMENTS...]"""
+
+
+import argparse
+import os
+import sys
+from typing import BinaryIO, Callable, Dict, List, Optional
+
+from cpm_disk import DIR_ENTRY, RECORD_SIZE, cpm_filename, host_filename
+from kbhit import KBHit
+from virtual8080 import Virtual8080
+from virtual_device import VirtualDevice
+
+
+TPA = 0x0100
+FCB1 = 0x005c
+FCB2 = 0x006c
+DEFAULT_DMA = 0x0080
+BDOS_ENTRY = 0xfe06
+BIOS_BASE = 0xff00
+BIOS_ENTRIES = 17
+
+
+class NullDevice(VirtualDevice):
+
+    def get_input(self, port_addr: int) -> int:
+        return 0
+
+    def send_output(self, port_addr: int, value: int) -> None:
+        pass
+
+
+def parse_fcb(arg: str) -> bytes:
+    # 'b:*.asm' -> b'\x02????????ASM', the drive, name and type of an FCB
+    # as the CCP fills them in from a command line argument.
+    drive = 0
+    arg = arg.upper()
+    if len(arg) >= 2 and arg[1] == ':':
+        drive = ord(arg[0]) - ord('A') + 1
+        arg = arg[2:]
+    name, _, ext = arg.partition('.')
+
+    def field(s: str, length: int) -> bytes:
+        if '*' in s:
+            s = s.partition('*')[0].ljust(length, '?')
+        return s[:length].ljust(length).encode('ascii', errors='replace')
+
+    return bytes([drive]) + field(name, 8) + field(ext, 3)
+
+
+class CPM_BDOS:
+    """CP/M 2.2's BDOS calls and BIOS entry points, done in Python.
+
+    Calls to 0005H and to the BIOS jump table are caught with pc hooks, so
+    only the program itself runs as 8080 code. The console is stdin and
+    stdout, and each drive is a host directory. The program ends when it
+    warm boots, or when it wants console input after the end of stdin.
+
+    When stdin isn't a terminal, a waiting key is only reported by the
+    console status calls once the program has polled poll_limit times with
+    no output in between, so that programs checking for a key to stop a
+    listing don't take input meant for their next prompt."""
+
+    poll_limit = 100
+
+    def __init__(self,
+                 vm: Virtual8080,
+                 directories: List[Optional[str]],
+                 stdout: BinaryIO = sys.stdout.buffer):
+        self.vm: Virtual8080 = vm
+        self.directories: List[Optional[str]] = directories   # By drive, None if there's no drive
+        self.stdout: BinaryIO = stdout
+        self.kb = KBHit()
+        self.interactive: bool = sys.stdin.isatty()
+        self.pending_key: Optional[int] = None  # Read for a status call, not yet taken
+        self.input_ended: bool = False
+        self.idle_polls: int = 0    # Status calls since the last output or input
+        self.last_cr: bool = False  # Last key was CR, so a following LF is dropped
+        self.column: int = 0        # For expanding tabs
+
+        self.dma: int = DEFAULT_DMA
+        self.drive: int = 0
+        self.user: int = 0
+        self.handles: Dict[str, BinaryIO] = {}
+        self.search_results: List[bytes] = []
+
+        self.functions: Dict[int, Callable[[], int]] = {
+            0: self.system_reset,
+            1: self.console_input,
+            2: self.console_output,
+            3: self.reader_input,
+            4: self.punch_output,
+            5: self.list_output,
+            6: self.direct_console_io,
+            7: self.get_iobyte,
+            8: self.set_iobyte,
+            9: self.print_string,
+            10: self.read_console_buffer,
+            11: self.console_status,
+            12: self.version,
+            13: self.reset_disk_system,
+            14: self.select_disk,
+            15: self.open_file,
+            16: self.close_file,
+            17: self.search_first,
+            18: self.search_next,
+            19: self.delete_file,
+            20: self.read_sequential,
+            21: self.write_sequential,
+            22: self.make_file,
+            23: self.rename_file,
+            24: self.login_vector,
+            25: self.current_disk,
+            26: self.set_dma,
+            32: self.user_code,
+            33: self.read_random,
+            34: self.write_random,
+            35: self.file_size,
+            36: self.set_random_record,
+            40: self.write_random,
+        }
+
+        bios: List[Callable[[], None]] = [
+            self.warm_boot, self.warm_boot, self.bios_const, self.bios_conin,
+            self.bios_conout, self.bios_ignore, self.bios_ignore, self.bios_reader,
+            self.bios_ignore, self.bios_seldsk, self.bios_ignore, self.bios_ignore,
+            self.bios_setdma, self.bios_disk_io, self.bios_disk_io, self.bios_listst,
+            self.bios_sectran,
+        ]
+        for i, fn in enumerate(bios):
+            vm.pc_hooks[BIOS_BASE + 3 * i] = self.bios_hook(fn)
+        vm.pc_hooks[BDOS_ENTRY] = self.bdos
+
+
+    def load(self, program: bytes, args: List[str]) -> None:
+        # Set up page zero as the CCP would and load the program at 0100H.
+        if len(program) > BDOS_ENTRY - TPA:
+            raise ValueError('program too big')
+        memory = self.vm.memory
+        memory[0x0000:0x0003] = [0xc3, (BIOS_BASE + 3) & 0xff, (BIOS_BASE + 3) >> 8]
+        memory[0x0003:0x0005] = [0, self.drive]
+        memory[0x0005:0x0008] = [0xc3, BDOS_ENTRY & 0xff, BDOS_ENTRY >> 8]
+        memory[BDOS_ENTRY] = 0xc9
+        for i in range(BIOS_ENTRIES):
+            memory[BIOS_BASE + 3 * i:BIOS_BASE + 3 * i + 3] = [0xc9, 0, 0]
+
+        memory[FCB1:TPA] = [0] * (TPA - FCB1)
+        memory[FCB1 + 1:FCB1 + 12] = b' ' * 11
+        memory[FCB2 + 1:FCB2 + 12] = b' ' * 11
+        for fcb, arg in zip([FCB1, FCB2], args):
+            memory[fcb:fcb + 12] = parse_fcb(arg)
+        tail = ''.join(' ' + arg for arg in args).upper().encode('ascii', errors='replace')[:127]
+        memory[DEFAULT_DMA] = len(tail)
+        memory[DEFAULT_DMA + 1:DEFAULT_DMA + 1 + len(tail)] = tail
+
+        memory[TPA:TPA + len(program)] = program
+        # Returning from the program goes to 0000H, and so warm boots.
+        self.vm.registers['sp'] = BDOS_ENTRY - 8
+        memory[BDOS_ENTRY - 8:BDOS_ENTRY - 6] = [0, 0]
+        self.vm.registers['pc'] = TPA
+
+
+    def close(self) -> None:
+        self.stdout.flush()
+        for f in self.handles.values():
+            f.close()
+        self.handles.clear()
+        self.kb.set_normal_term()
+
+
+    ##
+    ## Entry points
+    ##
+
+    def bdos(self) -> None:
+        registers = self.vm.registers
+        fn = self.functions.get(registers['c'])
+        result = fn() if fn is not None else 0
+        # Byte results are returned in A and L, words in HL with A=L and B=H.
+        registers['a'] = registers['l'] = result & 0xff
+        registers['b'] = registers['h'] = result >> 8
+        self.vm.return_from_sub()
+
+
+    def bios_hook(self, fn: Callable[[], None]) -> Callable[[], None]:
+        def hook() -> None:
+            fn()
+            self.vm.return_from_sub()
+        return hook
+
+
+    def warm_boot(self) -> None:
+        self.vm.halted = True
+
+
+    def bios_const(self) -> None:
+        self.vm.registers['a'] = self.console_status()
+
+
+    def bios_conin(self) -> None:
+        key = self.read_key()
+        self.vm.registers['a'] = 0x1a if key is None else key
+
+
+    def bios_conout(self) -> None:
+        self.idle_polls = 0
+        self.stdout.write(bytes([self.vm.registers['c']]))
+
+
+    def bios_reader(self) -> None:
+        self.vm.registers['a'] = 0x1a
+
+
+    def bios_listst(self) -> None:
+        self.vm.registers['a'] = 0xff
+
+
+    def bios_seldsk(self) -> None:
+        # There are no disks at the BIOS level.
+        self.vm.registers['h'] = self.vm.registers['l'] = 0
+
+
+    def bios_setdma(self) -> None:
+        self.dma = (self.vm.registers['b'] << 8) | self.vm.registers['c']
+
+
+    def bios_disk_io(self) -> None:
+        self.vm.registers['a'] = 1
+
+
+    def bios_sectran(self) -> None:
+        self.vm.registers['h'] = self.vm.registers['b']
+        self.vm.registers['l'] = self.vm.registers['c']
+
+
+    def bios_ignore(self) -> None:
+        pass
+
+
+    ##
+    ## Console
+    ##
+
+    def read_key(self) -> Optional[int]:
+        # Wait for the next key, or return None at the end of input, which
+        # also ends the program.
+        self.idle_polls = 0
+        key = self.pending_key
+        self.pending_key = None
+        if key is None:
+            key = self.next_key()
+        if key is None:
+            self.vm.halted = True
+        return key
+
+
+    def next_key(self) -> Optional[int]:
+        # Next byte of stdin, with LF read as CR.
+        self.stdout.flush()
+        while not self.input_ended:
+            if os.name == 'nt':
+                data = sys.stdin.buffer.read(1)
+            else:
+                data = os.read(sys.stdin.fileno(), 1)
+            if data == b'':
+                self.input_ended = True
+                break
+            key = data[0]
+            last_cr = self.last_cr
+            self.last_cr = key == 0x0d
+            if key == 0x0a:
+                if last_cr:
+                    continue
+                key = 0x0d
+            return key
+        return None
+
+
+    def key_ready(self) -> bool:
+        if self.pending_key is not None:
+            return True
+        self.idle_polls += 1
+        if self.input_ended:
+            if self.idle_polls >= self.poll_limit:
+                self.vm.halted = True   # Polling for input that will never come
+            return False
+        if (not self.interactive and self.idle_polls < self.poll_limit) or not self.kb.kbhit():
+            return False
+        self.pending_key = self.next_key()
+        return self.pending_key is not None
+
+
+    def output(self, c: int) -> None:
+        # Write a character, expanding tabs as the BDOS does.
+        self.idle_polls = 0
+        if c == 0x09:
+            spaces = 8 - self.column % 8
+            self.stdout.write(b' ' * spaces)
+            self.column += spaces
+            return
+        self.stdout.write(bytes([c]))
+        if c == 0x0d:
+            self.column = 0
+        elif c == 0x08:
+            self.column = max(0, self.column - 1)
+        elif c >= 0x20:
+            self.column += 1
+
+
+    def de(self) -> int:
+        return (self.vm.registers['d'] << 8) | self.vm.registers['e']
+
+
+    def system_reset(self) -> int:
+        self.vm.halted = True
+        return 0
+
+
+    def console_input(self) -> int:
+        key = self.read_key()
+        if key is None:
+            return 0x1a
+        if key >= 0x20 or key in (0x08, 0x09, 0x0a, 0x0d):
+            self.output(key)
+        return key
+
+
+    def console_output(self) -> int:
+        self.output(self.vm.registers['e'])
+        return 0
+
+
+    def reader_input(self) -> int:
+        return 0x1a
+
+
+    def punch_output(self) -> int:
+        return 0
+
+
+    def list_output(self) -> int:
+        return 0
+
+
+    def direct_console_io(self) -> int:
+        e = self.vm.registers['e']
+        if e == 0xff:
+            if not self.key_ready():
+                return 0
+            key = self.read_key()
+            return 0 if key is None else key
+        if e == 0xfe:
+            return self.console_status()
+        self.idle_polls = 0
+        self.stdout.write(bytes([e]))
+        return 0
+
+
+    def get_iobyte(self) -> int:
+        return self.vm.memory[0x0003]
+
+
+    def set_iobyte(self) -> int:
+        self.vm.memory[0x0003] = self.vm.registers['e']
+        return 0
+
+
+    def print_string(self) -> int:
+        memory = self.vm.memory
+        addr = self.de()
+        while memory[addr] != ord('$'):
+            self.output(memory[addr])
+            addr = (addr + 1) & 0xffff
+        return 0
+
+
+    def read_console_buffer(self) -> int:
+        memory = self.vm.memory
+        buffer = self.de()
+        max_length = memory[buffer]
+        line = bytearray()
+        while len(line) < max_length:
+            key = self.read_key()
+            if key is None:
+                break
+            if key == 0x0d:
+                break
+            if key in (0x08, 0x7f):
+                if line:
+                    line.pop()
+                    self.output(0x08)
+                    self.output(0x20)
+                    self.output(0x08)
+            elif key in (0x15, 0x18):   # ^U, ^X
+                while line:
+                    line.pop()
+                    self.output(0x08)
+                    self.output(0x20)
+                    self.output(0x08)
+            elif key == 0x03 and not line:
+                self.vm.halted = True
+                break
+            else:
+                line.append(key)
+                self.output(key)
+        self.output(0x0d)
+        memory[buffer + 1] = len(line)
+        memory[buffer + 2:buffer + 2 + len(line)] = line
+        return 0
+
+
+    def console_status(self) -> int:
+        return 0xff if self.key_ready() else 0
+
+
+    def version(self) -> int:
+        return 0x0022
+
+
+    ##
+    ## Files
+    ##
+
+    def reset_disk_system(self) -> int:
+        self.dma = DEFAULT_DMA
+        self.drive = 0
+        return 0
+
+
+    def select_disk(self) -> int:
+        self.drive = self.vm.registers['e'] & 0x0f
+        self.vm.memory[0x0004] = self.drive
+        return 0
+
+
+    def directory(self, fcb: int) -> Optional[str]:
+        drive = self.vm.memory[fcb]
+        drive = self.drive if drive in (0, ord('?')) else drive - 1
+        return self.directories[drive] if drive < len(self.directories) else None
+
+
+    def matches(self, fcb: int, offset: int = 1) -> List[str]:
+        # Paths of the host files with names matching the FCB's, where ?
+        # matches any character.
+        directory = self.directory(fcb)
+        if directory is None:
+            return []
+        pattern = bytes(c & 0x7f for c in self.vm.memory[fcb + offset:fcb + offset + 11])
+        paths = []
+        for host_name in sorted(os.listdir(directory)):
+            name = cpm_filename(host_name)
+            path = os.path.join(directory, host_name)
+            if name is None or not os.path.isfile(path):
+                continue
+            if all(p == ord('?') or p == c for p, c in zip(pattern, name[0] + name[1])):
+                paths.append(path)
+        return paths
+
+
+    def handle(self, fcb: int) -> Optional[BinaryIO]:
+        paths = self.matches(fcb)
+        if not paths or b'?' in bytes(self.vm.memory[fcb + 1:fcb + 12]):
+            return None
+        f = self.handles.get(paths[0])
+        if f is None:
+            try:
+                f = open(paths[0], 'r+b')
+            except PermissionError:
+                f = open(paths[0], 'rb')
+            self.handles[paths[0]] = f
+        return f
+
+
+    def forget(self, path: str) -> None:
+        f = self.handles.pop(path, None)
+        if f is not None:
+            f.close()
+
+
+    def file_records(self, f: BinaryIO) -> int:
+        f.flush()
+        return (os.fstat(f.fileno()).st_size + RECORD_SIZE - 1) // RECORD_SIZE
+
+
+    def fcb_record(self, fcb: int) -> int:
+        # Current record from the extent (EX and S2) and record (CR) fields.
+        memory = self.vm.memory
+        return ((memory[fcb + 14] & 0x3f) << 12) | ((memory[fcb + 12] & 0x1f) << 7) | memory[fcb + 32]
+
+
+    def set_fcb_record(self, fcb: int, record: int, f: BinaryIO) -> None:
+        memory = self.vm.memory
+        memory[fcb + 12] = (record >> 7) & 0x1f
+        memory[fcb + 14] = (record >> 12) & 0x3f
+        memory[fcb + 32] = record & 0x7f
+        memory[fcb + 15] = min(0x80, max(0, self.file_records(f) - (record & ~0x7f)))
+
+
+    def random_record(self, fcb: int) -> int:
+        memory = self.vm.memory
+        return memory[fcb + 33] | (memory[fcb + 34] << 8) | (memory[fcb + 35] << 16)
+
+
+    def read_record(self, f: BinaryIO, record: int) -> int:
+        f.seek(record * RECORD_SIZE)
+        data = f.read(RECORD_SIZE)
+        if data == b'':
+            return 1
+        self.vm.memory[self.dma:self.dma + RECORD_SIZE] = data + b'\x1a' * (RECORD_SIZE - len(data))
+        return 0
+
+
+    def write_record(self, f: BinaryIO, record: int) -> int:
+        f.seek(record * RECORD_SIZE)
+        try:
+            f.write(bytes(self.vm.memory[self.dma:self.dma + RECORD_SIZE]))
+        except OSError:
+            return 2
+        return 0
+
+
+    def open_file(self) -> int:
+        fcb = self.de()
+        f = self.handle(fcb)
+        if f is None:
+            return 0xff
+        self.vm.memory[fcb + 14] = 0
+        self.set_fcb_record(fcb, self.fcb_record(fcb), f)
+        return 0
+
+
+    def close_file(self) -> int:
+        f = self.handle(self.de())
+        if f is None:
+            return 0xff
+        f.flush()
+        return 0
+
+
+    def search_first(self) -> int:
+        fcb = self.de()
+        memory = self.vm.memory
+        any_extent = memory[fcb + 12] == ord('?')
+        self.search_results = []
+        for path in self.matches(fcb):
+            name = cpm_filename(os.path.basename(path))
+            assert name is not None
+            records = (os.path.getsize(path) + RECORD_SIZE - 1) // RECORD_SIZE
+            extents = range(max(1, (records + 0x7f) >> 7)) if any_extent else [memory[fcb + 12]]
+            for extent in extents:
+                extent_records = min(0x80, records - (extent << 7))
+                if extent_records < 0 or (extent_records == 0 and extent > 0):
+                    continue
+                self.search_results.append(DIR_ENTRY.pack(
+                    self.user, name[0], name[1], extent & 0x1f, 0, extent >> 5,
+                    extent_records, bytes(16)))
+        return self.search_next()
+
+
+    def search_next(self) -> int:
+        if not self.search_results:
+            return 0xff
+        entry = self.search_results.pop(0)
+        self.vm.memory[self.dma:self.dma + len(entry)] = entry
+        return 0
+
+
+    def delete_file(self) -> int:
+        paths = self.matches(self.de())
+        for path in paths:
+            self.forget(path)
+            os.remove(path)
+        return 0 if paths else 0xff
+
+
+    def read_sequential(self) -> int:
+        fcb = self.de()
+        f = self.handle(fcb)
+        if f is None:
+            return 9
+        record = self.fcb_record(fcb)
+        result = self.read_record(f, record)
+        if result == 0:
+            self.set_fcb_record(fcb, record + 1, f)
+        return result
+
+
+    def write_sequential(self) -> int:
+        fcb = self.de()
+        f = self.handle(fcb)
+        if f is None:
+            return 9
+        record = self.fcb_record(fcb)
+        result = self.write_record(f, record)
+        if result == 0:
+            self.set_fcb_record(fcb, record + 1, f)
+        return result
+
+
+    def make_file(self) -> int:
+        fcb = self.de()
+        memory = self.vm.memory
+        directory = self.directory(fcb)
+        name = bytes(c & 0x7f for c in memory[fcb + 1:fcb + 12])
+        if directory is None or b'?' in name:
+            return 0xff
+        paths = self.matches(fcb)
+        path = paths[0] if paths else os.path.join(directory, host_filename(name[:8], name[8:]))
+        self.forget(path)
+        try:
+            # Making extent 0 starts a new file; later extents add to it.
+            if memory[fcb + 12] == 0 or not paths:
+                f = open(path, 'w+b')
+            else:
+                f = open(path, 'r+b')
+        except OSError:
+            return 0xff
+        self.handles[path] = f
+        memory[fcb + 14] = 0
+        self.set_fcb_record(fcb, self.fcb_record(fcb), f)
+        return 0
+
+
+    def rename_file(self) -> int:
+        fcb = self.de()
+        directory = self.directory(fcb)
+        paths = self.matches(fcb)
+        name = bytes(c & 0x7f for c in self.vm.memory[fcb + 17:fcb + 28])
+        if directory is None or not paths or b'?' in name:
+            return 0xff
+        self.forget(paths[0])
+        os.replace(paths[0], os.path.join(directory, host_filename(name[:8], name[8:])))
+        return 0
+
+
+    def login_vector(self) -> int:
+        return sum(1 << drive for drive, directory in enumerate(self.directories)
+                   if directory is not None)
+
+
+    def current_disk(self) -> int:
+        return self.drive
+
+
+    def set_dma(self) -> int:
+        self.dma = self.de()
+        return 0
+
+
+    def user_code(self) -> int:
+        e = self.vm.registers['e']
+        if e == 0xff:
+            return self.user
+        self.user = e & 0x0f
+        return 0
+
+
+    def read_random(self) -> int:
+        fcb = self.de()
+        f = self.handle(fcb)
+        if f is None:
+            return 9
+        record = self.random_record(fcb)
+        self.set_fcb_record(fcb, record, f)
+        return self.read_record(f, record)
+
+
+    def write_random(self) -> int:
+        fcb = self.de()
+        f = self.handle(fcb)
+        if f is None:
+            return 9
+        record = self.random_record(fcb)
+        result = self.write_record(f, record)
+        self.set_fcb_record(fcb, record, f)
+        return result
+
+
+    def file_size(self) -> int:
+        fcb = self.de()
+        f = self.handle(fcb)
+        if f is None:
+            return 0xff
+        records = self.file_records(f)
+        self.vm.memory[fcb + 33:fcb + 36] = [records & 0xff, (records >> 8) & 0xff, records >> 16]
+        return 0
+
+
+    def set_random_record(self) -> int:
+        fcb = self.de()
+        record = self.fcb_record(fcb)
+        self.vm.memory[fcb + 33:fcb + 36] = [record & 0xff, (record >> 8) & 0xff, record >> 16]
+        return 0
+
+
+def find_program(program: str, directory: str) -> Optional[str]:
+    for path in [program, program + '.COM', os.path.join(directory, program),
+                 os.path.join(directory, program + '.COM')]:
+        if os.path.isfile(path):
+            return path
+        parent = os.path.dirname(path) or '.'
+        if os.path.isdir(parent):
+            for host_name in os.listdir(parent):
+                if host_name.upper() == os.path.basename(path).upper():
+                    return os.path.join(parent, host_name)
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    for d in range(ord('a'), ord('p') + 1):
+        parser.add_argument(f'-d{chr(d)}', f'--drive_{chr(d)}', type=str,
+                            default='.' if d == ord('a') else None,
+                            help=f'host directory for drive {chr(d).upper()}:'
+                                 + (' (default the current directory)' if d == ord('a') else ''))
+    parser.add_argument('program', help='.COM file, also looked for on drive A:')
+    parser.add_argument('arguments', nargs=argparse.REMAINDER,
+                        help='command line for the program')
+    args = parser.parse_args()
+
+    directories = [getattr(args, f'drive_{chr(d)}') for d in range(ord('a'), ord('p') + 1)]
+    program_file = find_program(args.program, args.drive_a)
+    if program_file is None:
+        parser.error(f'{args.program} not found')
+
+    vm = Virtual8080()
+    vm.io = NullDevice()
+    bdos = CPM_BDOS(vm, directories)
+    with open(program_file, 'rb') as f:
+        bdos.load(f.read(), args.arguments)
+    try:
+        vm.run()
+    finally:
+        bdos.close()
@@ -0,0 +1,143 @@
+# This is free and unencumbered software released into the public domain.
+#
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a compiled
+# binary, for any purpose, commercial or non-commercial, and by any
+# means.
+#
+# In jurisdictions that recognize copyright laws, the author or authors
+# of this software dedicate any and all copyright interest in the
+# software to the public domain. We make this dedication for the benefit
+# of the public at large and to the detriment of our heirs and
+# successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to this
+# software under copyright law.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# For more information, please refer to <https://unlicense.org>
+
+"""Headless front end for the CP/M machine.
+
+Reads the keyboard from stdin and translates the ADM-3A control codes the
+guest sends into ANSI escape sequences on stdout, so CP/M can run over SSH,
+in containers, or under batch automation without PyGame."""
+
+
+import sys
+import threading
+from typing import Any, BinaryIO, List, Optional
+
+from kbhit import KBHit
+
+from virtual8080 import Virtual8080
+from cpm import CPM_Machine
+
+
+class CPM_Console:
+
+    batch_size = 10000      # Instructions to run between output flushes
+    idle_wait = 0.1         # Seconds to sleep at a time while CP/M waits for a key
+
+    def __init__(self,
+                 disk_images: List[str] = [],
+                 out: Optional[BinaryIO] = None,
+                 **machine_options: Any):
+        self.disk_images: List[str] = disk_images
+        self.machine_options = machine_options     # Passed on to CPM_Machine
+        self.out: BinaryIO = out if out is not None else sys.stdout.buffer
+        self.ansi: bool = self.out.isatty()
+        self.out_buffer: bytearray = bytearray()
+        self.esc_sequence: bytes = b''
+        self.input_eof: bool = False
+        self.input_arrived = threading.Event()
+
+
+    def putch(self, ch: int) -> None:
+        ## ADM-3A cursor control, translated to ANSI
+        ch = ch & 0b01111111
+        if ch == 27:      # Esc
+            self.esc_sequence = b'\x1b'
+        elif len(self.esc_sequence) > 0:
+            self.esc_sequence += bytes([ch])
+            if not self.esc_sequence.startswith(b'\x1b='):
+                self.esc_sequence = b''     # Not something an ADM-3A knows
+            elif len(self.esc_sequence) >= 4:
+                y = self.esc_sequence[2] - 0x20
+                x = self.esc_sequence[3] - 0x20
+                if self.ansi:
+                    self.out_buffer += b'\x1b[%d;%dH' % (y + 1, x + 1)
+                self.esc_sequence = b''
+
+        elif ch == 8:         # ^H
+            self.out_buffer += b'\x1b[D' if self.ansi else b'\b'
+        elif ch == 10:         # ^J, \n
+            self.out_buffer += b'\x1bD' if self.ansi else b'\n'
+        elif ch == 11:         # ^K
+            if self.ansi:
+                self.out_buffer += b'\x1b[A'
+        elif ch == 12:         # ^L
+            if self.ansi:
+                self.out_buffer += b'\x1b[C'
+        elif ch == 13:      # \r
+            self.out_buffer += b'\r'
+        elif ch == 26:      # ^Z
+            if self.ansi:
+                self.out_buffer += b'\x1b[H\x1b[2J'
+        elif ch == 30:      # Home
+            if self.ansi:
+                self.out_buffer += b'\x1b[H'
+
+        elif 32 <= ch < 127 or ch == 7: # Printable, bell
+            self.out_buffer.append(ch)
+
+
+    def flush(self) -> None:
+        if len(self.out_buffer) > 0:
+            self.out.write(self.out_buffer)
+            self.out.flush()
+            self.out_buffer.clear()
+
+
+    def on_input(self, machine: CPM_Machine, keys: bytes) -> None:
+        # Enter arrives as \n and backspace as DEL from a terminal.
+        if keys == b'':
+            self.input_eof = True   # Piped input is exhausted
+        else:
+            machine.input_queue.push(keys.replace(b'\n', b'\r').replace(b'\x7f', b'\x08'))
+        self.input_arrived.set()
+
+
+    def run(self) -> None:
+        vm = Virtual8080()
+        vm.io = CPM_Machine(vm, self.disk_images, **self.machine_options)
+
+        kb = KBHit()
+        kb.start_reader(lambda keys: self.on_input(vm.io, keys))
+        try:
+            vm.halted = False
+            vm.io.warp()
+            while not vm.halted:
+                reason, _ = vm.run_slice(self.batch_size)
+                for ch in vm.io.drain_output():
+                    self.putch(ch)
+                self.flush()
+                if reason == 'idle':
+                    # CP/M is waiting for a key: sleep until one comes, or
+                    # stop if none ever will
+                    if self.input_eof and len(vm.io.input_queue) == 0:
+                        break
+                    self.input_arrived.wait(self.idle_wait)
+                    self.input_arrived.clear()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.flush()
+            kb.set_normal_term()
+            vm.io.close()
@@ -23,61 +23,503 @@
 #
 # For more information, please refer to <https://unlicense.org>
 
-from typing import List, Optional, Union
+import mmap
+import os
+import struct
+import threading
+from typing import BinaryIO, Dict, List, Optional, Set, Tuple, Union
+
+
+# Disk geometries by name: (sector size, sectors per track, tracks, skew). The
+# BIOS skews the floppy's sectors itself, so images are stored unskewed. The
+# order matters: the disk controller reports a drive's format by its index.
+DISK_FORMATS: Dict[str, Tuple[int, int, int, int]] = {
+    'ibm-3740': (128, 26, 77, 1),     # 8" single-sided single-density, 250 KB
+    'hd4m': (512, 32, 256, 1),        # 4 MB hard disk
+    'hd8m': (512, 32, 512, 1),        # 8 MB hard disk
+}
+
+
+# How CP/M lays out each format, matching the DPBs and translate tables in the
+# BIOSes: (block size, directory entries, reserved tracks, skew).
+DISK_PARAMETERS: Dict[str, Tuple[int, int, int, int]] = {
+    'ibm-3740': (1024, 64, 2, 6),
+    'hd4m': (4096, 1024, 0, 1),
+    'hd8m': (4096, 1024, 0, 1),
+}
+
+# A directory entry: user, name, type, extent (low), S1, extent (high), records
+# in the last extent, then the block pointers.
+DIR_ENTRY = struct.Struct('<B8s3sBBBB16s')
+DIR_ENTRY_SIZE = 32
+RECORD_SIZE = 128
+EMPTY = 0xe5    # User number of an unused directory entry
+
+
+def disk_parameters(disk_format: str) -> Dict[str, int]:
+    sector_size, sectors_per_track, num_tracks, _ = DISK_FORMATS[disk_format]
+    block_size, dir_entries, reserved_tracks, skew = DISK_PARAMETERS[disk_format]
+    num_blocks = (num_tracks - reserved_tracks) * sectors_per_track * sector_size // block_size
+    wide = num_blocks > 256     # 16-bit block pointers
+    pointers = 8 if wide else 16
+    return {
+        'sector_size': sector_size,
+        'sectors_per_track': sectors_per_track,
+        'num_tracks': num_tracks,
+        'block_size': block_size,
+        'dir_entries': dir_entries,
+        'reserved_tracks': reserved_tracks,
+        'reserved_bytes': reserved_tracks * sectors_per_track * sector_size,
+        'skew': skew,
+        'num_blocks': num_blocks,
+        'dir_blocks': dir_entries * DIR_ENTRY_SIZE // block_size,
+        'wide': wide,
+        'pointers': pointers,       # Block pointers per directory entry
+        'extent_mask': pointers * block_size // (16 * 1024) - 1,
+    }
+
+
+def record_location(params: Dict[str, int], skew_table: List[int], record: int) -> Tuple[int, int]:
+    # Track and physical sector holding the sector-sized record of the data
+    # area, given make_skew_table(sectors_per_track, skew).
+    track, logical_sector = divmod(record, params['sectors_per_track'])
+    return params['reserved_tracks'] + track, skew_table[logical_sector]
+
+
+def cpm_filename(host_name: str) -> Optional[Tuple[bytes, bytes]]:
+    # 'readme.txt' -> (b'README  ', b'TXT'), or None if it isn't an 8.3 name.
+    name, _, ext = host_name.upper().rpartition('.')
+    if name == '':
+        name, ext = ext, ''
+    if not 1 <= len(name) <= 8 or len(ext) > 3:
+        return None
+    for c in name + ext:
+        if not (c.isascii() and c.isprintable()) or c in ' .,;:=?*[]<>|':
+            return None
+    return name.ljust(8).encode('ascii'), ext.ljust(3).encode('ascii')
+
+
+def host_filename(name: bytes, ext: bytes) -> str:
+    # (b'README  ', b'TXT') -> 'README.TXT', ignoring attribute bits.
+    name_str = bytes(c & 0x7f for c in name).decode('ascii').rstrip()
+    ext_str = bytes(c & 0x7f for c in ext).decode('ascii').rstrip()
+    return name_str + '.' + ext_str if ext_str else name_str
+
+
+def pack_dir_entries(params: Dict[str, int], user: int, name: bytes, ext: bytes,
+                     records: int, blocks: List[int]) -> List[bytes]:
+    # The directory entries for a file of records records stored in blocks.
+    records_per_entry = params['pointers'] * params['block_size'] // RECORD_SIZE
+    pointers = params['pointers']
+    entries = []
+    for i in range(max(1, (len(blocks) + pointers - 1) // pointers)):
+        entry_records = min(max(records - i * records_per_entry, 0), records_per_entry)
+        # The entry's extent number is that of the last logical extent it holds.
+        extent = i * (params['extent_mask'] + 1) + max(entry_records - 1, 0) // 128
+        last_records = entry_records - max(entry_records - 1, 0) // 128 * 128
+        entry_blocks = blocks[i * pointers:(i + 1) * pointers]
+        entry_blocks += [0] * (pointers - len(entry_blocks))
+        if params['wide']:
+            allocation = struct.pack('<8H', *entry_blocks)
+        else:
+            allocation = bytes(entry_blocks)
+        entries.append(DIR_ENTRY.pack(user, name, ext, extent & 0x1f, 0, extent >> 5,
+                                      last_records, allocation))
+    return entries
+
+
+def read_directory(params: Dict[str, int], directory: bytes) -> Dict[Tuple[int, bytes, bytes], Tuple[int, List[int]]]:
+    # Collects the entries in directory into files:
+    # (user, name, type) -> (records, blocks in order).
+    extents: Dict[Tuple[int, bytes, bytes], List[Tuple[int, int, List[int]]]] = {}
+    for offset in range(0, len(directory) - DIR_ENTRY_SIZE + 1, DIR_ENTRY_SIZE):
+        user, name, ext, ex, _, s2, rc, allocation = DIR_ENTRY.unpack_from(directory, offset)
+        if user > 15:
+            continue    # Unused, or not a file
+        if params['wide']:
+            pointers = list(struct.unpack('<8H', allocation))
+        else:
+            pointers = list(allocation)
+        key = (user, bytes(c & 0x7f for c in name), bytes(c & 0x7f for c in ext))
+        extent = (s2 & 0x3f) << 5 | (ex & 0x1f)
+        extents.setdefault(key, []).append((extent, rc, [b for b in pointers if b != 0]))
+    files = {}
+    for key, file_extents in extents.items():
+        file_extents.sort()
+        last_extent, last_records, _ = file_extents[-1]
+        records = last_extent * 128 + last_records
+        blocks = [b for _, _, entry_blocks in file_extents for b in entry_blocks]
+        files[key] = (records, blocks)
+    return files
+
+
+# Write-protected images are mapped once per process and shared by every disk
+# that opens them: path and size -> [file, data, number of disks using it].
+shared_images: Dict[Tuple[str, int], list] = {}
+shared_images_lock = threading.Lock()
+
+
+def map_shared_image(image_file: str, total_bytes: int) -> Union[mmap.mmap, bytearray]:
+    key = (os.path.realpath(image_file), total_bytes)
+    with shared_images_lock:
+        entry = shared_images.get(key)
+        if entry is None:
+            f = open(image_file, 'rb')
+            size = os.fstat(f.fileno()).st_size
+            data: Union[mmap.mmap, bytearray]
+            if size >= total_bytes:
+                data = mmap.mmap(f.fileno(), total_bytes, access=mmap.ACCESS_READ)
+            else:
+                # Short image: pad a copy in memory
+                data = bytearray(f.read())
+                data += bytes([0xe5 for _ in range(total_bytes - size)])
+            entry = [f, data, 0]
+            shared_images[key] = entry
+        entry[2] += 1
+        return entry[1]
+
+
+def unmap_shared_image(image_file: str, total_bytes: int) -> None:
+    key = (os.path.realpath(image_file), total_bytes)
+    with shared_images_lock:
+        entry = shared_images[key]
+        entry[2] -= 1
+        if entry[2] == 0:
+            del shared_images[key]
+            if isinstance(entry[1], mmap.mmap):
+                entry[1].close()
+            entry[0].close()
 
 
 class CPM_Disk:
 
+    # When to write changed sectors back to the image file: after every write,
+    # when the machine is idle, every so often from a DiskFlusher thread, or
+    # only when the disk is closed.
+    flush_policies = ('immediate', 'idle', 'background', 'exit')
+
     def __init__(self,
                  image_file: str,
                  sector_size: int,
                  sectors_per_track: int,
                  num_tracks: int,
                  skew: Union[int, List[int]],
-                 write_protect: bool = False):
+                 write_protect: bool = False,
+                 flush_policy: str = 'immediate',
+                 fsync: bool = False):
+        if flush_policy not in self.flush_policies:
+            raise ValueError
         self.image_file: str = image_file
         self.sector_size: int = sector_size
         self.sectors_per_track: int = sectors_per_track
+        self.num_tracks: int = num_tracks
         self.write_protect: bool = write_protect
-        self.disk_tracks: List[List[bytes]] = []
+        self.flush_policy: str = flush_policy
+        self.fsync: bool = fsync        # Also fsync() the image file on every flush
+        self.dirty: Set[int] = set()    # Offsets of sectors changed since the last flush
+        self.lock = threading.Lock()    # Keeps flushes from seeing half-written sectors
         self.skew_table: List[int]
 
-        with open(image_file, 'rb') as f:
-            disk_bytes = f.read()
-        total_bytes = sector_size * sectors_per_track * num_tracks
-        disk_bytes += bytes([0xe5 for _ in range(total_bytes - len(disk_bytes))])
-        for _ in range(num_tracks):
-            tmp_track: List[bytes] = []
-            for _ in range(sectors_per_track):
-                tmp_sect = disk_bytes[0:sector_size]
-                disk_bytes = disk_bytes[sector_size:]
-                tmp_track.append(tmp_sect)
-            self.disk_tracks.append(tmp_track)
-        
+        self.total_bytes: int = sector_size * sectors_per_track * num_tracks
+        self.file: Optional[BinaryIO] = None
+        self.file_size: int = 0
+        self.writable: bool = True      # False if the image file is read-only
+        self.data: Union[mmap.mmap, bytearray] = self.map_image()
+        self.view: memoryview = memoryview(self.data)
+        self.closed: bool = False
+
         if isinstance(skew, int):
             self.skew_table = make_skew_table(sectors_per_track, skew)
         else:
             self.skew_table = skew
-    
 
-    def get_sector(self, track: int, sector: int) -> bytes:
+
+    def map_image(self) -> Union[mmap.mmap, bytearray]:
+        # Map the image file rather than reading it, so only the sectors that
+        # are used get paged in, and a write touches only its own sector.
+        if self.write_protect:
+            return map_shared_image(self.image_file, self.total_bytes)
+        try:
+            self.file = open(self.image_file, 'r+b')
+        except PermissionError:
+            # Usable until the guest writes to it, which is a disk error
+            self.file = open(self.image_file, 'rb')
+            self.writable = False
+        self.file_size = os.fstat(self.file.fileno()).st_size
+        if self.file_size < self.total_bytes:
+            # Short image: pad a copy in memory, and only grow the file when
+            # a sector past its end is written
+            data = bytearray(self.file.read())
+            data += bytes([0xe5 for _ in range(self.total_bytes - self.file_size)])
+            return data
+        access = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+        return mmap.mmap(self.file.fileno(), self.total_bytes, access=access)
+
+
+    def unmap_image(self) -> None:
+        if self.file is None:
+            unmap_shared_image(self.image_file, self.total_bytes)
+        else:
+            if isinstance(self.data, mmap.mmap):
+                self.data.close()
+            self.file.close()
+
+
+    def sector_offset(self, track: int, sector: int) -> int:
         raw_sector = self.skew_table[sector - 1] - 1
-        return self.disk_tracks[track][raw_sector]
-    
+        return (track * self.sectors_per_track + raw_sector) * self.sector_size
+
+
+    def get_sector(self, track: int, sector: int) -> memoryview:
+        offset = self.sector_offset(track, sector)
+        return self.view[offset:offset + self.sector_size]
+
 
     def set_sector(self, track: int, sector: int, sector_data: bytes) -> None:
         if not self.write_protect:
-            raw_sector = self.skew_table[sector - 1] - 1
-            self.disk_tracks[track][raw_sector] = sector_data
-    
+            if not self.writable:
+                raise PermissionError(self.image_file)
+            offset = self.sector_offset(track, sector)
+            sector_data = sector_data[:self.sector_size]
+            with self.lock:
+                self.view[offset:offset + len(sector_data)] = sector_data
+                self.dirty.add(offset)
+            # A store into the mapping is already in the file as far as
+            # anyone reading it can tell, so unless it's to be fsynced there's
+            # nothing more to do until the disk is flushed.
+            if (self.flush_policy == 'immediate'
+                    and (self.fsync or not isinstance(self.data, mmap.mmap))):
+                self.flush()
+
+
+    def flush(self) -> None:
+        # Repeated writes to a sector since the last flush are written once.
+        if len(self.dirty) == 0:
+            return
+        with self.lock:
+            if not isinstance(self.data, mmap.mmap):
+                if self.file is not None:
+                    self.write_back()
+            else:
+                # Sync only the pages holding changed sectors.
+                page_size = mmap.ALLOCATIONGRANULARITY
+                pages: Set[int] = set()
+                for offset in self.dirty:
+                    pages.add(offset // page_size)
+                    pages.add((offset + self.sector_size - 1) // page_size)
+                for page in sorted(pages):
+                    start = page * page_size
+                    self.data.flush(start, min(page_size, len(self.data) - start))
+            if self.fsync and self.file is not None:
+                os.fsync(self.file.fileno())
+            self.dirty.clear()
+
+
+    def write_back(self) -> None:
+        # Write the changed sectors of a short image, padding the file up to
+        # any that lie past its end.
+        assert self.file is not None
+        for offset in sorted(self.dirty):
+            if offset > self.file_size:
+                self.file.seek(self.file_size)
+                self.file.write(self.view[self.file_size:offset])
+            self.file.seek(offset)
+            self.file.write(self.view[offset:offset + self.sector_size])
+            self.file_size = max(self.file_size, offset + self.sector_size)
+        self.file.flush()
+
 
     def save_image(self, image_file: Optional[str] = None) -> None:
         if image_file is None:
-            image_file = self.image_file
+            self.flush()
+            return
         with open(image_file, 'wb') as f:
-            for track in self.disk_tracks:
-                for sector in track:
-                    f.write(sector)
+            f.write(self.view)
+
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.flush()
+        self.view.release()
+        self.unmap_image()
+        self.closed = True
+
+
+class OverlayDisk(CPM_Disk):
+    """A copy-on-write disk: the base image is shared read-only, and sectors
+    written are kept apart in a delta, in memory or, given delta_file, also
+    in a file of (offset, sector) records that's reloaded on the next open.
+    commit() writes the delta into the base image; discard() drops it."""
+
+    record_header = struct.Struct('<I')     # Offset of the sector that follows
+    # Rewrite the delta file with only the latest copy of each sector once
+    # it holds this many records for each sector
+    compact_factor = 4
+
+    def __init__(self,
+                 image_file: str,
+                 sector_size: int,
+                 sectors_per_track: int,
+                 num_tracks: int,
+                 skew: Union[int, List[int]],
+                 delta_file: Optional[str] = None,
+                 flush_policy: str = 'immediate',
+                 fsync: bool = False):
+        super().__init__(image_file, sector_size, sectors_per_track, num_tracks, skew,
+                         write_protect=True, flush_policy=flush_policy, fsync=fsync)
+        self.delta: Dict[int, bytes] = {}
+        self.delta_file: Optional[BinaryIO] = None
+        self.delta_path: Optional[str] = delta_file
+        self.delta_records: int = 0     # Records in the delta file
+        if delta_file is not None:
+            self.delta_file = open(delta_file, 'a+b')
+            self.delta_file.seek(0)
+            while True:
+                header = self.delta_file.read(self.record_header.size)
+                sector_data = self.delta_file.read(sector_size)
+                if len(sector_data) < sector_size:
+                    break   # End of file, or a record cut short
+                offset, = self.record_header.unpack(header)
+                self.delta[offset] = sector_data
+                self.delta_records += 1
+
+
+    def get_sector(self, track: int, sector: int) -> memoryview:
+        offset = self.sector_offset(track, sector)
+        sector_data = self.delta.get(offset)
+        if sector_data is not None:
+            return memoryview(sector_data)
+        return self.view[offset:offset + self.sector_size]
+
+
+    def set_sector(self, track: int, sector: int, sector_data: bytes) -> None:
+        offset = self.sector_offset(track, sector)
+        new_data = bytearray(self.get_sector(track, sector))
+        new_data[:len(sector_data)] = sector_data[:self.sector_size]
+        with self.lock:
+            self.delta[offset] = bytes(new_data)
+            self.dirty.add(offset)
+        if self.flush_policy == 'immediate':
+            self.flush()
+
+
+    def flush(self) -> None:
+        if len(self.dirty) == 0:
+            return
+        with self.lock:
+            if self.delta_file is not None:
+                for offset in sorted(self.dirty):
+                    self.delta_file.write(self.record_header.pack(offset))
+                    self.delta_file.write(self.delta[offset])
+                self.delta_file.flush()
+                if self.fsync:
+                    os.fsync(self.delta_file.fileno())
+                self.delta_records += len(self.dirty)
+                if self.delta_records > self.compact_factor * len(self.delta):
+                    self.compact()
+            self.dirty.clear()
+
+
+    def compact(self) -> None:
+        # Rewrite the delta file with just the live sectors, through a new
+        # file so the old one is intact until it's done. Called with the
+        # lock held.
+        assert self.delta_file is not None and self.delta_path is not None
+        new_file = self.delta_path + '.new'
+        with open(new_file, 'wb') as f:
+            for offset, sector_data in sorted(self.delta.items()):
+                f.write(self.record_header.pack(offset))
+                f.write(sector_data)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self.delta_file.close()
+        os.replace(new_file, self.delta_path)
+        self.delta_file = open(self.delta_path, 'a+b')
+        self.delta_records = len(self.delta)
+
+
+    def commit(self) -> None:
+        # Write the delta into the base image. Other disks sharing the base
+        # see the change.
+        with self.lock:
+            with open(self.image_file, 'r+b') as f:
+                for offset, sector_data in sorted(self.delta.items()):
+                    f.seek(offset)
+                    f.write(sector_data)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+        self.discard()
+
+
+    def discard(self) -> None:
+        with self.lock:
+            self.delta.clear()
+            self.dirty.clear()
+            if self.delta_file is not None:
+                self.delta_file.truncate(0)
+                self.delta_file.flush()
+                self.delta_records = 0
+
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        super().close()
+        if self.delta_file is not None:
+            with self.lock:
+                if self.delta_records > len(self.delta):
+                    self.compact()
+            self.delta_file.close()
+
+
+class RamDisk(CPM_Disk):
+    """A disk that lives in host memory, starting out empty. Its contents are
+    written to dump_file when it's closed, if given, and lost otherwise."""
+
+    def __init__(self,
+                 sector_size: int,
+                 sectors_per_track: int,
+                 num_tracks: int,
+                 skew: Union[int, List[int]],
+                 dump_file: Optional[str] = None):
+        self.dump_file: Optional[str] = dump_file
+        super().__init__(dump_file or '', sector_size, sectors_per_track, num_tracks, skew,
+                         flush_policy='exit')
+
+
+    def map_image(self) -> bytearray:
+        return bytearray(b'\xe5') * self.total_bytes
+
+
+    def unmap_image(self) -> None:
+        if self.dump_file is not None:
+            with open(self.dump_file, 'wb') as f:
+                f.write(self.data)
+
+
+class DiskFlusher(threading.Thread):
+    """Writes back disks' changed sectors every interval seconds, off the
+    emulator's thread, and once more when stopped."""
+
+    def __init__(self, disks: List[CPM_Disk], interval: float = 1.0):
+        super().__init__(daemon=True)
+        self.disks: List[CPM_Disk] = disks
+        self.interval: float = interval
+        self.stopping = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopping.wait(self.interval):
+            for disk in self.disks:
+                disk.flush()
+
+    def stop(self) -> None:
+        self.stopping.set()
+        self.join()
+        for disk in self.disks:
+            disk.flush()
 
 
 def make_skew_table(num_sectors: int, skew_factor: int) -> List[int]:
@@ -92,3 +534,13 @@ def make_skew_table(num_sectors: int, skew_factor: int) -> List[int]:
 if __name__ == '__main__':
     skew_table = make_skew_table(26, 6)
     assert(skew_table == [1,7,13,19,25,5,11,17,23,3,9,15,21,2,8,14,20,26,6,12,18,24,4,10,16,22])
+
+    assert(cpm_filename('readme.txt') == (b'README  ', b'TXT'))
+    assert(cpm_filename('toolongname.c') is None)
+    assert(host_filename(b'STAT    ', b'C' + bytes([ord('O') | 0x80]) + b'M') == 'STAT.COM')
+    for disk_format, size in (('ibm-3740', 40000), ('hd8m', 100000), ('hd8m', 0)):
+        params = disk_parameters(disk_format)
+        records = (size + RECORD_SIZE - 1) // RECORD_SIZE
+        blocks = list(range(params['dir_blocks'], params['dir_blocks'] + (size + params['block_size'] - 1) // params['block_size']))
+        entries = pack_dir_entries(params, 0, b'TEST    ', b'DAT', records, blocks)
+        assert(read_directory(params, b''.join(entries)) == {(0, b'TEST    ', b'DAT'): (records, blocks)})
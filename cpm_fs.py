@@ -0,0 +1,238 @@
+# This is free and unencumbered software released into the public domain.
+#
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a compiled
+# binary, for any purpose, commercial or non-commercial, and by any
+# means.
+#
+# In jurisdictions that recognize copyright laws, the author or authors
+# of this software dedicate any and all copyright interest in the
+# software to the public domain. We make this dedication for the benefit
+# of the public at large and to the detriment of our heirs and
+# successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to this
+# software under copyright law.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# For more information, please refer to <https://unlicense.org>
+
+"""List, extract and add files on CP/M disk images without running CP/M.
+
+    python cpm_fs.py ls IMAGE...
+    python cpm_fs.py get IMAGE... [-f NAME...] [-o DIR]
+    python cpm_fs.py put IMAGE... -f FILE..."""
+
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+from typing import Dict, List, Optional, Set, Tuple
+
+from cpm_disk import (CPM_Disk, DISK_FORMATS, DIR_ENTRY_SIZE, EMPTY, RECORD_SIZE,
+                      cpm_filename, disk_parameters, host_filename, make_skew_table,
+                      pack_dir_entries, read_directory, record_location)
+
+
+class CPM_FileSystem:
+    """The files on a CP/M disk.
+
+    The directory is read once, into an index from each file to its
+    directory entries, records and blocks. Files are read and written a
+    block at a time, and only the directory sectors that change are written
+    back."""
+
+    def __init__(self, disk: CPM_Disk, disk_format: str = 'ibm-3740'):
+        self.disk: CPM_Disk = disk
+        self.params: Dict[str, int] = disk_parameters(disk_format)
+        self.skew_table: List[int] = make_skew_table(self.params['sectors_per_track'],
+                                                     self.params['skew'])
+        self.sectors_per_block: int = self.params['block_size'] // self.params['sector_size']
+
+        self.directory: bytearray = bytearray(self.read_blocks(range(self.params['dir_blocks'])))
+        # (user, name, type) -> (records, blocks)
+        self.files: Dict[Tuple[int, bytes, bytes], Tuple[int, List[int]]] = read_directory(
+            self.params, self.directory)
+        # (user, name, type) -> its directory entries
+        self.entries: Dict[Tuple[int, bytes, bytes], List[int]] = {}
+        self.free_entries: List[int] = []
+        for i in range(self.params['dir_entries']):
+            user = self.directory[i * DIR_ENTRY_SIZE]
+            if user == EMPTY:
+                self.free_entries.append(i)
+            elif user <= 15:
+                name = bytes(c & 0x7f for c in self.directory[i * DIR_ENTRY_SIZE + 1:i * DIR_ENTRY_SIZE + 9])
+                ext = bytes(c & 0x7f for c in self.directory[i * DIR_ENTRY_SIZE + 9:i * DIR_ENTRY_SIZE + 12])
+                self.entries.setdefault((user, name, ext), []).append(i)
+        used = {block for _, blocks in self.files.values() for block in blocks}
+        self.free_blocks: Set[int] = set(range(self.params['dir_blocks'], self.params['num_blocks'])) - used
+
+
+    @classmethod
+    def open(cls, image_file: str, disk_format: str = 'ibm-3740',
+             write_protect: bool = False) -> 'CPM_FileSystem':
+        disk = CPM_Disk(image_file, *DISK_FORMATS[disk_format],
+                        write_protect=write_protect, flush_policy='exit')
+        return cls(disk, disk_format)
+
+
+    def close(self) -> None:
+        self.disk.close()
+
+
+    def block_sectors(self, block: int) -> List[Tuple[int, int]]:
+        first = block * self.sectors_per_block
+        return [record_location(self.params, self.skew_table, first + i)
+                for i in range(self.sectors_per_block)]
+
+
+    def read_blocks(self, blocks) -> bytes:
+        return b''.join(self.disk.get_sector(track, sector)
+                        for block in blocks
+                        for track, sector in self.block_sectors(block))
+
+
+    def write_block(self, block: int, data: bytes) -> None:
+        sector_size = self.params['sector_size']
+        for i, (track, sector) in enumerate(self.block_sectors(block)):
+            self.disk.set_sector(track, sector, data[i * sector_size:(i + 1) * sector_size])
+
+
+    def write_entries(self, entries: List[int]) -> None:
+        # Write back the directory sectors holding entries.
+        sector_size = self.params['sector_size']
+        for record in sorted({entry * DIR_ENTRY_SIZE // sector_size for entry in entries}):
+            track, sector = record_location(self.params, self.skew_table, record)
+            self.disk.set_sector(track, sector,
+                                 bytes(self.directory[record * sector_size:(record + 1) * sector_size]))
+
+
+    def key(self, filename: str, user: int = 0) -> Tuple[int, bytes, bytes]:
+        name = cpm_filename(filename)
+        if name is None:
+            raise ValueError(filename)
+        return user, name[0], name[1]
+
+
+    def ls(self) -> List[Tuple[int, str, int]]:
+        # (user, file name, size in bytes) of every file
+        return [(user, host_filename(name, ext), records * RECORD_SIZE)
+                for (user, name, ext), (records, _) in sorted(self.files.items())]
+
+
+    def get(self, filename: str, user: int = 0) -> bytes:
+        records, blocks = self.files[self.key(filename, user)]
+        return self.read_blocks(blocks)[:records * RECORD_SIZE]
+
+
+    def erase(self, filename: str, user: int = 0) -> None:
+        key = self.key(filename, user)
+        _, blocks = self.files.pop(key)
+        entries = self.entries.pop(key)
+        for entry in entries:
+            self.directory[entry * DIR_ENTRY_SIZE] = EMPTY
+        self.write_entries(entries)
+        self.free_entries = sorted(self.free_entries + entries)
+        self.free_blocks.update(blocks)
+
+
+    def put(self, filename: str, data: bytes, user: int = 0) -> None:
+        # Add a file, replacing any file of the same name.
+        key = self.key(filename, user)
+        block_size = self.params['block_size']
+        records = (len(data) + RECORD_SIZE - 1) // RECORD_SIZE
+        data = data + b'\x1a' * (records * RECORD_SIZE - len(data))
+        num_blocks = (len(data) + block_size - 1) // block_size
+        num_entries = max(1, (num_blocks + self.params['pointers'] - 1) // self.params['pointers'])
+        # Check that it fits, counting what the file it replaces would free,
+        # before touching the old file
+        free_blocks, free_entries = len(self.free_blocks), len(self.free_entries)
+        if key in self.files:
+            free_blocks += len(self.files[key][1])
+            free_entries += len(self.entries[key])
+        if num_blocks > free_blocks:
+            raise OSError(f'{self.disk.image_file}: disk full')
+        if num_entries > free_entries:
+            raise OSError(f'{self.disk.image_file}: directory full')
+
+        if key in self.files:
+            self.erase(filename, user)
+        blocks = sorted(self.free_blocks)[:num_blocks]
+        packed = pack_dir_entries(self.params, user, key[1], key[2], records, blocks)
+
+        for i, block in enumerate(blocks):
+            chunk = data[i * block_size:(i + 1) * block_size]
+            self.write_block(block, chunk + b'\x1a' * (block_size - len(chunk)))
+        entries = self.free_entries[:len(packed)]
+        del self.free_entries[:len(packed)]
+        for entry, entry_data in zip(entries, packed):
+            self.directory[entry * DIR_ENTRY_SIZE:(entry + 1) * DIR_ENTRY_SIZE] = entry_data
+        self.write_entries(entries)
+        self.free_blocks.difference_update(blocks)
+        self.files[key] = (records, blocks)
+        self.entries[key] = entries
+
+
+def run_command(command: str, image_file: str, disk_format: str, user: int,
+                files: List[str], out_dir: Optional[str]) -> str:
+    # Runs one command on one image, returning what to print.
+    lines = []
+    fs = CPM_FileSystem.open(image_file, disk_format, write_protect=(command != 'put'))
+    try:
+        if command == 'ls':
+            for file_user, filename, size in fs.ls():
+                lines.append(f'{image_file}: {file_user:2}:{filename:12} {size:8}')
+        elif command == 'get':
+            names = files or [filename for file_user, filename, _ in fs.ls() if file_user == user]
+            for filename in names:
+                path = os.path.join(out_dir or '.', filename)
+                with open(path, 'wb') as f:
+                    f.write(fs.get(filename, user))
+                lines.append(f'{image_file}: {filename} -> {path}')
+        elif command == 'put':
+            for path in files:
+                with open(path, 'rb') as f:
+                    fs.put(os.path.basename(path), f.read(), user)
+                lines.append(f'{path} -> {image_file}')
+    finally:
+        fs.close()
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['ls', 'get', 'put'])
+    parser.add_argument('images', nargs='+', help='disk images')
+    parser.add_argument('-f', '--files', nargs='+', default=[],
+                        help='files to get (default all) or put')
+    parser.add_argument('-o', '--out-dir', default=None,
+                        help='where to put files gotten, in a directory per image '
+                             'if there are several images')
+    parser.add_argument('--format', choices=DISK_FORMATS, default='ibm-3740')
+    parser.add_argument('--user', type=int, default=0, help='user area (default 0)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='images to work on at once (default one per CPU)')
+    args = parser.parse_args()
+
+    out_dirs: List[Optional[str]] = [args.out_dir for _ in args.images]
+    if args.command == 'get' and len(args.images) > 1:
+        out_dirs = [os.path.join(args.out_dir or '.', os.path.splitext(os.path.basename(image))[0])
+                    for image in args.images]
+    for out_dir in out_dirs:
+        if out_dir is not None and args.command == 'get':
+            os.makedirs(out_dir, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        results = executor.map(run_command,
+                               [args.command for _ in args.images], args.images,
+                               [args.format for _ in args.images], [args.user for _ in args.images],
+                               [args.files for _ in args.images], out_dirs)
+        for result in results:
+            if result:
+                print(result)
@@ -0,0 +1,263 @@
+# This is free and unencumbered software released into the public domain.
+#
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a compiled
+# binary, for any purpose, commercial or non-commercial, and by any
+# means.
+#
+# In jurisdictions that recognize copyright laws, the author or authors
+# of this software dedicate any and all copyright interest in the
+# software to the public domain. We make this dedication for the benefit
+# of the public at large and to the detriment of our heirs and
+# successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to this
+# software under copyright law.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# For more information, please refer to <https://unlicense.org>
+
+"""A CP/M drive backed by a directory on the host."""
+
+
+import os
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from cpm_disk import (CPM_Disk, DISK_FORMATS, DIR_ENTRY_SIZE, EMPTY, RECORD_SIZE,
+                      cpm_filename, disk_parameters, host_filename, make_skew_table,
+                      pack_dir_entries, read_directory)
+
+
+class HostDirDisk(CPM_Disk):
+    """Shows the files in a host directory as a CP/M disk.
+
+    The CP/M directory is built from the host files the first time the disk
+    is used, laying each file out in consecutive blocks. Data sectors are
+    read from and written to the host files in place. When CP/M writes the
+    directory, the changes are carried over to the host: files are created,
+    extended, renamed and deleted to match. Only user 0 is mirrored; files
+    in other user areas, and the system tracks, are kept in memory."""
+
+    max_handles = 32    # Host files to keep open
+
+    def __init__(self,
+                 directory: str,
+                 disk_format: str = 'ibm-3740',
+                 flush_policy: str = 'immediate',
+                 fsync: bool = False):
+        self.params: Dict[str, int] = disk_parameters(disk_format)
+        super().__init__(directory, *DISK_FORMATS[disk_format],
+                         flush_policy=flush_policy, fsync=fsync)
+
+        # Physical sector -> position on the track as CP/M sees it
+        skew_table = make_skew_table(self.sectors_per_track, self.params['skew'])
+        self.logical_sector: List[int] = [0 for _ in skew_table]
+        for logical, physical in enumerate(skew_table):
+            self.logical_sector[physical - 1] = logical
+
+        self.directory_data: Optional[bytearray] = None     # Built on first use
+        # CP/M name and type -> (host file name, records, blocks)
+        self.files: Dict[Tuple[bytes, bytes], Tuple[str, int, List[int]]] = {}
+        # Block -> host file and offset it's read from, if any
+        self.block_source: List[Optional[Tuple[str, int]]] = [None for _ in range(self.params['num_blocks'])]
+        self.pending: Dict[int, bytearray] = {}     # Blocks written that no host file holds yet
+        self.handles: Dict[str, BinaryIO] = {}
+
+
+    def map_image(self) -> bytearray:
+        # Only the system tracks are kept as an image.
+        return bytearray([EMPTY]) * self.params['reserved_bytes']
+
+
+    def unmap_image(self) -> None:
+        self.close_handles()
+
+
+    def data_offset(self, track: int, sector: int) -> int:
+        # Offset of a sector in CP/M's data area, or -1 on the system tracks.
+        if track < self.params['reserved_tracks']:
+            return -1
+        record = ((track - self.params['reserved_tracks']) * self.sectors_per_track
+                  + self.logical_sector[sector - 1])
+        return record * self.sector_size
+
+
+    def handle(self, host_name: str) -> BinaryIO:
+        f = self.handles.get(host_name)
+        if f is None:
+            if len(self.handles) >= self.max_handles:
+                self.close_handles()
+            path = os.path.join(self.image_file, host_name)
+            try:
+                f = open(path, 'r+b', buffering=0)
+            except PermissionError:
+                # Writing it raises an OSError, which the disk controller
+                # reports to CP/M as an error
+                f = open(path, 'rb', buffering=0)
+            self.handles[host_name] = f
+        return f
+
+
+    def close_handles(self, host_name: Optional[str] = None) -> None:
+        for name in list(self.handles) if host_name is None else [host_name]:
+            f = self.handles.pop(name, None)
+            if f is not None:
+                f.close()
+
+
+    def build_directory(self) -> None:
+        if self.directory_data is not None:
+            return
+        block_size = self.params['block_size']
+        directory = bytearray([EMPTY]) * (self.params['dir_blocks'] * block_size)
+        entry = 0
+        next_block = self.params['dir_blocks']
+        for host_name in sorted(os.listdir(self.image_file)):
+            name = cpm_filename(host_name)
+            path = os.path.join(self.image_file, host_name)
+            if name is None or name in self.files or not os.path.isfile(path):
+                continue
+            size = os.path.getsize(path)
+            records = (size + RECORD_SIZE - 1) // RECORD_SIZE
+            blocks = list(range(next_block, next_block + (size + block_size - 1) // block_size))
+            ext = name[1]
+            if not os.access(path, os.W_OK):
+                ext = bytes([ext[0] | 0x80]) + ext[1:]     # Read-only attribute
+            entries = pack_dir_entries(self.params, 0, name[0], ext, records, blocks)
+            if (entry + len(entries) > self.params['dir_entries']
+                    or next_block + len(blocks) > self.params['num_blocks']):
+                continue    # Doesn't fit on the disk
+            for packed in entries:
+                directory[entry * DIR_ENTRY_SIZE:(entry + 1) * DIR_ENTRY_SIZE] = packed
+                entry += 1
+            for i, block in enumerate(blocks):
+                self.block_source[block] = (host_name, i * block_size)
+            next_block += len(blocks)
+            self.files[name] = (host_name, records, blocks)
+        self.directory_data = directory
+
+
+    def read_block(self, block: int, start: int, length: int) -> bytes:
+        data = self.pending.get(block)
+        if data is not None:
+            return bytes(data[start:start + length])
+        source = self.block_source[block] if block < len(self.block_source) else None
+        if source is None:
+            return bytes([EMPTY]) * length
+        host_name, file_offset = source
+        f = self.handle(host_name)
+        f.seek(file_offset + start)
+        data = f.read(length)
+        return data + b'\x1a' * (length - len(data))   # ^Z past the end of the file
+
+
+    def get_sector(self, track: int, sector: int) -> memoryview:
+        offset = self.data_offset(track, sector)
+        if offset < 0:
+            return super().get_sector(track, sector)
+        self.build_directory()
+        assert self.directory_data is not None
+        if offset < len(self.directory_data):
+            return memoryview(self.directory_data)[offset:offset + self.sector_size]
+        block, start = divmod(offset, self.params['block_size'])
+        return memoryview(self.read_block(block, start, self.sector_size))
+
+
+    def set_sector(self, track: int, sector: int, sector_data: bytes) -> None:
+        offset = self.data_offset(track, sector)
+        if offset < 0:
+            super().set_sector(track, sector, sector_data)
+            return
+        self.build_directory()
+        assert self.directory_data is not None
+        sector_data = bytes(sector_data[:self.sector_size])
+        block_size = self.params['block_size']
+        block, start = divmod(offset, block_size)
+        with self.lock:
+            if offset < len(self.directory_data):
+                self.directory_data[offset:offset + len(sector_data)] = sector_data
+                self.sync_directory()
+            elif block < self.params['num_blocks']:
+                source = self.block_source[block]
+                if source is None:
+                    data = self.pending.setdefault(block, bytearray([EMPTY]) * block_size)
+                    data[start:start + len(sector_data)] = sector_data
+                else:
+                    f = self.handle(source[0])
+                    f.seek(source[1] + start)
+                    f.write(sector_data)
+            self.dirty.add(offset)
+        if self.flush_policy == 'immediate':
+            self.flush()
+
+
+    def sync_directory(self) -> None:
+        # Make the host directory match the CP/M directory.
+        assert self.directory_data is not None
+        block_size = self.params['block_size']
+        new_files = {(name, ext): entry
+                     for (user, name, ext), entry in read_directory(self.params, self.directory_data).items()
+                     if user == 0}
+        changed = {key: entry for key, entry in new_files.items()
+                   if key not in self.files or self.files[key][1:] != entry}
+        removed = [key for key in self.files if key not in new_files]
+
+        # Read what the changed files hold before renaming or deleting
+        # anything, since their blocks may have belonged to other files.
+        # A file that only grew gets just its new blocks written.
+        contents: Dict[Tuple[bytes, bytes], Tuple[int, bytes]] = {}
+        for key, (records, blocks) in changed.items():
+            first = 0
+            if key in self.files:
+                old_blocks = self.files[key][2]
+                if blocks[:len(old_blocks)] == old_blocks:
+                    first = len(old_blocks)
+            contents[key] = (first, b''.join(self.read_block(block, 0, block_size)
+                                             for block in blocks[first:]))
+
+        for key in removed:
+            host_name, records, blocks = self.files.pop(key)
+            self.close_handles(host_name)
+            path = os.path.join(self.image_file, host_name)
+            renamed = [new_key for new_key in changed
+                       if new_key not in self.files and len(blocks) > 0
+                       and new_files[new_key][1] == blocks]
+            if renamed:
+                new_name = host_filename(*renamed[0])
+                os.replace(path, os.path.join(self.image_file, new_name))
+                self.files[renamed[0]] = (new_name, records, blocks)
+                if new_files[renamed[0]] == self.files[renamed[0]][1:]:
+                    del contents[renamed[0]]
+            elif os.path.isfile(path):
+                os.remove(path)
+
+        for key, (first, data) in contents.items():
+            records, blocks = new_files[key]
+            host_name = self.files[key][0] if key in self.files else host_filename(*key)
+            self.close_handles(host_name)
+            path = os.path.join(self.image_file, host_name)
+            with open(path, 'r+b' if first > 0 and os.path.isfile(path) else 'wb') as f:
+                f.seek(first * block_size)
+                f.write(data)
+                f.truncate(records * RECORD_SIZE)
+            self.files[key] = (host_name, records, blocks)
+
+        self.block_source = [None for _ in range(self.params['num_blocks'])]
+        for host_name, _, blocks in self.files.values():
+            for i, block in enumerate(blocks):
+                self.block_source[block] = (host_name, i * block_size)
+                self.pending.pop(block, None)
+
+
+    def flush(self) -> None:
+        with self.lock:
+            if self.fsync:
+                for f in self.handles.values():
+                    os.fsync(f.fileno())
+            self.dirty.clear()
@@ -0,0 +1,335 @@
+# This is free and unencumbered software released into the public domain.
+#
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a compiled
+# binary, for any purpose, commercial or non-commercial, and by any
+# means.
+#
+# In jurisdictions that recognize copyright laws, the author or authors
+# of this software dedicate any and all copyright interest in the
+# software to the public domain. We make this dedication for the benefit
+# of the public at large and to the detriment of our heirs and
+# successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to this
+# software under copyright law.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# For more information, please refer to <https://unlicense.org>
+
+"""PyGame front end for the CP/M machine: an ADM-3A terminal in a window."""
+
+
+from contextlib import suppress
+import os
+import time
+from typing import Any, ContextManager, Dict, List, Optional, Tuple
+
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+import pygame
+from pygame.constants import KEYDOWN, KMOD_CTRL, KMOD_SHIFT, QUIT
+from pygame.freetype import Font
+from pygame.rect import Rect
+from pygame.surface import Surface
+
+from adm3a import ADM3A_Screen
+from virtual8080 import Virtual8080
+from cpm import CPM_Machine
+from cpm_worker import CPM_ProcessWorker, CPM_ThreadWorker
+
+
+class FramePacer:
+    """Schedules frames for the CP/M terminal.
+
+    While the screen is changing, each frame emulates for what's left of the
+    target frame time after the measured cost of drawing. While the screen is
+    static, the emulation slice doubles each frame, up to one frame at
+    idle_frame_rate, so little time goes to redrawing an unchanged screen.
+    With a CPU budget below 1, the pacer sleeps so that emulating and drawing
+    take only that fraction of the wall clock time."""
+
+    idle_frame_rate = 10
+    report_interval = 1.0   # Seconds between frame rate reports
+
+    def __init__(self, frame_rate: int = 60, cpu_budget: float = 1.0):
+        if frame_rate <= 0 or not 0 < cpu_budget <= 1:
+            raise ValueError
+        self.frame_time: float = 1 / frame_rate
+        self.cpu_budget: float = cpu_budget
+        self.render_time: float = 0.0     # Moving average
+        self.slice: float = self.frame_time
+
+        self.frames: int = 0
+        self.instructions: int = 0
+        self.report_start: float = time.perf_counter()
+
+    def end_frame(self, busy: bool, work_time: float, render_time: float, instructions: int) -> None:
+        self.render_time = 0.9 * self.render_time + 0.1 * render_time
+        if busy:
+            self.slice = max(0.001, self.frame_time - self.render_time)
+        else:
+            self.slice = min(2 * self.slice, 1 / self.idle_frame_rate)
+
+        self.frames += 1
+        self.instructions += instructions
+        if self.cpu_budget < 1:
+            time.sleep(work_time * (1 - self.cpu_budget) / self.cpu_budget)
+
+    def report(self) -> Optional[Tuple[float, float]]:
+        # Every report_interval, returns frames per second and emulated MIPS.
+        now = time.perf_counter()
+        elapsed = now - self.report_start
+        if elapsed < self.report_interval:
+            return None
+        fps = self.frames / elapsed
+        mips = self.instructions / elapsed / 1000000
+        self.frames = 0
+        self.instructions = 0
+        self.report_start = now
+        return fps, mips
+
+
+class CPM_TTY:
+
+    background = (0, 0, 0)
+    foreground = (200, 200, 200)
+    margin = 5
+    batch_size = 1000       # Instructions to run between clock checks
+    row_cache_size = 512    # Rendered rows to keep around
+
+    shift_keymap = {
+        ord('`'): ord('~'),
+        ord('1'): ord('!'),
+        ord('2'): ord('@'),
+        ord('3'): ord('#'),
+        ord('4'): ord('$'),
+        ord('5'): ord('%'),
+        ord('6'): ord('^'),
+        ord('7'): ord('&'),
+        ord('8'): ord('*'),
+        ord('9'): ord('('),
+        ord('0'): ord(')'),
+        ord('-'): ord('_'),
+        ord('='): ord('+'),
+        ord('['): ord('{'),
+        ord(']'): ord('}'),
+        ord(';'): ord(':'),
+        ord("'"): ord('"'),
+        ord(','): ord('<'),
+        ord('.'): ord('>'),
+        ord('/'): ord('?'),
+    }
+
+    def __init__(self,
+                 disk_images: List[str] = [],
+                 worker: str = 'none',
+                 frame_rate: int = 60,
+                 cpu_budget: float = 1.0,
+                 **machine_options: Any):
+        self.disk_images: List[str] = disk_images
+        self.machine_options = machine_options     # Passed on to CPM_Machine
+        self.worker: str = worker   # 'none', 'thread' or 'process'
+        self.pacer: FramePacer = FramePacer(frame_rate, cpu_budget)
+
+        self.adm3a: ADM3A_Screen = ADM3A_Screen()
+        self.screen_lock: ContextManager = suppress()     # No lock (nullcontext() needs 3.7)
+
+        pygame.init()
+        pygame.display.set_caption('CP/M')
+        pygame.key.set_repeat(1000, 100)
+
+        self.screen: Surface = pygame.display.set_mode(
+            (80 * 10 + 2 * self.margin, 24 * 20 + 2 * self.margin))
+        self.screen.fill(self.background)
+        self.canvas: Surface = Surface((80 * 10, 24 * 20))
+        self.canvas.fill(self.background)
+        self.font: Font = Font('BmPlus_Rainbow100_re_80.otb', 24)
+        self.blink_rate: int = 750
+
+        self.row_cache: Dict[bytes, Surface] = {}
+        self.cursor_cache: Dict[int, Surface] = {}
+        self.cursor_drawn: Optional[int] = None     # Where the cursor is on the canvas
+        self.screen_changed: bool = True
+
+
+    def putch(self, ch: int) -> None:
+        if not self.adm3a.putch(ch):
+            # print(f'{ch} {ch & 0x7f}')
+            print(chr(ch & 0x7f), end='', flush=True)
+
+
+    def draw_row(self, row: int) -> Rect:
+        rect = Rect(0, row * 20, 80 * 10, 20)
+        self.canvas.fill(self.background, rect)
+        text = self.adm3a.row(row).rstrip()
+        if len(text) > 0:
+            surface = self.row_cache.get(text)
+            if surface is None:
+                if len(self.row_cache) >= self.row_cache_size:
+                    self.row_cache.clear()
+                surface, _ = self.font.render(text, fgcolor=self.foreground)
+                self.row_cache[text] = surface
+            self.canvas.blit(surface, rect.topleft)
+        return rect
+
+
+    def draw_cursor(self) -> Rect:
+        row, col = divmod(self.adm3a.cursor, 80)
+        ch = self.adm3a.row(row)[col]
+        surface = self.cursor_cache.get(ch)
+        if surface is None:
+            surface, _ = self.font.render(bytes([ch]),
+                                          fgcolor=self.background,
+                                          bgcolor=self.foreground)
+            self.cursor_cache[ch] = surface
+        rect = Rect(col * 10, row * 20, 10, 20)
+        self.canvas.blit(surface, rect.topleft)
+        return rect
+
+
+    def render_buffer(self) -> List[Rect]:
+        # Bring the canvas up to date with the screen model and return the
+        # parts of it that changed. Unchanged rows aren't touched at all.
+        cursor_on = (time.time_ns() // 1000000 // self.blink_rate) % 2 == 0
+        cursor = self.adm3a.cursor
+        dirty, scrolled = self.adm3a.take_changes()
+        self.screen_changed = len(dirty) > 0 or scrolled > 0
+
+        if scrolled >= 24:
+            dirty = set(range(24))
+        elif scrolled > 0:
+            self.canvas.scroll(0, -20 * scrolled)
+
+        # Erase the cursor if it has moved, blinked off or scrolled away.
+        if self.cursor_drawn is not None:
+            row = self.cursor_drawn // 80 - scrolled
+            if row >= 0 and (not cursor_on or scrolled > 0 or self.cursor_drawn != cursor):
+                dirty.add(row)
+
+        changed = [self.draw_row(row) for row in sorted(dirty)]
+
+        if cursor_on and (self.cursor_drawn != cursor or scrolled > 0 or cursor // 80 in dirty):
+            changed.append(self.draw_cursor())
+        self.cursor_drawn = cursor if cursor_on else None
+
+        if scrolled > 0:
+            return [self.canvas.get_rect()]
+        return changed
+
+
+    def draw(self) -> None:
+        with self.screen_lock:
+            rects = self.render_buffer()
+        if len(rects) > 0:
+            updated = []
+            for rect in rects:
+                dest = rect.move(self.margin, self.margin)
+                self.screen.blit(self.canvas, dest, rect)
+                updated.append(dest)
+            pygame.display.update(updated)
+
+
+    def read_keys(self) -> Optional[bytes]:
+        # Returns the keys typed since the last call, or None on QUIT.
+        keys = b''
+        for event in pygame.event.get():
+            if event.type == QUIT:
+                return None
+
+            if event.type == KEYDOWN:
+                if 0 <= event.key <= 255: 
+                    key = event.key
+                    if 97 <= key <= 122 and event.mod & KMOD_SHIFT: # A-Z
+                        key -= 32
+                    elif event.mod & KMOD_SHIFT:                    # Other
+                        if key in self.shift_keymap.keys():
+                            key = self.shift_keymap[key]
+                    elif 97 <= key <= 122 and event.mod & KMOD_CTRL: # ^A - ^Z
+                        key -= 96
+                    keys += bytes([key])
+        return keys
+
+
+    def run(self) -> None:
+        if self.worker == 'thread':
+            self.run_worker(CPM_ThreadWorker(self.disk_images, **self.machine_options))
+            return
+        elif self.worker == 'process':
+            self.run_worker(CPM_ProcessWorker(self.disk_images, **self.machine_options))
+            return
+
+        vm = Virtual8080()
+        vm.io = CPM_Machine(vm, self.disk_images, **self.machine_options)
+
+        vm.halted = False
+        vm.io.warp()
+        while not vm.halted:
+            frame_start = time.perf_counter()
+            work_until = frame_start + self.pacer.slice
+            steps = 0
+            while time.perf_counter() < work_until and not vm.halted:
+                steps += vm.run_for(self.batch_size)
+            for ch in vm.io.drain_output():
+                self.putch(ch)
+
+            keys = self.read_keys()
+            if keys is None:
+                vm.halted = True
+            elif len(keys) > 0:
+                vm.io.input_queue.push(keys)
+
+            render_start = time.perf_counter()
+            self.draw()
+            render_end = time.perf_counter()
+
+            self.pacer.end_frame(self.screen_changed or bool(keys),
+                                 render_end - frame_start, render_end - render_start, steps)
+            self.show_stats()
+
+        vm.io.close()
+        pygame.quit()
+
+
+    def run_worker(self, worker) -> None:
+        # The worker emulates flat out; this loop only handles the keyboard and
+        # draws the shared screen, sleeping for the emulation slice in between.
+        self.adm3a = worker.screen
+        self.screen_lock = worker.lock
+        worker.start()
+        instructions = 0
+        while worker.is_alive():
+            keys = self.read_keys()
+            if keys is None:
+                worker.stop()
+                break
+            elif len(keys) > 0:
+                worker.push_input(keys)
+            else:
+                worker.flush_input()
+
+            render_start = time.perf_counter()
+            self.draw()
+            render_end = time.perf_counter()
+            time.sleep(self.pacer.slice)
+
+            total = worker.instructions
+            self.pacer.end_frame(self.screen_changed or bool(keys),
+                                 render_end - render_start, render_end - render_start,
+                                 total - instructions)
+            instructions = total
+            self.show_stats()
+        worker.join()
+
+        pygame.quit()
+
+
+    def show_stats(self) -> None:
+        stats = self.pacer.report()
+        if stats is not None:
+            pygame.display.set_caption('CP/M - %.0f fps, %.2f MIPS' % stats)
@@ -0,0 +1,309 @@
+# This is free and unencumbered software released into the public domain.
+#
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a compiled
+# binary, for any purpose, commercial or non-commercial, and by any
+# means.
+#
+# In jurisdictions that recognize copyright laws, the author or authors
+# of this software dedicate any and all copyright interest in the
+# software to the public domain. We make this dedication for the benefit
+# of the public at large and to the detriment of our heirs and
+# successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to this
+# software under copyright law.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# For more information, please refer to <https://unlicense.org>
+
+"""Run the CP/M machine on its own worker, apart from the front end.
+
+The worker runs the emulator flat out and keeps the ADM-3A screen model up to
+date; the front end takes keys and draws the screen at its own pace. A thread
+worker shares the screen object itself under a lock. A process worker gets
+around the GIL by publishing the screen to shared memory, and reads keys from
+a lock-free ring buffer in shared memory."""
+
+
+from contextlib import suppress
+import struct
+import threading
+from typing import Any, ContextManager, Dict, List, Set, Tuple
+
+from adm3a import ADM3A_Screen
+from virtual8080 import Virtual8080
+from cpm import CPM_Machine
+
+
+def print_unhandled(screen: ADM3A_Screen, data: bytes) -> None:
+    for ch in data:
+        if not screen.putch(ch):
+            print(chr(ch & 0x7f), end='', flush=True)
+
+
+class CPM_ThreadWorker(threading.Thread):
+
+    batch_size = 10000      # Instructions to run between screen updates
+
+    def __init__(self, disk_images: List[str] = [], **machine_options: Any):
+        super().__init__(daemon=True)
+        self.screen: ADM3A_Screen = ADM3A_Screen()
+        self.lock: ContextManager = threading.Lock()
+        self.stopping: bool = False
+        self.instructions: int = 0
+
+        self.vm: Virtual8080 = Virtual8080()
+        self.vm.io = CPM_Machine(self.vm, disk_images, **machine_options)
+
+    def push_input(self, data: bytes) -> None:
+        self.vm.io.input_queue.push(data)
+
+    def flush_input(self) -> None:
+        pass    # push_input() never holds keys back
+
+    def stop(self) -> None:
+        self.stopping = True
+
+    def run(self) -> None:
+        vm = self.vm
+        vm.halted = False
+        vm.io.warp()
+        while not vm.halted and not self.stopping:
+            self.instructions += vm.run_for(self.batch_size)
+            data = vm.io.drain_output()
+            if len(data) > 0:
+                with self.lock:
+                    print_unhandled(self.screen, data)
+        vm.io.close()
+
+
+class SharedRing:
+    """Single-producer, single-consumer byte ring in shared memory.
+
+    The producer only ever writes the tail index and the consumer only the
+    head index, so neither side needs a lock."""
+
+    header = struct.Struct('<II')   # head, tail
+
+    def __init__(self, buf: memoryview):
+        self.buf: memoryview = buf
+        self.size: int = len(buf) - self.header.size
+
+    def put(self, data: bytes) -> int:
+        # Returns how many bytes fit.
+        head, tail = self.header.unpack_from(self.buf)
+        free = self.size - 1 - (tail - head) % self.size
+        data = data[:free]
+        for ch in data:
+            self.buf[self.header.size + tail] = ch
+            tail = (tail + 1) % self.size
+        struct.pack_into('<I', self.buf, 4, tail)
+        return len(data)
+
+    def get(self) -> bytes:
+        head, tail = self.header.unpack_from(self.buf)
+        if head == tail:
+            return b''
+        start = self.header.size
+        if head < tail:
+            data = bytes(self.buf[start + head:start + tail])
+        else:
+            data = bytes(self.buf[start + head:start + self.size]) + bytes(self.buf[start:start + tail])
+        struct.pack_into('<I', self.buf, 0, tail)
+        return data
+
+
+class SharedScreen:
+    """Writer side of an ADM-3A screen published in shared memory.
+
+    Rows are kept in the screen model's ring order, with a version number per
+    row so a reader can tell which rows changed. A sequence number, odd while
+    an update is in progress, lets the reader retry instead of reading a torn
+    update."""
+
+    header = struct.Struct('<IHHI')     # seq, top, cursor, scroll total
+    halted_offset = 12                  # Set by the writer when the machine stops
+    stop_offset = 13                    # Set by the reader to stop the machine
+    instructions = struct.Struct('<Q')  # Instructions run so far, for statistics
+    instructions_offset = 16
+    versions = struct.Struct('<24I')
+    versions_offset = 24
+    cells_offset = versions_offset + versions.size
+    size = cells_offset + 80 * 24
+
+    def __init__(self, buf: memoryview):
+        self.buf: memoryview = buf
+        self.seq: int = 0
+        self.scroll_total: int = 0
+        self.row_versions: List[int] = [0] * 24
+
+    def publish(self, screen: ADM3A_Screen) -> None:
+        dirty, scrolled = screen.take_changes()
+        if len(dirty) == 0 and scrolled == 0:
+            return
+        self.seq += 1
+        struct.pack_into('<I', self.buf, 0, self.seq)
+        for row in dirty:
+            start = 80 * ((screen.top + row) % 24)
+            self.buf[self.cells_offset + start:self.cells_offset + start + 80] = screen.cells[start:start + 80]
+            self.row_versions[start // 80] += 1
+        self.scroll_total = (self.scroll_total + scrolled) & 0xffffffff
+        self.versions.pack_into(self.buf, self.versions_offset, *self.row_versions)
+        self.seq += 1
+        self.header.pack_into(self.buf, 0, self.seq, screen.top, screen.cursor,
+                              self.scroll_total)
+
+    def set_instructions(self, instructions: int) -> None:
+        self.instructions.pack_into(self.buf, self.instructions_offset, instructions)
+
+    def set_halted(self) -> None:
+        self.buf[self.halted_offset] = 1
+
+    def stop_requested(self) -> bool:
+        return self.buf[self.stop_offset] != 0
+
+
+class SharedScreenView(ADM3A_Screen):
+    """Reader side of a SharedScreen: a local copy brought up to date by
+    take_changes(), so it can be drawn like any ADM3A_Screen."""
+
+    def __init__(self, buf: memoryview):
+        super().__init__()
+        self.buf: memoryview = buf
+        self.row_versions: Tuple[int, ...] = (0,) * 24
+        self.scroll_total: int = 0
+
+    retries = 1000
+
+    def take_changes(self) -> Tuple[Set[int], int]:
+        header = SharedScreen.header
+        offset = SharedScreen.cells_offset
+        for _ in range(self.retries):
+            seq, top, cursor, scroll_total = header.unpack_from(self.buf)
+            if seq & 1:
+                continue
+            versions = SharedScreen.versions.unpack_from(self.buf, SharedScreen.versions_offset)
+            rows = {p: bytes(self.buf[offset + 80 * p:offset + 80 * p + 80])
+                    for p in range(24) if versions[p] != self.row_versions[p]}
+            if header.unpack_from(self.buf)[0] == seq:
+                break
+        else:
+            return set(), 0     # The writer is stuck mid-update; try next frame
+
+        for p, data in rows.items():
+            self.cells[80 * p:80 * p + 80] = data
+        scrolled = (scroll_total - self.scroll_total) & 0xffffffff
+        dirty = {(p - top) % 24 for p in rows}
+        if self.cursor != cursor:
+            dirty.add(self.cursor // 80)
+            dirty.add(cursor // 80)
+        self.top, self.cursor = top, cursor
+        self.row_versions, self.scroll_total = versions, scroll_total
+        return dirty, scrolled
+
+    def halted(self) -> bool:
+        return self.buf[SharedScreen.halted_offset] != 0
+
+    def instructions(self) -> int:
+        return SharedScreen.instructions.unpack_from(self.buf, SharedScreen.instructions_offset)[0]
+
+    def request_stop(self) -> None:
+        self.buf[SharedScreen.stop_offset] = 1
+
+
+def process_worker_main(disk_images: List[str],
+                        machine_options: Dict[str, Any],
+                        screen_name: str,
+                        ring_name: str) -> None:
+    from multiprocessing import shared_memory
+
+    screen_shm = shared_memory.SharedMemory(name=screen_name)
+    ring_shm = shared_memory.SharedMemory(name=ring_name)
+    shared = SharedScreen(screen_shm.buf)
+    ring = SharedRing(ring_shm.buf)
+    screen = ADM3A_Screen()
+
+    vm = Virtual8080()
+    vm.io = CPM_Machine(vm, disk_images, **machine_options)
+    instructions = 0
+    try:
+        vm.halted = False
+        vm.io.warp()
+        while not vm.halted and not shared.stop_requested():
+            keys = ring.get()
+            if len(keys) > 0:
+                vm.io.input_queue.push(keys)
+            instructions += vm.run_for(CPM_ThreadWorker.batch_size)
+            shared.set_instructions(instructions)
+            data = vm.io.drain_output()
+            if len(data) > 0:
+                print_unhandled(screen, data)
+                shared.publish(screen)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        vm.io.close()
+        shared.set_halted()
+        del shared, ring
+        screen_shm.close()
+        ring_shm.close()
+
+
+class CPM_ProcessWorker:
+
+    ring_size = 4096
+
+    def __init__(self, disk_images: List[str] = [], **machine_options: Any):
+        from multiprocessing import Process, shared_memory
+
+        self.screen_shm = shared_memory.SharedMemory(create=True, size=SharedScreen.size)
+        self.ring_shm = shared_memory.SharedMemory(create=True,
+                                                   size=SharedRing.header.size + self.ring_size)
+        self.screen_shm.buf[:SharedScreen.size] = bytes(SharedScreen.size)
+        self.ring_shm.buf[:SharedRing.header.size] = bytes(SharedRing.header.size)
+        self.screen: SharedScreenView = SharedScreenView(self.screen_shm.buf)
+        self.ring: SharedRing = SharedRing(self.ring_shm.buf)
+        self.lock: ContextManager = suppress()    # No lock (nullcontext() needs 3.7)
+        self.pending: bytes = b''
+        self.process = Process(target=process_worker_main,
+                               args=(disk_images, machine_options,
+                                     self.screen_shm.name, self.ring_shm.name),
+                               daemon=True)
+
+    def start(self) -> None:
+        self.process.start()
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive() and not self.screen.halted()
+
+    @property
+    def instructions(self) -> int:
+        return self.screen.instructions()
+
+    def push_input(self, data: bytes) -> None:
+        # Keys that don't fit in the ring wait for flush_input().
+        self.pending += data
+        self.flush_input()
+
+    def flush_input(self) -> None:
+        # Called every frame, so a long paste goes on without more keys
+        if len(self.pending) > 0:
+            sent = self.ring.put(self.pending)
+            self.pending = self.pending[sent:]
+
+    def stop(self) -> None:
+        self.screen.request_stop()
+
+    def join(self) -> None:
+        self.process.join()
+        del self.screen, self.ring
+        for shm in (self.screen_shm, self.ring_shm):
+            shm.close()
+            shm.unlink()
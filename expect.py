@@ -0,0 +1,174 @@
+# This is free and unencumbered software released into the public domain.
+#
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a compiled
+# binary, for any purpose, commercial or non-commercial, and by any
+# means.
+#
+# In jurisdictions that recognize copyright laws, the author or authors
+# of this software dedicate any and all copyright interest in the
+# software to the public domain. We make this dedication for the benefit
+# of the public at large and to the detriment of our heirs and
+# successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to this
+# software under copyright law.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# For more information, please refer to <https://unlicense.org>
+
+"""Scripting a machine's console from Python, in the manner of expect.
+
+    session = ConsoleSession(vm)
+    session.expect(r'A>')
+    session.send('DIR\\r')
+    session.expect(r'A>')
+    print(session.before.decode('ascii'))
+
+The machine runs in batches between looks at its output. Only output that
+hasn't been matched yet is searched, and only when there's more of it."""
+
+
+import re
+from typing import Callable, Match, Optional, Pattern, Union
+
+from adm3a import ADM3A_Screen
+from virtual8080 import Virtual8080
+
+
+class ExpectTimeout(Exception):
+    """The machine ran max_steps instructions, or halted, without the
+    output expected."""
+
+
+class ConsoleSession:
+
+    batch_size = 100000     # Instructions to run between looks at the output
+    search_window = 4096    # Output before each batch's that expect() searches again
+
+    def __init__(self, vm: Virtual8080):
+        # vm.io must be a ConsoleDevice.
+        self.vm: Virtual8080 = vm
+        self.screen: ADM3A_Screen = ADM3A_Screen()
+        self.buffer: bytearray = bytearray()        # Output not matched yet
+        self.before: bytes = b''    # Output up to the last match
+        self.match: Optional[Match[bytes]] = None   # The last match
+        self.steps: int = 0         # Instructions run so far
+        vm.halted = False
+
+
+    def send(self, data: Union[bytes, str]) -> None:
+        if isinstance(data, str):
+            data = data.encode(encoding='ascii')
+        self.vm.io.input_queue.push(data)
+
+
+    def run(self, max_steps: int) -> int:
+        # Run up to max_steps instructions, taking in the output. Returns
+        # the number of bytes of output.
+        steps = self.vm.run_for(max_steps)
+        self.steps += steps
+        data = self.vm.io.drain_output()
+        self.screen.write(data)
+        self.buffer += data
+        return len(data)
+
+
+    def expect(self,
+               pattern: Union[bytes, str, Pattern[bytes]],
+               max_steps: int = 10000000,
+               search_window: Optional[int] = None) -> Match[bytes]:
+        # Run until the output not matched yet matches the regular expression
+        # pattern, and consume the output up to the end of the match. Each
+        # batch's output is searched along with the search_window bytes
+        # before it (self.search_window if not given), so a match can't
+        # start further back than that.
+        if isinstance(pattern, str):
+            pattern = pattern.encode(encoding='ascii')
+        regex = re.compile(pattern)
+        window = self.search_window if search_window is None else search_window
+
+        def search(scanned: int) -> Optional[Match[bytes]]:
+            found = regex.search(self.buffer, max(0, scanned - window))
+            if found is None:
+                return None
+            # Match again on a copy, which stays put when the buffer is
+            # consumed
+            return regex.match(bytes(self.buffer), found.start())
+        return self.wait_for(search, max_steps)
+
+
+    def expect_exact(self, text: Union[bytes, str], max_steps: int = 10000000) -> Match[bytes]:
+        # Like expect(), for text itself rather than a regular expression.
+        # Only each batch's output, and the end of the output before it that
+        # could hold the start of text, is searched.
+        if isinstance(text, str):
+            text = text.encode(encoding='ascii')
+
+        def search(scanned: int) -> Optional[Match[bytes]]:
+            found = self.buffer.find(text, max(0, scanned - len(text) + 1))
+            if found < 0:
+                return None
+            return re.compile(re.escape(text)).match(bytes(self.buffer), found)
+        return self.wait_for(search, max_steps)
+
+
+    def wait_for(self, search: Callable[[int], Optional[Match[bytes]]],
+                 max_steps: int) -> Match[bytes]:
+        # search(scanned) finds a match in self.buffer that ends past its
+        # first scanned bytes, which have been searched already.
+        scanned = 0
+        steps = self.steps
+        while True:
+            if len(self.buffer) > scanned or scanned == 0:
+                match = search(scanned)
+                if match is not None:
+                    self.before = bytes(self.buffer[:match.start()])
+                    self.match = match
+                    del self.buffer[:match.end()]
+                    return match
+                scanned = len(self.buffer)
+            remaining = max_steps - (self.steps - steps)
+            if remaining <= 0 or self.vm.halted:
+                raise ExpectTimeout
+            self.run(min(self.batch_size, remaining))
+
+
+    def screen_text(self) -> str:
+        # What an ADM-3A would show, one line per row with trailing spaces
+        # removed
+        return self.screen.text()
+
+
+if __name__ == '__main__':
+    from altair_basic import AltairWithTerminal
+
+    vm = Virtual8080()
+    vm.io = AltairWithTerminal()
+    with open('altair_basic_bin/8kbas.bin', 'rb') as f:
+        vm.load(f.read())
+    session = ConsoleSession(vm)
+    session.expect_exact('MEMORY SIZE?')
+    session.send('65529\r\rY\r')
+    session.expect(rb'(\d+) BYTES FREE')
+    assert session.match is not None and int(session.match.group(1)) > 50000
+    session.expect_exact('OK')
+
+    session.send('PRINT 6*7\r')
+    session.expect(r'\r\n *(-?\d+) *\r\nOK')
+    assert session.match is not None and session.match.group(1) == b'42'
+    assert session.before.strip() == b'PRINT 6*7'
+    assert ' 42' in session.screen_text().split('\n')
+
+    session.send('10 GOTO 10\rRUN\r')
+    try:
+        session.expect_exact('NEVER', max_steps=200000)
+        assert False
+    except ExpectTimeout:
+        pass
@@ -19,6 +19,7 @@ GNU General Public License for more details.
 '''
 
 import os
+import threading
 
 # Windows
 if os.name == 'nt':
@@ -45,6 +46,10 @@ class KBHit:
 
             # Save the terminal settings
             self.fd = sys.stdin.fileno()
+            self.is_tty = os.isatty(self.fd)
+            if not self.is_tty:
+                # Piped or redirected input: nothing to set up
+                return
             self.new_term = termios.tcgetattr(self.fd)
             self.old_term = termios.tcgetattr(self.fd)
 
@@ -63,7 +68,7 @@ class KBHit:
         if os.name == 'nt':
             pass
 
-        else:
+        elif self.is_tty:
             termios.tcsetattr(self.fd, termios.TCSAFLUSH, self.old_term)
 
 
@@ -102,6 +107,26 @@ class KBHit:
         return vals.index(ord(c.decode('utf-8')))
 
 
+    def start_reader(self, on_input):
+        ''' Starts a background thread that waits for keyboard input and
+        passes it to on_input() as bytes, as soon as it arrives, so the caller
+        doesn't need to poll. on_input(b'') is called at end of input.
+        '''
+
+        def read():
+            while True:
+                if os.name == 'nt':
+                    data = msvcrt.getch()
+                else:
+                    data = os.read(self.fd, 4096)
+                on_input(data)
+                if data == b'':
+                    break
+
+        self.reader = threading.Thread(target=read, daemon=True)
+        self.reader.start()
+
+
     def kbhit(self):
         ''' Returns True if keyboard character was hit, False otherwise.
         '''
@@ -0,0 +1,279 @@
+# This is free and unencumbered software released into the public domain.
+#
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a compiled
+# binary, for any purpose, commercial or non-commercial, and by any
+# means.
+#
+# In jurisdictions that recognize copyright laws, the author or authors
+# of this software dedicate any and all copyright interest in the
+# software to the public domain. We make this dedication for the benefit
+# of the public at large and to the detriment of our heirs and
+# successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to this
+# software under copyright law.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# For more information, please refer to <https://unlicense.org>
+
+"""Running many machines in turn on one thread.
+
+    scheduler = Scheduler()
+    scheduler.add(vm1)
+    scheduler.add(vm2, priority=2, quota=500000)
+    scheduler.run()
+
+Each turn goes to the machine that has had the fewest instructions for its
+priority (stride scheduling), so a machine with priority 2 gets twice the
+instructions of one with priority 1. A machine is skipped while it's idle
+(waiting for console input that hasn't come), paused, over its quota of
+instructions a second, or halted, or once it has used up its budget."""
+
+
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from virtual8080 import Virtual8080
+
+
+class ScheduledVM:
+    """A machine in a Scheduler, with its share and what it's had of it."""
+
+    def __init__(self,
+                 vm: Virtual8080,
+                 name: str,
+                 priority: float = 1,
+                 quota: Optional[int] = None,
+                 budget: Optional[int] = None,
+                 on_slice: Optional[Callable[['ScheduledVM', str], None]] = None):
+        # quota is the most instructions in each Scheduler.quota_period (a
+        # second by default), and budget the most in all. on_slice(machine,
+        # reason) is called after each turn, with run_slice()'s reason, or
+        # 'done' when the budget is used up.
+        self.vm: Virtual8080 = vm
+        self.name: str = name
+        self.priority: float = priority
+        self.quota: Optional[int] = quota
+        self.budget: Optional[int] = budget
+        self.on_slice = on_slice
+
+        # 'ready', 'idle', 'paused', 'throttled', 'halted' or 'done'
+        self.state: str = 'ready'
+        self.pass_value: float = 0.0    # Instructions had, over priority
+        self.steps: int = 0
+        self.seconds: float = 0.0       # Host time spent running it
+        self.slices: int = 0
+        self.added: float = time.monotonic()
+        self.idle_since: float = 0.0
+        self.period_start: float = self.added
+        self.period_steps: int = 0      # Instructions this quota period
+
+    def input_waiting(self) -> bool:
+        input_queue = getattr(self.vm.io, 'input_queue', None)
+        return input_queue is not None and len(input_queue) > 0
+
+
+class Scheduler:
+
+    quantum = 10000         # Instructions in a turn, at priority 1
+    quota_period = 1.0      # Seconds over which quotas are counted
+
+    def __init__(self, quantum: Optional[int] = None):
+        if quantum is not None:
+            self.quantum = quantum
+        self.machines: List[ScheduledVM] = []
+        self.wakeup: Optional[asyncio.Event] = None     # Set by run_async()
+
+
+    def add(self, vm: Virtual8080, name: Optional[str] = None, **options: Any) -> ScheduledVM:
+        # options are passed on to ScheduledVM. The machine starts running,
+        # clearing vm.halted, with as many instructions for its priority as
+        # the least served machine, so it doesn't get a run of turns to
+        # catch up.
+        vm.halted = False
+        machine = ScheduledVM(vm, name if name is not None else str(len(self.machines)), **options)
+        machine.pass_value = self.min_pass()
+        self.machines.append(machine)
+        self.wake(machine)
+        return machine
+
+
+    def remove(self, machine: ScheduledVM) -> None:
+        self.machines.remove(machine)
+
+
+    def min_pass(self) -> float:
+        passes = [machine.pass_value for machine in self.machines
+                  if machine.state in ('ready', 'throttled')]
+        return min(passes) if len(passes) > 0 else 0.0
+
+
+    def wake(self, machine: Optional[ScheduledVM] = None) -> None:
+        # Let the event loop know that machine may have something to do, for
+        # example when input has arrived for it.
+        if machine is not None and machine.state == 'idle' and machine.input_waiting():
+            self.ready(machine)
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+
+    def pause(self, machine: ScheduledVM) -> None:
+        if machine.state in ('ready', 'idle', 'throttled'):
+            machine.state = 'paused'
+
+
+    def resume(self, machine: ScheduledVM) -> None:
+        if machine.state == 'paused':
+            self.ready(machine)
+            self.wake()
+
+
+    def ready(self, machine: ScheduledVM) -> None:
+        # Back in the running, without credit for the time it sat out
+        machine.pass_value = max(machine.pass_value, self.min_pass())
+        machine.state = 'ready'
+
+
+    def next_machine(self, now: float) -> Optional[ScheduledVM]:
+        # The runnable machine that's had the fewest instructions for its
+        # priority
+        chosen = None
+        for machine in self.machines:
+            if machine.state == 'idle' and machine.input_waiting():
+                self.ready(machine)
+            elif machine.state == 'throttled' and now >= machine.period_start + self.quota_period:
+                machine.state = 'ready'
+            if machine.state == 'ready' and (chosen is None or machine.pass_value < chosen.pass_value):
+                chosen = machine
+        return chosen
+
+
+    def run_turn(self) -> Optional[ScheduledVM]:
+        # Give the next machine its turn. Returns it, or None if none can run.
+        now = time.monotonic()
+        machine = self.next_machine(now)
+        if machine is None:
+            return None
+        if now >= machine.period_start + self.quota_period:
+            machine.period_start = now
+            machine.period_steps = 0
+        budget = int(self.quantum * machine.priority)
+        if machine.quota is not None:
+            budget = min(budget, max(1, machine.quota - machine.period_steps))
+        if machine.budget is not None:
+            budget = min(budget, machine.budget - machine.steps)
+
+        reason, steps = machine.vm.run_slice(budget)
+        end = time.monotonic()
+        machine.seconds += end - now
+        machine.steps += steps
+        machine.period_steps += steps
+        machine.slices += 1
+        machine.pass_value += steps / machine.priority
+
+        if reason == 'halted':
+            machine.state = 'halted'
+        elif machine.budget is not None and machine.steps >= machine.budget:
+            machine.state = 'done'
+            reason = 'done'
+        elif reason == 'idle':
+            machine.state = 'idle'
+            machine.idle_since = end
+        elif machine.quota is not None and machine.period_steps >= machine.quota:
+            machine.state = 'throttled'
+        if machine.on_slice is not None:
+            machine.on_slice(machine, reason)
+        return machine
+
+
+    def next_quota_period(self) -> Optional[float]:
+        # When the first throttled machine can run again
+        ends = [machine.period_start + self.quota_period for machine in self.machines
+                if machine.state == 'throttled']
+        return min(ends) if len(ends) > 0 else None
+
+
+    def run(self) -> None:
+        # Run until no machine has anything more to do but wait for input.
+        while True:
+            if self.run_turn() is None:
+                wait_until = self.next_quota_period()
+                if wait_until is None:
+                    return
+                time.sleep(max(0.0, wait_until - time.monotonic()))
+
+
+    async def run_async(self) -> None:
+        # Run forever in an asyncio event loop, letting other tasks run after
+        # every turn. Call wake() when input arrives for an idle machine.
+        self.wakeup = asyncio.Event()
+        while True:
+            if self.run_turn() is not None:
+                await asyncio.sleep(0)
+                continue
+            self.wakeup.clear()
+            wait_until = self.next_quota_period()
+            timeout = None if wait_until is None else max(0.0, wait_until - time.monotonic())
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+    def stats(self) -> List[Dict[str, Any]]:
+        # How each machine has been served: its share is the fraction of all
+        # the time spent running machines that went to it, and its
+        # utilization the fraction of the time since it was added.
+        now = time.monotonic()
+        total = sum(machine.seconds for machine in self.machines)
+        return [{
+            'name': machine.name,
+            'state': machine.state,
+            'priority': machine.priority,
+            'steps': machine.steps,
+            'slices': machine.slices,
+            'seconds': machine.seconds,
+            'share': machine.seconds / total if total > 0 else 0.0,
+            'utilization': machine.seconds / max(now - machine.added, 1e-9),
+            'steps_per_second': machine.steps / machine.seconds if machine.seconds > 0 else 0.0,
+        } for machine in self.machines]
+
+
+if __name__ == '__main__':
+    def spinner() -> Virtual8080:
+        vm = Virtual8080()
+        vm.memory[0] = 0xc3     # jmp 0000h
+        vm.memory[1] = 0x00
+        vm.memory[2] = 0x00
+        return vm
+
+    scheduler = Scheduler(quantum=1000)
+    low = scheduler.add(spinner(), 'low', budget=100000)
+    high = scheduler.add(spinner(), 'high', priority=2, budget=200000)
+    halts = scheduler.add(Virtual8080(), 'halts')
+    halts.vm.memory[0] = 0x76   # hlt
+    while low.steps < 50000:
+        scheduler.run_turn()
+    # Twice the priority, twice the instructions
+    assert abs(high.steps - 2 * low.steps) <= 2000
+    scheduler.run()
+    assert (low.steps, high.steps) == (100000, 200000)
+    assert (low.state, high.state, halts.state) == ('done', 'done', 'halted')
+    assert halts.steps == 1 and scheduler.run_turn() is None
+
+    throttled = scheduler.add(spinner(), 'throttled', quota=5000)
+    scheduler.quota_period = 0.05
+    start = time.monotonic()
+    while throttled.steps < 20000:
+        if scheduler.run_turn() is None:
+            time.sleep(0.001)
+    assert time.monotonic() - start >= 0.15
+    assert [s['name'] for s in scheduler.stats()] == ['low', 'high', 'halts', 'throttled']
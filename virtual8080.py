@@ -25,17 +25,30 @@
 
 """8080 machine code interpreter."""
 
+import asyncio
+import os
 import re
-from typing import Callable, Dict, List, Optional
+from typing import Callable, Dict, Iterator, Optional, Tuple
 
 from virtual_device import VirtualDevice
 
 
+IDLE_CHECK_STEPS = 1000     # Instructions between looks for an idle guest
+IDLE_POLLS = 100            # Polls for missing input in that many that mean idle
+
+Instruction = Callable[['Virtual8080'], None]
+
+# Program images read by load_file(), kept for the next machine to load them
+images: Dict[Tuple[str, int, int], bytes] = {}
+
+
 class Virtual8080:
 
+    op_table: Optional[Dict[int, Instruction]] = None
+
     def __init__(self, max_memory: int = 2**16, io: Optional[VirtualDevice] = None):
         self.max_memory: int = max_memory
-        self.memory: List[int] = [0 for _ in range(self.max_memory)]
+        self.memory: bytearray = bytearray(self.max_memory)
         self.io = io
         self.halted: bool = True
 
@@ -51,295 +64,400 @@ class Virtual8080:
         self.registers['sp'] = self.max_memory - 1
         self.registers['pc'] = 0
 
-        self.op: Dict[int, Callable[[], None]] = {}
-        self.op[0x00] = self.instr_nop()
-        self.op[0x10] = self.instr_nop()
-        self.op[0x20] = self.instr_nop()
-        self.op[0x30] = self.instr_nop()
-        self.op[0x40] = self.instr_mov_reg_reg('b', 'b')
-        self.op[0x50] = self.instr_mov_reg_reg('d', 'b')
-        self.op[0x60] = self.instr_mov_reg_reg('h', 'b')
-        self.op[0x70] = self.instr_mov_mem_reg('b')
-        self.op[0x80] = self.instr_add_reg('b')
-        self.op[0x90] = self.instr_sub_reg('b')
-        self.op[0xa0] = self.instr_ana_reg('b')
-        self.op[0xb0] = self.instr_ora_reg('b')
-        self.op[0xc0] = self.instr_ret_zero(0)
-        self.op[0xd0] = self.instr_ret_carry(0)
-        self.op[0xe0] = self.instr_ret_parity(0)
-        self.op[0xf0] = self.instr_ret_sign(0)
-
-        self.op[0x01] = self.instr_lxi('b', 'c')
-        self.op[0x11] = self.instr_lxi('d', 'e')
-        self.op[0x21] = self.instr_lxi('h', 'l')
-        self.op[0x31] = self.instr_lxi_sp()
-        self.op[0x41] = self.instr_mov_reg_reg('b', 'c')
-        self.op[0x51] = self.instr_mov_reg_reg('d', 'c')
-        self.op[0x61] = self.instr_mov_reg_reg('h', 'c')
-        self.op[0x71] = self.instr_mov_mem_reg('c')
-        self.op[0x81] = self.instr_add_reg('c')
-        self.op[0x91] = self.instr_sub_reg('c')
-        self.op[0xa1] = self.instr_ana_reg('c')
-        self.op[0xb1] = self.instr_ora_reg('c')
-        self.op[0xc1] = self.instr_pop('b', 'c')
-        self.op[0xd1] = self.instr_pop('d', 'e')
-        self.op[0xe1] = self.instr_pop('h', 'l')
-        self.op[0xf1] = self.instr_pop('a', 'f')
-
-        self.op[0x02] = self.instr_stax('b', 'c')
-        self.op[0x12] = self.instr_stax('d', 'e')
-        self.op[0x22] = self.instr_shld()
-        self.op[0x32] = self.instr_sta()
-        self.op[0x42] = self.instr_mov_reg_reg('b', 'd')
-        self.op[0x52] = self.instr_mov_reg_reg('d', 'd')
-        self.op[0x62] = self.instr_mov_reg_reg('h', 'd')
-        self.op[0x72] = self.instr_mov_mem_reg('d')
-        self.op[0x82] = self.instr_add_reg('d')
-        self.op[0x92] = self.instr_sub_reg('d')
-        self.op[0xa2] = self.instr_ana_reg('d')
-        self.op[0xb2] = self.instr_ora_reg('d')
-        self.op[0xc2] = self.instr_jmp_zero(0)
-        self.op[0xd2] = self.instr_jmp_carry(0)
-        self.op[0xe2] = self.instr_jmp_parity(0)
-        self.op[0xf2] = self.instr_jmp_sign(0)
-
-        self.op[0x03] = self.instr_inx('b', 'c')
-        self.op[0x13] = self.instr_inx('d', 'e')
-        self.op[0x23] = self.instr_inx('h', 'l')
-        self.op[0x33] = self.instr_inx_sp()
-        self.op[0x43] = self.instr_mov_reg_reg('b', 'e')
-        self.op[0x53] = self.instr_mov_reg_reg('d', 'e')
-        self.op[0x63] = self.instr_mov_reg_reg('h', 'e')
-        self.op[0x73] = self.instr_mov_mem_reg('e')
-        self.op[0x83] = self.instr_add_reg('e')
-        self.op[0x93] = self.instr_sub_reg('e')
-        self.op[0xa3] = self.instr_ana_reg('e')
-        self.op[0xb3] = self.instr_ora_reg('e')
-        self.op[0xc3] = self.instr_jmp()
-        self.op[0xd3] = self.instr_out()
-        self.op[0xe3] = self.instr_xthl()
-        self.op[0xf3] = self.instr_di()
-
-        self.op[0x04] = self.instr_inc_reg('b')
-        self.op[0x14] = self.instr_inc_reg('d')
-        self.op[0x24] = self.instr_inc_reg('h')
-        self.op[0x34] = self.instr_inc_mem()
-        self.op[0x44] = self.instr_mov_reg_reg('b', 'h')
-        self.op[0x54] = self.instr_mov_reg_reg('d', 'h')
-        self.op[0x64] = self.instr_mov_reg_reg('h', 'h')
-        self.op[0x74] = self.instr_mov_mem_reg('h')
-        self.op[0x84] = self.instr_add_reg('h')
-        self.op[0x94] = self.instr_sub_reg('h')
-        self.op[0xa4] = self.instr_ana_reg('h')
-        self.op[0xb4] = self.instr_ora_reg('h')
-        self.op[0xc4] = self.instr_call_zero(0)
-        self.op[0xd4] = self.instr_call_carry(0)
-        self.op[0xe4] = self.instr_call_parity(0)
-        self.op[0xf4] = self.instr_call_sign(0)
-
-        self.op[0x05] = self.instr_dcr_reg('b')
-        self.op[0x15] = self.instr_dcr_reg('d')
-        self.op[0x25] = self.instr_dcr_reg('h')
-        self.op[0x35] = self.instr_dcr_mem()
-        self.op[0x45] = self.instr_mov_reg_reg('b', 'l')
-        self.op[0x55] = self.instr_mov_reg_reg('d', 'l')
-        self.op[0x65] = self.instr_mov_reg_reg('h', 'l')
-        self.op[0x75] = self.instr_mov_mem_reg('l')
-        self.op[0x85] = self.instr_add_reg('l')
-        self.op[0x95] = self.instr_sub_reg('l')
-        self.op[0xa5] = self.instr_ana_reg('l')
-        self.op[0xb5] = self.instr_ora_reg('l')
-        self.op[0xc5] = self.instr_push('b', 'c')
-        self.op[0xd5] = self.instr_push('d', 'e')
-        self.op[0xe5] = self.instr_push('h', 'l')
-        self.op[0xf5] = self.instr_push('a', 'f')
-
-        self.op[0x06] = self.instr_mov_reg_immed('b')
-        self.op[0x16] = self.instr_mov_reg_immed('d')
-        self.op[0x26] = self.instr_mov_reg_immed('h')
-        self.op[0x36] = self.instr_mov_mem_immed()
-        self.op[0x46] = self.instr_mov_reg_mem('b')
-        self.op[0x56] = self.instr_mov_reg_mem('d')
-        self.op[0x66] = self.instr_mov_reg_mem('h')
-        self.op[0x76] = self.instr_halt()
-        self.op[0x86] = self.instr_add_mem()
-        self.op[0x96] = self.instr_sub_mem()
-        self.op[0xa6] = self.instr_ana_mem()
-        self.op[0xb6] = self.instr_ora_mem()
-        self.op[0xc6] = self.instr_add_immed()
-        self.op[0xd6] = self.instr_sub_immed()
-        self.op[0xe6] = self.instr_ana_immed()
-        self.op[0xf6] = self.instr_ora_immed()
-
-        self.op[0x07] = self.instr_rlc()
-        self.op[0x17] = self.instr_ral()
-        self.op[0x27] = self.instr_daa()
-        self.op[0x37] = self.instr_stc()
-        self.op[0x47] = self.instr_mov_reg_reg('b', 'a')
-        self.op[0x57] = self.instr_mov_reg_reg('d', 'a')
-        self.op[0x67] = self.instr_mov_reg_reg('h', 'a')
-        self.op[0x77] = self.instr_mov_mem_reg('a')
-        self.op[0x87] = self.instr_add_reg('a')
-        self.op[0x97] = self.instr_sub_reg('a')
-        self.op[0xa7] = self.instr_ana_reg('a')
-        self.op[0xb7] = self.instr_ora_reg('a')
-        self.op[0xc7] = self.instr_reset(0)
-        self.op[0xd7] = self.instr_reset(2)
-        self.op[0xe7] = self.instr_reset(4)
-        self.op[0xf7] = self.instr_reset(6)
-
-        self.op[0x08] = self.instr_nop()
-        self.op[0x18] = self.instr_nop()
-        self.op[0x28] = self.instr_nop()
-        self.op[0x38] = self.instr_nop()
-        self.op[0x48] = self.instr_mov_reg_reg('c', 'b')
-        self.op[0x58] = self.instr_mov_reg_reg('e', 'b')
-        self.op[0x68] = self.instr_mov_reg_reg('l', 'b')
-        self.op[0x78] = self.instr_mov_reg_reg('a', 'b')
-        self.op[0x88] = self.instr_adc_reg('b')
-        self.op[0x98] = self.instr_sbb_reg('b')
-        self.op[0xa8] = self.instr_xra_reg('b')
-        self.op[0xb8] = self.instr_cmp_reg('b')
-        self.op[0xc8] = self.instr_ret_zero(1)
-        self.op[0xd8] = self.instr_ret_carry(1)
-        self.op[0xe8] = self.instr_ret_parity(1)
-        self.op[0xf8] = self.instr_ret_sign(1)
-
-        self.op[0x09] = self.instr_dad('b', 'c')
-        self.op[0x19] = self.instr_dad('d', 'e')
-        self.op[0x29] = self.instr_dad('h', 'l')
-        self.op[0x39] = self.instr_dad_sp()
-        self.op[0x49] = self.instr_mov_reg_reg('c', 'c')
-        self.op[0x59] = self.instr_mov_reg_reg('e', 'c')
-        self.op[0x69] = self.instr_mov_reg_reg('l', 'c')
-        self.op[0x79] = self.instr_mov_reg_reg('a', 'c')
-        self.op[0x89] = self.instr_adc_reg('c')
-        self.op[0x99] = self.instr_sbb_reg('c')
-        self.op[0xa9] = self.instr_xra_reg('c')
-        self.op[0xb9] = self.instr_cmp_reg('c')
-        self.op[0xc9] = self.instr_ret()
-        self.op[0xd9] = self.instr_ret()
-        self.op[0xe9] = self.instr_pchl()
-        self.op[0xf9] = self.instr_sphl()
-
-        self.op[0x0a] = self.instr_ldax('b', 'c')
-        self.op[0x1a] = self.instr_ldax('d', 'e')
-        self.op[0x2a] = self.instr_lhld()
-        self.op[0x3a] = self.instr_lda()
-        self.op[0x4a] = self.instr_mov_reg_reg('c', 'd')
-        self.op[0x5a] = self.instr_mov_reg_reg('e', 'd')
-        self.op[0x6a] = self.instr_mov_reg_reg('l', 'd')
-        self.op[0x7a] = self.instr_mov_reg_reg('a', 'd')
-        self.op[0x8a] = self.instr_adc_reg('d')
-        self.op[0x9a] = self.instr_sbb_reg('d')
-        self.op[0xaa] = self.instr_xra_reg('d')
-        self.op[0xba] = self.instr_cmp_reg('d')
-        self.op[0xca] = self.instr_jmp_zero(1)
-        self.op[0xda] = self.instr_jmp_carry(1)
-        self.op[0xea] = self.instr_jmp_parity(1)
-        self.op[0xfa] = self.instr_jmp_sign(1)
-
-        self.op[0x0b] = self.instr_dcx('b', 'c')
-        self.op[0x1b] = self.instr_dcx('d', 'e')
-        self.op[0x2b] = self.instr_dcx('h', 'l')
-        self.op[0x3b] = self.instr_dcx_sp()
-        self.op[0x4b] = self.instr_mov_reg_reg('c', 'e')
-        self.op[0x5b] = self.instr_mov_reg_reg('e', 'e')
-        self.op[0x6b] = self.instr_mov_reg_reg('l', 'e')
-        self.op[0x7b] = self.instr_mov_reg_reg('a', 'e')
-        self.op[0x8b] = self.instr_adc_reg('e')
-        self.op[0x9b] = self.instr_sbb_reg('e')
-        self.op[0xab] = self.instr_xra_reg('e')
-        self.op[0xbb] = self.instr_cmp_reg('e')
-        self.op[0xcb] = self.instr_jmp()
-        self.op[0xdb] = self.instr_in()
-        self.op[0xeb] = self.instr_xchg()
-        self.op[0xfb] = self.instr_ei()
-
-        self.op[0x0c] = self.instr_inc_reg('c')
-        self.op[0x1c] = self.instr_inc_reg('e')
-        self.op[0x2c] = self.instr_inc_reg('l')
-        self.op[0x3c] = self.instr_inc_reg('a')
-        self.op[0x4c] = self.instr_mov_reg_reg('c', 'h')
-        self.op[0x5c] = self.instr_mov_reg_reg('e', 'h')
-        self.op[0x6c] = self.instr_mov_reg_reg('l', 'h')
-        self.op[0x7c] = self.instr_mov_reg_reg('a', 'h')
-        self.op[0x8c] = self.instr_adc_reg('h')
-        self.op[0x9c] = self.instr_sbb_reg('h')
-        self.op[0xac] = self.instr_xra_reg('h')
-        self.op[0xbc] = self.instr_cmp_reg('h')
-        self.op[0xcc] = self.instr_call_zero(1)
-        self.op[0xdc] = self.instr_call_carry(1)
-        self.op[0xec] = self.instr_call_parity(1)
-        self.op[0xfc] = self.instr_call_sign(1)
-
-        self.op[0x0d] = self.instr_dcr_reg('c')
-        self.op[0x1d] = self.instr_dcr_reg('e')
-        self.op[0x2d] = self.instr_dcr_reg('l')
-        self.op[0x3d] = self.instr_dcr_reg('a')
-        self.op[0x4d] = self.instr_mov_reg_reg('c', 'l')
-        self.op[0x5d] = self.instr_mov_reg_reg('e', 'l')
-        self.op[0x6d] = self.instr_mov_reg_reg('l', 'l')
-        self.op[0x7d] = self.instr_mov_reg_reg('a', 'l')
-        self.op[0x8d] = self.instr_adc_reg('l')
-        self.op[0x9d] = self.instr_sbb_reg('l')
-        self.op[0xad] = self.instr_xra_reg('l')
-        self.op[0xbd] = self.instr_cmp_reg('l')
-        self.op[0xcd] = self.instr_call()
-        self.op[0xdd] = self.instr_call()
-        self.op[0xed] = self.instr_call()
-        self.op[0xfd] = self.instr_call()
-
-        self.op[0x0e] = self.instr_mov_reg_immed('c')
-        self.op[0x1e] = self.instr_mov_reg_immed('e')
-        self.op[0x2e] = self.instr_mov_reg_immed('l')
-        self.op[0x3e] = self.instr_mov_reg_immed('a')
-        self.op[0x4e] = self.instr_mov_reg_mem('c')
-        self.op[0x5e] = self.instr_mov_reg_mem('e')
-        self.op[0x6e] = self.instr_mov_reg_mem('l')
-        self.op[0x7e] = self.instr_mov_reg_mem('a')
-        self.op[0x8e] = self.instr_adc_mem()
-        self.op[0x9e] = self.instr_sbb_mem()
-        self.op[0xae] = self.instr_xra_mem()
-        self.op[0xbe] = self.instr_cmp_mem()
-        self.op[0xce] = self.instr_adc_immed()
-        self.op[0xde] = self.instr_sbb_immed()
-        self.op[0xee] = self.instr_xra_immed()
-        self.op[0xfe] = self.instr_cmp_immed()
-
-        self.op[0x0f] = self.instr_rrc()
-        self.op[0x1f] = self.instr_rar()
-        self.op[0x2f] = self.instr_cma()
-        self.op[0x3f] = self.instr_cmc()
-        self.op[0x4f] = self.instr_mov_reg_reg('c', 'a')
-        self.op[0x5f] = self.instr_mov_reg_reg('e', 'a')
-        self.op[0x6f] = self.instr_mov_reg_reg('l', 'a')
-        self.op[0x7f] = self.instr_mov_reg_reg('a', 'a')
-        self.op[0x8f] = self.instr_adc_reg('a')
-        self.op[0x9f] = self.instr_sbb_reg('a')
-        self.op[0xaf] = self.instr_xra_reg('a')
-        self.op[0xbf] = self.instr_cmp_reg('a')
-        self.op[0xcf] = self.instr_reset(1)
-        self.op[0xdf] = self.instr_reset(3)
-        self.op[0xef] = self.instr_reset(5)
-        self.op[0xff] = self.instr_reset(7)
+        # Addresses whose code is run in Python instead. When a jump, call,
+        # return or restart reaches one, its hook is called in place of the
+        # instruction there, and must set pc itself, for example with
+        # return_from_sub(). A hook that leaves pc alone lets the
+        # instruction run after all.
+        self.pc_hooks: Dict[int, Callable[[], None]] = {}
+        self.hooked_op: Optional[Dict[int, Instruction]] = None
+
+        # The instruction table is built once and shared by every machine;
+        # each instruction is passed the machine it runs on.
+        if Virtual8080.op_table is None:
+            Virtual8080.op_table = Virtual8080.make_op_table()
+        self.op: Dict[int, Instruction] = Virtual8080.op_table
+
+    @staticmethod
+    def make_op_table() -> Dict[int, Instruction]:
+        op: Dict[int, Instruction] = {}
+        op[0x00] = Virtual8080.instr_nop()
+        op[0x10] = Virtual8080.instr_nop()
+        op[0x20] = Virtual8080.instr_nop()
+        op[0x30] = Virtual8080.instr_nop()
+        op[0x40] = Virtual8080.instr_mov_reg_reg('b', 'b')
+        op[0x50] = Virtual8080.instr_mov_reg_reg('d', 'b')
+        op[0x60] = Virtual8080.instr_mov_reg_reg('h', 'b')
+        op[0x70] = Virtual8080.instr_mov_mem_reg('b')
+        op[0x80] = Virtual8080.instr_add_reg('b')
+        op[0x90] = Virtual8080.instr_sub_reg('b')
+        op[0xa0] = Virtual8080.instr_ana_reg('b')
+        op[0xb0] = Virtual8080.instr_ora_reg('b')
+        op[0xc0] = Virtual8080.instr_ret_zero(0)
+        op[0xd0] = Virtual8080.instr_ret_carry(0)
+        op[0xe0] = Virtual8080.instr_ret_parity(0)
+        op[0xf0] = Virtual8080.instr_ret_sign(0)
+
+        op[0x01] = Virtual8080.instr_lxi('b', 'c')
+        op[0x11] = Virtual8080.instr_lxi('d', 'e')
+        op[0x21] = Virtual8080.instr_lxi('h', 'l')
+        op[0x31] = Virtual8080.instr_lxi_sp()
+        op[0x41] = Virtual8080.instr_mov_reg_reg('b', 'c')
+        op[0x51] = Virtual8080.instr_mov_reg_reg('d', 'c')
+        op[0x61] = Virtual8080.instr_mov_reg_reg('h', 'c')
+        op[0x71] = Virtual8080.instr_mov_mem_reg('c')
+        op[0x81] = Virtual8080.instr_add_reg('c')
+        op[0x91] = Virtual8080.instr_sub_reg('c')
+        op[0xa1] = Virtual8080.instr_ana_reg('c')
+        op[0xb1] = Virtual8080.instr_ora_reg('c')
+        op[0xc1] = Virtual8080.instr_pop('b', 'c')
+        op[0xd1] = Virtual8080.instr_pop('d', 'e')
+        op[0xe1] = Virtual8080.instr_pop('h', 'l')
+        op[0xf1] = Virtual8080.instr_pop('a', 'f')
+
+        op[0x02] = Virtual8080.instr_stax('b', 'c')
+        op[0x12] = Virtual8080.instr_stax('d', 'e')
+        op[0x22] = Virtual8080.instr_shld()
+        op[0x32] = Virtual8080.instr_sta()
+        op[0x42] = Virtual8080.instr_mov_reg_reg('b', 'd')
+        op[0x52] = Virtual8080.instr_mov_reg_reg('d', 'd')
+        op[0x62] = Virtual8080.instr_mov_reg_reg('h', 'd')
+        op[0x72] = Virtual8080.instr_mov_mem_reg('d')
+        op[0x82] = Virtual8080.instr_add_reg('d')
+        op[0x92] = Virtual8080.instr_sub_reg('d')
+        op[0xa2] = Virtual8080.instr_ana_reg('d')
+        op[0xb2] = Virtual8080.instr_ora_reg('d')
+        op[0xc2] = Virtual8080.instr_jmp_zero(0)
+        op[0xd2] = Virtual8080.instr_jmp_carry(0)
+        op[0xe2] = Virtual8080.instr_jmp_parity(0)
+        op[0xf2] = Virtual8080.instr_jmp_sign(0)
+
+        op[0x03] = Virtual8080.instr_inx('b', 'c')
+        op[0x13] = Virtual8080.instr_inx('d', 'e')
+        op[0x23] = Virtual8080.instr_inx('h', 'l')
+        op[0x33] = Virtual8080.instr_inx_sp()
+        op[0x43] = Virtual8080.instr_mov_reg_reg('b', 'e')
+        op[0x53] = Virtual8080.instr_mov_reg_reg('d', 'e')
+        op[0x63] = Virtual8080.instr_mov_reg_reg('h', 'e')
+        op[0x73] = Virtual8080.instr_mov_mem_reg('e')
+        op[0x83] = Virtual8080.instr_add_reg('e')
+        op[0x93] = Virtual8080.instr_sub_reg('e')
+        op[0xa3] = Virtual8080.instr_ana_reg('e')
+        op[0xb3] = Virtual8080.instr_ora_reg('e')
+        op[0xc3] = Virtual8080.instr_jmp()
+        op[0xd3] = Virtual8080.instr_out()
+        op[0xe3] = Virtual8080.instr_xthl()
+        op[0xf3] = Virtual8080.instr_di()
+
+        op[0x04] = Virtual8080.instr_inc_reg('b')
+        op[0x14] = Virtual8080.instr_inc_reg('d')
+        op[0x24] = Virtual8080.instr_inc_reg('h')
+        op[0x34] = Virtual8080.instr_inc_mem()
+        op[0x44] = Virtual8080.instr_mov_reg_reg('b', 'h')
+        op[0x54] = Virtual8080.instr_mov_reg_reg('d', 'h')
+        op[0x64] = Virtual8080.instr_mov_reg_reg('h', 'h')
+        op[0x74] = Virtual8080.instr_mov_mem_reg('h')
+        op[0x84] = Virtual8080.instr_add_reg('h')
+        op[0x94] = Virtual8080.instr_sub_reg('h')
+        op[0xa4] = Virtual8080.instr_ana_reg('h')
+        op[0xb4] = Virtual8080.instr_ora_reg('h')
+        op[0xc4] = Virtual8080.instr_call_zero(0)
+        op[0xd4] = Virtual8080.instr_call_carry(0)
+        op[0xe4] = Virtual8080.instr_call_parity(0)
+        op[0xf4] = Virtual8080.instr_call_sign(0)
+
+        op[0x05] = Virtual8080.instr_dcr_reg('b')
+        op[0x15] = Virtual8080.instr_dcr_reg('d')
+        op[0x25] = Virtual8080.instr_dcr_reg('h')
+        op[0x35] = Virtual8080.instr_dcr_mem()
+        op[0x45] = Virtual8080.instr_mov_reg_reg('b', 'l')
+        op[0x55] = Virtual8080.instr_mov_reg_reg('d', 'l')
+        op[0x65] = Virtual8080.instr_mov_reg_reg('h', 'l')
+        op[0x75] = Virtual8080.instr_mov_mem_reg('l')
+        op[0x85] = Virtual8080.instr_add_reg('l')
+        op[0x95] = Virtual8080.instr_sub_reg('l')
+        op[0xa5] = Virtual8080.instr_ana_reg('l')
+        op[0xb5] = Virtual8080.instr_ora_reg('l')
+        op[0xc5] = Virtual8080.instr_push('b', 'c')
+        op[0xd5] = Virtual8080.instr_push('d', 'e')
+        op[0xe5] = Virtual8080.instr_push('h', 'l')
+        op[0xf5] = Virtual8080.instr_push('a', 'f')
+
+        op[0x06] = Virtual8080.instr_mov_reg_immed('b')
+        op[0x16] = Virtual8080.instr_mov_reg_immed('d')
+        op[0x26] = Virtual8080.instr_mov_reg_immed('h')
+        op[0x36] = Virtual8080.instr_mov_mem_immed()
+        op[0x46] = Virtual8080.instr_mov_reg_mem('b')
+        op[0x56] = Virtual8080.instr_mov_reg_mem('d')
+        op[0x66] = Virtual8080.instr_mov_reg_mem('h')
+        op[0x76] = Virtual8080.instr_halt()
+        op[0x86] = Virtual8080.instr_add_mem()
+        op[0x96] = Virtual8080.instr_sub_mem()
+        op[0xa6] = Virtual8080.instr_ana_mem()
+        op[0xb6] = Virtual8080.instr_ora_mem()
+        op[0xc6] = Virtual8080.instr_add_immed()
+        op[0xd6] = Virtual8080.instr_sub_immed()
+        op[0xe6] = Virtual8080.instr_ana_immed()
+        op[0xf6] = Virtual8080.instr_ora_immed()
+
+        op[0x07] = Virtual8080.instr_rlc()
+        op[0x17] = Virtual8080.instr_ral()
+        op[0x27] = Virtual8080.instr_daa()
+        op[0x37] = Virtual8080.instr_stc()
+        op[0x47] = Virtual8080.instr_mov_reg_reg('b', 'a')
+        op[0x57] = Virtual8080.instr_mov_reg_reg('d', 'a')
+        op[0x67] = Virtual8080.instr_mov_reg_reg('h', 'a')
+        op[0x77] = Virtual8080.instr_mov_mem_reg('a')
+        op[0x87] = Virtual8080.instr_add_reg('a')
+        op[0x97] = Virtual8080.instr_sub_reg('a')
+        op[0xa7] = Virtual8080.instr_ana_reg('a')
+        op[0xb7] = Virtual8080.instr_ora_reg('a')
+        op[0xc7] = Virtual8080.instr_reset(0)
+        op[0xd7] = Virtual8080.instr_reset(2)
+        op[0xe7] = Virtual8080.instr_reset(4)
+        op[0xf7] = Virtual8080.instr_reset(6)
+
+        op[0x08] = Virtual8080.instr_nop()
+        op[0x18] = Virtual8080.instr_nop()
+        op[0x28] = Virtual8080.instr_nop()
+        op[0x38] = Virtual8080.instr_nop()
+        op[0x48] = Virtual8080.instr_mov_reg_reg('c', 'b')
+        op[0x58] = Virtual8080.instr_mov_reg_reg('e', 'b')
+        op[0x68] = Virtual8080.instr_mov_reg_reg('l', 'b')
+        op[0x78] = Virtual8080.instr_mov_reg_reg('a', 'b')
+        op[0x88] = Virtual8080.instr_adc_reg('b')
+        op[0x98] = Virtual8080.instr_sbb_reg('b')
+        op[0xa8] = Virtual8080.instr_xra_reg('b')
+        op[0xb8] = Virtual8080.instr_cmp_reg('b')
+        op[0xc8] = Virtual8080.instr_ret_zero(1)
+        op[0xd8] = Virtual8080.instr_ret_carry(1)
+        op[0xe8] = Virtual8080.instr_ret_parity(1)
+        op[0xf8] = Virtual8080.instr_ret_sign(1)
+
+        op[0x09] = Virtual8080.instr_dad('b', 'c')
+        op[0x19] = Virtual8080.instr_dad('d', 'e')
+        op[0x29] = Virtual8080.instr_dad('h', 'l')
+        op[0x39] = Virtual8080.instr_dad_sp()
+        op[0x49] = Virtual8080.instr_mov_reg_reg('c', 'c')
+        op[0x59] = Virtual8080.instr_mov_reg_reg('e', 'c')
+        op[0x69] = Virtual8080.instr_mov_reg_reg('l', 'c')
+        op[0x79] = Virtual8080.instr_mov_reg_reg('a', 'c')
+        op[0x89] = Virtual8080.instr_adc_reg('c')
+        op[0x99] = Virtual8080.instr_sbb_reg('c')
+        op[0xa9] = Virtual8080.instr_xra_reg('c')
+        op[0xb9] = Virtual8080.instr_cmp_reg('c')
+        op[0xc9] = Virtual8080.instr_ret()
+        op[0xd9] = Virtual8080.instr_ret()
+        op[0xe9] = Virtual8080.instr_pchl()
+        op[0xf9] = Virtual8080.instr_sphl()
+
+        op[0x0a] = Virtual8080.instr_ldax('b', 'c')
+        op[0x1a] = Virtual8080.instr_ldax('d', 'e')
+        op[0x2a] = Virtual8080.instr_lhld()
+        op[0x3a] = Virtual8080.instr_lda()
+        op[0x4a] = Virtual8080.instr_mov_reg_reg('c', 'd')
+        op[0x5a] = Virtual8080.instr_mov_reg_reg('e', 'd')
+        op[0x6a] = Virtual8080.instr_mov_reg_reg('l', 'd')
+        op[0x7a] = Virtual8080.instr_mov_reg_reg('a', 'd')
+        op[0x8a] = Virtual8080.instr_adc_reg('d')
+        op[0x9a] = Virtual8080.instr_sbb_reg('d')
+        op[0xaa] = Virtual8080.instr_xra_reg('d')
+        op[0xba] = Virtual8080.instr_cmp_reg('d')
+        op[0xca] = Virtual8080.instr_jmp_zero(1)
+        op[0xda] = Virtual8080.instr_jmp_carry(1)
+        op[0xea] = Virtual8080.instr_jmp_parity(1)
+        op[0xfa] = Virtual8080.instr_jmp_sign(1)
+
+        op[0x0b] = Virtual8080.instr_dcx('b', 'c')
+        op[0x1b] = Virtual8080.instr_dcx('d', 'e')
+        op[0x2b] = Virtual8080.instr_dcx('h', 'l')
+        op[0x3b] = Virtual8080.instr_dcx_sp()
+        op[0x4b] = Virtual8080.instr_mov_reg_reg('c', 'e')
+        op[0x5b] = Virtual8080.instr_mov_reg_reg('e', 'e')
+        op[0x6b] = Virtual8080.instr_mov_reg_reg('l', 'e')
+        op[0x7b] = Virtual8080.instr_mov_reg_reg('a', 'e')
+        op[0x8b] = Virtual8080.instr_adc_reg('e')
+        op[0x9b] = Virtual8080.instr_sbb_reg('e')
+        op[0xab] = Virtual8080.instr_xra_reg('e')
+        op[0xbb] = Virtual8080.instr_cmp_reg('e')
+        op[0xcb] = Virtual8080.instr_jmp()
+        op[0xdb] = Virtual8080.instr_in()
+        op[0xeb] = Virtual8080.instr_xchg()
+        op[0xfb] = Virtual8080.instr_ei()
+
+        op[0x0c] = Virtual8080.instr_inc_reg('c')
+        op[0x1c] = Virtual8080.instr_inc_reg('e')
+        op[0x2c] = Virtual8080.instr_inc_reg('l')
+        op[0x3c] = Virtual8080.instr_inc_reg('a')
+        op[0x4c] = Virtual8080.instr_mov_reg_reg('c', 'h')
+        op[0x5c] = Virtual8080.instr_mov_reg_reg('e', 'h')
+        op[0x6c] = Virtual8080.instr_mov_reg_reg('l', 'h')
+        op[0x7c] = Virtual8080.instr_mov_reg_reg('a', 'h')
+        op[0x8c] = Virtual8080.instr_adc_reg('h')
+        op[0x9c] = Virtual8080.instr_sbb_reg('h')
+        op[0xac] = Virtual8080.instr_xra_reg('h')
+        op[0xbc] = Virtual8080.instr_cmp_reg('h')
+        op[0xcc] = Virtual8080.instr_call_zero(1)
+        op[0xdc] = Virtual8080.instr_call_carry(1)
+        op[0xec] = Virtual8080.instr_call_parity(1)
+        op[0xfc] = Virtual8080.instr_call_sign(1)
+
+        op[0x0d] = Virtual8080.instr_dcr_reg('c')
+        op[0x1d] = Virtual8080.instr_dcr_reg('e')
+        op[0x2d] = Virtual8080.instr_dcr_reg('l')
+        op[0x3d] = Virtual8080.instr_dcr_reg('a')
+        op[0x4d] = Virtual8080.instr_mov_reg_reg('c', 'l')
+        op[0x5d] = Virtual8080.instr_mov_reg_reg('e', 'l')
+        op[0x6d] = Virtual8080.instr_mov_reg_reg('l', 'l')
+        op[0x7d] = Virtual8080.instr_mov_reg_reg('a', 'l')
+        op[0x8d] = Virtual8080.instr_adc_reg('l')
+        op[0x9d] = Virtual8080.instr_sbb_reg('l')
+        op[0xad] = Virtual8080.instr_xra_reg('l')
+        op[0xbd] = Virtual8080.instr_cmp_reg('l')
+        op[0xcd] = Virtual8080.instr_call()
+        op[0xdd] = Virtual8080.instr_call()
+        op[0xed] = Virtual8080.instr_call()
+        op[0xfd] = Virtual8080.instr_call()
+
+        op[0x0e] = Virtual8080.instr_mov_reg_immed('c')
+        op[0x1e] = Virtual8080.instr_mov_reg_immed('e')
+        op[0x2e] = Virtual8080.instr_mov_reg_immed('l')
+        op[0x3e] = Virtual8080.instr_mov_reg_immed('a')
+        op[0x4e] = Virtual8080.instr_mov_reg_mem('c')
+        op[0x5e] = Virtual8080.instr_mov_reg_mem('e')
+        op[0x6e] = Virtual8080.instr_mov_reg_mem('l')
+        op[0x7e] = Virtual8080.instr_mov_reg_mem('a')
+        op[0x8e] = Virtual8080.instr_adc_mem()
+        op[0x9e] = Virtual8080.instr_sbb_mem()
+        op[0xae] = Virtual8080.instr_xra_mem()
+        op[0xbe] = Virtual8080.instr_cmp_mem()
+        op[0xce] = Virtual8080.instr_adc_immed()
+        op[0xde] = Virtual8080.instr_sbb_immed()
+        op[0xee] = Virtual8080.instr_xra_immed()
+        op[0xfe] = Virtual8080.instr_cmp_immed()
+
+        op[0x0f] = Virtual8080.instr_rrc()
+        op[0x1f] = Virtual8080.instr_rar()
+        op[0x2f] = Virtual8080.instr_cma()
+        op[0x3f] = Virtual8080.instr_cmc()
+        op[0x4f] = Virtual8080.instr_mov_reg_reg('c', 'a')
+        op[0x5f] = Virtual8080.instr_mov_reg_reg('e', 'a')
+        op[0x6f] = Virtual8080.instr_mov_reg_reg('l', 'a')
+        op[0x7f] = Virtual8080.instr_mov_reg_reg('a', 'a')
+        op[0x8f] = Virtual8080.instr_adc_reg('a')
+        op[0x9f] = Virtual8080.instr_sbb_reg('a')
+        op[0xaf] = Virtual8080.instr_xra_reg('a')
+        op[0xbf] = Virtual8080.instr_cmp_reg('a')
+        op[0xcf] = Virtual8080.instr_reset(1)
+        op[0xdf] = Virtual8080.instr_reset(3)
+        op[0xef] = Virtual8080.instr_reset(5)
+        op[0xff] = Virtual8080.instr_reset(7)
+        return op
 
     def run(self) -> None:
         self.halted = False
         while not self.halted:
-            self.step()
+            self.run_for(100000)
+
+    def run_for(self, max_steps: int) -> int:
+        # Run up to max_steps instructions, or until HLT. Unlike run(), this
+        # doesn't clear self.halted first. Returns the number of steps run.
+        op = self.op if not self.pc_hooks else self.hooked_ops()
+        get_program_byte = self.get_program_byte
+        steps = 0
+        while steps < max_steps and not self.halted:
+            op[get_program_byte()](self)
+            steps += 1
+        return steps
+
+    def run_slice(self, budget: int) -> Tuple[str, int]:
+        # Run up to budget instructions like run_for(), but stop early once
+        # the guest is idle, spinning on an input port with nothing to read
+        # and nothing else to do. Returns why it stopped, 'halted', 'idle'
+        # or 'budget', and the number of steps run. An idle guest needs input
+        # before it has anything more to do.
+        io = self.io
+        steps = 0
+        while steps < budget and not self.halted:
+            polls = io.input_polls()[0] if io is not None else 0
+            steps += self.run_for(min(IDLE_CHECK_STEPS, budget - steps))
+            if io is not None:
+                # Programs check for a key now and then as they run, and
+                # while printing, so both the rate of polling and how long
+                # it's gone on with nothing happening count
+                total, since_io = io.input_polls()
+                if total - polls >= IDLE_POLLS and since_io >= IDLE_POLLS:
+                    return 'idle', steps
+        return ('halted' if self.halted else 'budget'), steps
+
+    def slices(self, budget: int) -> Iterator[Tuple[str, int]]:
+        # run_slice(budget) over and over, yielding each result, until HLT.
+        # Like run_for(), this doesn't clear self.halted first.
+        while not self.halted:
+            yield self.run_slice(budget)
+
+    async def run_async(self, budget: int, slice_steps: int = 10000) -> Tuple[str, int]:
+        # run_slice() for an asyncio event loop: the budget is run
+        # slice_steps instructions at a time, and other tasks get to run in
+        # between, so many machines can share one thread.
+        steps = 0
+        while True:
+            reason, count = self.run_slice(min(slice_steps, budget - steps))
+            steps += count
+            if reason != 'budget' or steps >= budget:
+                return reason, steps
+            await asyncio.sleep(0)
+
+    def hooked_ops(self) -> Dict[int, Instruction]:
+        # The instruction table with pc_hooks checked after every instruction
+        # that can jump, which are all among 0C0H-0FFH.
+        if self.hooked_op is None:
+            hooks = self.pc_hooks
+            registers = self.registers
+
+            def hooked(fn: Instruction) -> Instruction:
+                def checked(vm: Virtual8080) -> None:
+                    fn(vm)
+                    hook = hooks.get(registers['pc'])
+                    if hook is not None:
+                        hook()
+                return checked
+
+            self.hooked_op = {opcode: hooked(fn) if opcode >= 0xc0 else fn
+                              for opcode, fn in self.op.items()}
+        return self.hooked_op
 
     def step(self) -> None:
+        pc = self.registers['pc']
+        hook = self.pc_hooks.get(pc)
+        if hook is not None:
+            hook()
+            if self.registers['pc'] != pc:
+                return
+        self.execute()
+
+    def execute(self) -> None:
         _pc = self.registers['pc']  # for easier breakpoints
         opcode = self.get_program_byte()
-        self.op[opcode]()
+        self.op[opcode](self)
     
     def load(self, data: bytes, offset: int = 0) -> None:
-        i = offset
-        for c in data:
-            self.memory[i] = c
-            i += 1
+        if offset + len(data) > self.max_memory:
+            raise IndexError('bytearray index out of range')
+        self.memory[offset:offset + len(data)] = data
     
+    def load_file(self, filename: str, offset: int = 0) -> None:
+        # load() a file's contents. Each file is read once per process (until
+        # it changes), however many machines load it.
+        stat = os.stat(filename)
+        key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+        data = images.get(key)
+        if data is None:
+            with open(filename, 'rb') as f:
+                data = f.read()
+            images[key] = data
+        self.load(data, offset)
+
     def load_hex(self, hex_str: str) -> None:
         hex_re = re.compile(
             r'^:(?P<length>[0-9a-f]{2})(?P<address>[0-9a-f]{4})(?P<type>[0-9a-f]{2})(?P<data>[0-9a-f]*?)(?P<checksum>[0-9a-f]{2})$',
@@ -410,60 +528,69 @@ class Virtual8080:
     ## 8-bit load/store/move instructions
     ##
 
-    def instr_mov_reg_reg(self, dest: str, src: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_mov_reg_reg(dest: str, src: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             self.registers[dest] = self.registers[src]
         return fn
 
-    def instr_mov_reg_immed(self, dest: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_mov_reg_immed(dest: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             val = self.get_program_byte()
             self.registers[dest] = val
         return fn
 
-    def instr_mov_reg_mem(self, dest: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_mov_reg_mem(dest: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             addr = (self.registers['h'] << 8) | self.registers['l']
             self.registers[dest] = self.get_mem(addr)
         return fn
 
-    def instr_mov_mem_reg(self, src: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_mov_mem_reg(src: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             addr = (self.registers['h'] << 8) | self.registers['l']
             self.set_mem(addr, self.registers[src])
         return fn
 
-    def instr_mov_mem_immed(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_mov_mem_immed() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             val = self.get_program_byte()
             addr = (self.registers['h'] << 8) | self.registers['l']
             self.set_mem(addr, val)
         return fn
 
-    def instr_sta(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_sta() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             lo_addr = self.get_program_byte()
             hi_addr = self.get_program_byte()
             addr = (hi_addr << 8) | lo_addr
             self.set_mem(addr, self.registers['a'])
         return fn
 
-    def instr_stax(self, addr_hi: str, addr_lo: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_stax(addr_hi: str, addr_lo: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             addr = (self.registers[addr_hi] << 8) | self.registers[addr_lo]
             self.set_mem(addr, self.registers['a'])
         return fn
 
-    def instr_lda(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_lda() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             lo_addr = self.get_program_byte()
             hi_addr = self.get_program_byte()
             addr = (hi_addr << 8) | lo_addr
             self.registers['a'] = self.get_mem(addr)
         return fn
 
-    def instr_ldax(self, addr_hi: str, addr_lo: str):
-        def fn() -> None:
+    @staticmethod
+    def instr_ldax(addr_hi: str, addr_lo: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             addr = (self.registers[addr_hi] << 8) | self.registers[addr_lo]
             self.registers['a'] = self.get_mem(addr)
         return fn
@@ -472,29 +599,33 @@ class Virtual8080:
     ## 16-bit load/store/move instructions
     ##
 
-    def instr_lxi(self, dest_hi: str, dest_lo: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_lxi(dest_hi: str, dest_lo: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             self.registers[dest_lo] = self.get_program_byte()
             self.registers[dest_hi] = self.get_program_byte()
         return fn
 
-    def instr_lxi_sp(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_lxi_sp() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             lo = self.get_program_byte()
             hi = self.get_program_byte()
             self.registers['sp'] = (hi << 8) | lo
         return fn
 
-    def instr_sphl(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_sphl() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             lo_addr = self.registers['l']
             hi_addr = self.registers['h']
             addr = (hi_addr << 8) | lo_addr
             self.registers['sp'] = addr
         return fn
 
-    def instr_pop(self, dest_hi: str, dest_lo: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_pop(dest_hi: str, dest_lo: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             sp = self.registers['sp']
             self.registers[dest_lo] = self.get_mem(sp)
             if dest_lo == 'f':
@@ -504,16 +635,18 @@ class Virtual8080:
             self.registers['sp'] += 2
         return fn
 
-    def instr_push(self, src_hi: str, src_lo: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_push(src_hi: str, src_lo: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             sp = self.registers['sp']
             self.set_mem(sp - 1, self.registers[src_hi])
             self.set_mem(sp - 2, self.registers[src_lo])
             self.registers['sp'] -= 2
         return fn
 
-    def instr_shld(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_shld() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             lo_addr = self.get_program_byte()
             hi_addr = self.get_program_byte()
             addr = (hi_addr << 8) | lo_addr
@@ -521,8 +654,9 @@ class Virtual8080:
             self.set_mem(addr + 1, self.registers['h'])
         return fn
 
-    def instr_lhld(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_lhld() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             lo_addr = self.get_program_byte()
             hi_addr = self.get_program_byte()
             addr = (hi_addr << 8) | lo_addr
@@ -530,14 +664,16 @@ class Virtual8080:
             self.registers['h'] = self.get_mem(addr + 1)
         return fn
 
-    def instr_xchg(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_xchg() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             self.registers['h'], self.registers['d'] = self.registers['d'], self.registers['h']
             self.registers['l'], self.registers['e'] = self.registers['e'], self.registers['l']
         return fn
 
-    def instr_xthl(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_xthl() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             sp = self.registers['sp']
             val_lo = self.get_mem(sp)
             val_hi = self.get_mem(sp + 1)
@@ -551,8 +687,9 @@ class Virtual8080:
     ## 8-bit logic/arithmetic instructions
     ##
 
-    def instr_add_reg(self, src: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_add_reg(src: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             sum = self.registers['a'] + self.registers[src]
             lsn_sum = (self.registers['a'] & 0x0f) + (self.registers[src] & 0x0f)
             result = sum % 256
@@ -564,8 +701,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_adc_reg(self, src: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_adc_reg(src: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             sum = self.registers['a'] + self.registers[src] + self.get_flag_carry()
             lsn_sum = (self.registers['a'] & 0x0f) + (self.registers[src] & 0x0f) + self.get_flag_carry()
             result = sum % 256
@@ -577,8 +715,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_sub_reg(self, src: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_sub_reg(src: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             diff = self.registers['a'] - self.registers[src]
             lsn_diff = (self.registers['a'] & 0x0f) - (self.registers[src] & 0x0f)
             result = diff % 256
@@ -590,8 +729,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_sbb_reg(self, src: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_sbb_reg(src: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             diff = self.registers['a'] - self.registers[src] - self.get_flag_carry()
             lsn_diff = (self.registers['a'] & 0x0f) - (self.registers[src] & 0x0f) - self.get_flag_carry()
             result = diff % 256
@@ -603,8 +743,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_ana_reg(self, src: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_ana_reg(src: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             result = self.registers['a'] & self.registers[src]
             self.set_flag_sign(result >> 7)
             self.set_flag_zero(1 if result == 0 else 0)
@@ -614,8 +755,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_ora_reg(self, src: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_ora_reg(src: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             result = self.registers['a'] | self.registers[src]
             self.set_flag_sign(result >> 7)
             self.set_flag_zero(1 if result == 0 else 0)
@@ -625,8 +767,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_xra_reg(self, src: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_xra_reg(src: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             result = self.registers['a'] ^ self.registers[src]
             self.set_flag_sign(result >> 7)
             self.set_flag_zero(1 if result == 0 else 0)
@@ -636,8 +779,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_cmp_reg(self, src: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_cmp_reg(src: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             diff = self.registers['a'] - self.registers[src]
             lsn_diff = (self.registers['a'] & 0x0f) - (self.registers[src] & 0x0f)
             result = diff % 256
@@ -648,8 +792,9 @@ class Virtual8080:
             self.set_flag_carry(1 if diff < 0 else 0)
         return fn
 
-    def instr_add_mem(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_add_mem() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             addr = (self.registers['h'] << 8) | self.registers['l']
             sum = self.registers['a'] + self.get_mem(addr)
             lsn_sum = (self.registers['a'] &0x0f) + (self.get_mem(addr) & 0x0f)
@@ -662,8 +807,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_adc_mem(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_adc_mem() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             addr = (self.registers['h'] << 8) | self.registers['l']
             sum = self.registers['a'] + self.get_mem(addr) + self.get_flag_carry()
             lsn_sum = (self.registers['a'] &0x0f) + (self.get_mem(addr) & 0x0f) + self.get_flag_carry()
@@ -676,8 +822,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_cmp_mem(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_cmp_mem() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             addr = (self.registers['h'] << 8) | self.registers['l']
             diff = self.registers['a'] - self.get_mem(addr)
             lsn_diff = (self.registers['a'] & 0x0f) - (self.get_mem(addr) &0x0f)
@@ -689,8 +836,9 @@ class Virtual8080:
             self.set_flag_carry(1 if diff < 0 else 0)
         return fn
 
-    def instr_sub_mem(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_sub_mem() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             addr = (self.registers['h'] << 8) | self.registers['l']
             diff = self.registers['a'] - self.get_mem(addr)
             lsn_diff = (self.registers['a'] & 0x0f) - (self.get_mem(addr) &0x0f)
@@ -703,8 +851,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_sbb_mem(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_sbb_mem() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             addr = (self.registers['h'] << 8) | self.registers['l']
             diff = self.registers['a'] - self.get_mem(addr) - self.get_flag_carry()
             lsn_diff = (self.registers['a'] & 0x0f) - (self.get_mem(addr) &0x0f) - self.get_flag_carry()
@@ -717,8 +866,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_ana_mem(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_ana_mem() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             addr = (self.registers['h'] << 8) | self.registers['l']
             result = self.registers['a'] & self.get_mem(addr)
             self.set_flag_sign(result >> 7)
@@ -729,8 +879,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_ora_mem(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_ora_mem() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             addr = (self.registers['h'] << 8) | self.registers['l']
             result = self.registers['a'] | self.get_mem(addr)
             self.set_flag_sign(result >> 7)
@@ -741,8 +892,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_xra_mem(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_xra_mem() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             addr = (self.registers['h'] << 8) | self.registers['l']
             result = self.registers['a'] ^ self.get_mem(addr)
             self.set_flag_sign(result >> 7)
@@ -753,8 +905,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_add_immed(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_add_immed() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             immed = self.get_program_byte()
             sum = self.registers['a'] + immed
             lsn_sum = (self.registers['a'] & 0x0f) + (immed & 0x0f)
@@ -767,8 +920,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_adc_immed(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_adc_immed() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             immed = self.get_program_byte()
             sum_ = self.registers['a'] + immed + self.get_flag_carry()
             lsn_sum = (self.registers['a'] & 0x0f) + (immed & 0x0f) + self.get_flag_carry()
@@ -781,8 +935,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_cmp_immed(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_cmp_immed() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             immed = self.get_program_byte()
             diff = self.registers['a'] - immed
             lsn_diff = (self.registers['a'] & 0x0f) - (immed & 0x0f)
@@ -794,8 +949,9 @@ class Virtual8080:
             self.set_flag_carry(1 if diff < 0 else 0)
         return fn
 
-    def instr_sub_immed(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_sub_immed() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             immed = self.get_program_byte()
             diff = self.registers['a'] - immed
             lsn_diff = (self.registers['a'] & 0x0f) - (immed & 0x0f)
@@ -808,8 +964,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_sbb_immed(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_sbb_immed() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             immed = self.get_program_byte()
             diff = self.registers['a'] - immed - self.get_flag_carry()
             lsn_diff = (self.registers['a'] & 0x0f) - (immed & 0x0f) - self.get_flag_carry()
@@ -822,8 +979,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_ana_immed(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_ana_immed() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             immed = self.get_program_byte()
             result = self.registers['a'] & immed
             self.set_flag_sign(result >> 7)
@@ -834,8 +992,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_ora_immed(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_ora_immed() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             immed = self.get_program_byte()
             result = self.registers['a'] | immed
             self.set_flag_sign(result >> 7)
@@ -846,8 +1005,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_xra_immed(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_xra_immed() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             immed = self.get_program_byte()
             result = self.registers['a'] ^ immed
             self.set_flag_sign(result >> 7)
@@ -858,8 +1018,9 @@ class Virtual8080:
             self.registers['a'] = result
         return fn
 
-    def instr_inc_reg(self, reg: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_inc_reg(reg: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             result = (self.registers[reg] + 1) % 256
             self.set_flag_sign(result >> 7)
             self.set_flag_zero(1 if result == 0 else 0)
@@ -868,8 +1029,9 @@ class Virtual8080:
             self.registers[reg] = result
         return fn
 
-    def instr_inc_mem(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_inc_mem() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             addr = (self.registers['h'] << 8) | self.registers['l']
             result = (self.get_mem(addr) + 1) % 256
             self.set_flag_sign(result >> 7)
@@ -879,8 +1041,9 @@ class Virtual8080:
             self.set_mem(addr, result)
         return fn
 
-    def instr_dcr_reg(self, reg: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_dcr_reg(reg: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             result = (self.registers[reg] - 1) % 256
             self.set_flag_sign(result >> 7)
             self.set_flag_zero(1 if result == 0 else 0)
@@ -889,8 +1052,9 @@ class Virtual8080:
             self.registers[reg] = result
         return fn
 
-    def instr_dcr_mem(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_dcr_mem() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             addr = (self.registers['h'] << 8) | self.registers['l']
             result = (self.get_mem(addr) - 1) % 256
             self.set_flag_sign(result >> 7)
@@ -900,51 +1064,59 @@ class Virtual8080:
             self.set_mem(addr, result)
         return fn
     
-    def instr_rlc(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_rlc() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             self.set_flag_carry((self.registers['a'] & 0b10000000) >> 7)
             self.registers['a'] = (((self.registers['a'] << 1) & 0xff)
                                    | self.get_flag_carry())
         return fn
     
-    def instr_ral(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_ral() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             c = self.get_flag_carry()
             self.set_flag_carry((self.registers['a'] & 0b10000000) >> 7)
             self.registers['a'] = ((self.registers['a'] << 1) & 0xff) | c
         return fn
     
-    def instr_rrc(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_rrc() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             self.set_flag_carry(self.registers['a'] & 0b00000001)
             self.registers['a'] = ((self.registers['a'] >> 1)
                                    | (self.get_flag_carry() << 7))
         return fn
     
-    def instr_rar(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_rar() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             c = self.get_flag_carry()
             self.set_flag_carry(self.registers['a'] & 0b00000001)
             self.registers['a'] = ((self.registers['a'] >> 1) | (c << 7))
         return fn
 
-    def instr_cma(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_cma() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             self.registers['a'] = self.registers['a'] ^ 0xff
         return fn
 
-    def instr_stc(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_stc() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             self.set_flag_carry(1)
         return fn
 
-    def instr_cmc(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_cmc() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             self.set_flag_carry(0 if self.get_flag_carry() else 1)
         return fn
 
-    def instr_daa(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_daa() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             acc = self.registers['a']
             carry = self.get_flag_carry()
             aux_carry = self.get_flag_auxcarry()
@@ -974,8 +1146,9 @@ class Virtual8080:
     ## 16-bit logic/arithmetic instructions
     ##
 
-    def instr_dad(self, hi: str, lo: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_dad(hi: str, lo: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             acc = (self.registers['h'] << 8) | self.registers['l']
             operand = (self.registers[hi] << 8) | self.registers[lo]
             sum_ = acc + operand
@@ -987,8 +1160,9 @@ class Virtual8080:
             self.set_flag_carry(1 if sum_ > 0xffff else 0)
         return fn
 
-    def instr_dad_sp(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_dad_sp() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             acc = (self.registers['h'] << 8) | self.registers['l']
             operand = self.registers['sp']
             sum_ = acc + operand
@@ -1000,8 +1174,9 @@ class Virtual8080:
             self.set_flag_carry(1 if sum_ > 0xffff else 0)
         return fn
 
-    def instr_inx(self, hi: str, lo: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_inx(hi: str, lo: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             val = (self.registers[hi] << 8) | self.registers[lo]
             val = (val + 1) % 65536
             val_hi = (val & 0xff00) >> 8
@@ -1010,13 +1185,15 @@ class Virtual8080:
             self.registers[lo] = val_lo
         return fn
 
-    def instr_inx_sp(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_inx_sp() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             self.registers['sp'] = (self.registers['sp'] + 1) % 65536
         return fn
 
-    def instr_dcx(self, hi: str, lo: str) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_dcx(hi: str, lo: str) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             val = (self.registers[hi] << 8) | self.registers[lo]
             val = (val - 1) % 65536
             val_hi = (val & 0xff00) >> 8
@@ -1025,8 +1202,9 @@ class Virtual8080:
             self.registers[lo] = val_lo
         return fn
 
-    def instr_dcx_sp(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_dcx_sp() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             self.registers['sp'] = (self.registers['sp'] - 1) % 65536
         return fn
 
@@ -1034,53 +1212,61 @@ class Virtual8080:
     ## Jump/call instructions
     ##
 
-    def instr_ret(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_ret() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             self.return_from_sub()
         return fn
 
-    def instr_ret_zero(self, cmp: int) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_ret_zero(cmp: int) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             if self.get_flag_zero() == cmp:
                 self.return_from_sub()
         return fn
 
-    def instr_ret_carry(self, cmp: int) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_ret_carry(cmp: int) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             if self.get_flag_carry() == cmp:
                 self.return_from_sub()
         return fn
 
-    def instr_ret_parity(self, cmp: int) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_ret_parity(cmp: int) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             if self.get_flag_parity() == cmp:
                 self.return_from_sub()
         return fn
 
-    def instr_ret_sign(self, cmp: int) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_ret_sign(cmp: int) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             if self.get_flag_sign() == cmp:
                 self.return_from_sub()
         return fn
 
-    def instr_pchl(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_pchl() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             lo_addr = self.registers['l']
             hi_addr = self.registers['h']
             addr = (hi_addr << 8) | lo_addr
             self.registers['pc'] = addr
         return fn
 
-    def instr_jmp(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_jmp() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             lo_addr = self.get_program_byte()
             hi_addr = self.get_program_byte()
             addr = (hi_addr << 8) | lo_addr
             self.registers['pc'] = addr
         return fn
 
-    def instr_jmp_zero(self, cmp: int) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_jmp_zero(cmp: int) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             lo_addr = self.get_program_byte()
             hi_addr = self.get_program_byte()
             addr = (hi_addr << 8) | lo_addr
@@ -1088,8 +1274,9 @@ class Virtual8080:
                 self.registers['pc'] = addr
         return fn
 
-    def instr_jmp_carry(self, cmp: int) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_jmp_carry(cmp: int) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             lo_addr = self.get_program_byte()
             hi_addr = self.get_program_byte()
             addr = (hi_addr << 8) | lo_addr
@@ -1097,8 +1284,9 @@ class Virtual8080:
                 self.registers['pc'] = addr
         return fn
 
-    def instr_jmp_parity(self, cmp: int) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_jmp_parity(cmp: int) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             lo_addr = self.get_program_byte()
             hi_addr = self.get_program_byte()
             addr = (hi_addr << 8) | lo_addr
@@ -1106,8 +1294,9 @@ class Virtual8080:
                 self.registers['pc'] = addr
         return fn
 
-    def instr_jmp_sign(self, cmp: int) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_jmp_sign(cmp: int) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             lo_addr = self.get_program_byte()
             hi_addr = self.get_program_byte()
             addr = (hi_addr << 8) | lo_addr
@@ -1115,16 +1304,18 @@ class Virtual8080:
                 self.registers['pc'] = addr
         return fn
 
-    def instr_call(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_call() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             lo_addr = self.get_program_byte()
             hi_addr = self.get_program_byte()
             addr = (hi_addr << 8) | lo_addr
             self.call_sub(addr)
         return fn
 
-    def instr_call_zero(self, cmp: int) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_call_zero(cmp: int) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             lo_addr = self.get_program_byte()
             hi_addr = self.get_program_byte()
             addr = (hi_addr << 8) | lo_addr
@@ -1132,8 +1323,9 @@ class Virtual8080:
                 self.call_sub(addr)
         return fn
 
-    def instr_call_carry(self, cmp: int) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_call_carry(cmp: int) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             lo_addr = self.get_program_byte()
             hi_addr = self.get_program_byte()
             addr = (hi_addr << 8) | lo_addr
@@ -1141,8 +1333,9 @@ class Virtual8080:
                 self.call_sub(addr)
         return fn
 
-    def instr_call_parity(self, cmp: int) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_call_parity(cmp: int) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             lo_addr = self.get_program_byte()
             hi_addr = self.get_program_byte()
             addr = (hi_addr << 8) | lo_addr
@@ -1150,8 +1343,9 @@ class Virtual8080:
                 self.call_sub(addr)
         return fn
 
-    def instr_call_sign(self, cmp: int) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_call_sign(cmp: int) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             lo_addr = self.get_program_byte()
             hi_addr = self.get_program_byte()
             addr = (hi_addr << 8) | lo_addr
@@ -1159,8 +1353,9 @@ class Virtual8080:
                 self.call_sub(addr)
         return fn
 
-    def instr_reset(self, exp: int) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_reset(exp: int) -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             addr = exp << 3
             self.call_sub(addr)
         return fn
@@ -1184,37 +1379,43 @@ class Virtual8080:
     ## Misc. instructions
     ##
 
-    def instr_nop(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_nop() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             pass
         return fn
 
-    def instr_halt(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_halt() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             self.halted = True
             self.registers['pc'] -= 1
         return fn
 
-    def instr_ei(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_ei() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             pass
         return fn
 
-    def instr_di(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_di() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             pass
         return fn
 
-    def instr_in(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_in() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             port_addr = self.get_program_byte()
             ch = self.io.get_input(port_addr) if self.io is not None else None
             if ch is not None:
                 self.registers['a'] = ch
         return fn
 
-    def instr_out(self) -> Callable[[], None]:
-        def fn() -> None:
+    @staticmethod
+    def instr_out() -> Instruction:
+        def fn(self: 'Virtual8080') -> None:
             port_addr = self.get_program_byte()
             val = self.registers['a']
             if self.io is not None:
@@ -1394,3 +1595,27 @@ if __name__ == '__main__':
     assert(vm.get_flag_auxcarry() == 0)   # wtf
     assert(vm.get_flag_parity() == 0)
     assert(vm.get_flag_carry() == 1)
+
+    vm = Virtual8080()
+    vm.memory[0] = 0xcd     # call 0010h
+    vm.memory[1] = 0x10
+    vm.memory[2] = 0x00
+    vm.memory[3] = 0x76     # hlt
+    vm.memory[0x10] = 0x76  # hlt, unless hooked
+    def hook() -> None:
+        vm.registers['a'] = 0x42
+        vm.return_from_sub()
+    vm.pc_hooks[0x10] = hook
+    vm.run()
+    assert(vm.registers['a'] == 0x42)
+    assert(vm.registers['pc'] == 3)
+
+    vm = Virtual8080()
+    vm.memory[0] = 0xc3     # jmp 0000h
+    vm.memory[1] = 0x00
+    vm.memory[2] = 0x00
+    vm.halted = False
+    assert(vm.run_slice(2500) == ('budget', 2500))
+    vm.memory[0] = 0x76     # hlt
+    assert(asyncio.run(vm.run_async(100000, 1000)) == ('halted', 1))
+    assert(list(vm.slices(1000)) == [])
@@ -23,10 +23,11 @@
 #
 # For more information, please refer to <https://unlicense.org>
 
-"""Abstract class representing the I/O devices connected to an 8080."""
+"""Abstract classes representing the I/O devices connected to an 8080."""
 
 from abc import ABC, abstractmethod
-from typing import Optional
+from collections import deque
+from typing import BinaryIO, Callable, Deque, Optional, Tuple, Union
 
 
 class VirtualDevice(ABC):
@@ -38,3 +39,121 @@ class VirtualDevice(ABC):
     @abstractmethod
     def send_output(self, port_addr: int, value: int) -> None:
         pass
+
+    def input_polls(self) -> Tuple[int, int]:
+        # How many times so far the guest has looked for input and found none,
+        # and how many of those came since the console last had any input or
+        # output. Both climbing quickly means the guest is idle, waiting.
+        return 0, 0
+
+
+class InputQueue:
+    """FIFO of bytes waiting to be read by the guest from a console.
+
+    Keystrokes are pushed with push(). Whole files or pipes can be attached
+    with stream(); they are read a chunk at a time, only when fewer than
+    low_water bytes are queued, so a large file is typed in at the rate the
+    guest consumes it, in linear time and bounded memory."""
+
+    def __init__(self, low_water: int = 256, chunk_size: int = 4096):
+        self.low_water: int = low_water
+        self.chunk_size: int = chunk_size
+        self.queue: Deque[int] = deque()
+        self.sources: Deque[Tuple[Union[BinaryIO, bytes], Optional[bytes], bytes]] = deque()
+        self.empty_polls: int = 0   # Calls to ready() or pop() that found nothing
+        self.polls_since_io: int = 0    # The same, since the last that found something
+
+    def __len__(self) -> int:
+        return len(self.queue)
+
+    def push(self, data: bytes) -> None:
+        if len(self.sources) > 0:
+            # Keep typing order behind anything still being streamed
+            self.sources.append((data, None, b''))
+        else:
+            self.queue.extend(data)
+
+    def stream(self,
+               source: BinaryIO,
+               translate: Optional[bytes] = None,
+               delete: bytes = b'') -> None:
+        # Queue the contents of source, passed through bytes.translate().
+        # The source is closed once it's exhausted.
+        self.sources.append((source, translate, delete))
+
+    def refill(self) -> None:
+        while len(self.queue) <= self.low_water and len(self.sources) > 0:
+            source, translate, delete = self.sources[0]
+            if isinstance(source, bytes):
+                self.sources.popleft()
+                self.queue.extend(source)
+                continue
+            read = getattr(source, 'read1', source.read)
+            data = read(self.chunk_size)
+            if len(data) == 0:
+                self.sources.popleft()
+                source.close()
+                continue
+            if translate is not None or len(delete) > 0:
+                data = data.translate(translate, delete)
+            self.queue.extend(data)
+
+    def ready(self) -> bool:
+        if len(self.queue) == 0 and len(self.sources) > 0:
+            self.refill()
+        if len(self.queue) > 0:
+            self.polls_since_io = 0
+            return True
+        self.empty_polls += 1
+        self.polls_since_io += 1
+        return False
+
+    def pop(self) -> Optional[int]:
+        if len(self.queue) <= self.low_water and len(self.sources) > 0:
+            self.refill()
+        if len(self.queue) > 0:
+            self.polls_since_io = 0
+            return self.queue.popleft()
+        self.empty_polls += 1
+        self.polls_since_io += 1
+        return None
+
+    def clear(self) -> None:
+        self.queue.clear()
+        while len(self.sources) > 0:
+            source = self.sources.popleft()[0]
+            if not isinstance(source, bytes):
+                source.close()
+
+
+class ConsoleDevice(VirtualDevice):
+    """A device with a console terminal attached.
+
+    Console input is read from input_queue. Console output is appended to a
+    FIFO that the front end drains in chunks, so the emulator can run any
+    number of instructions between polls without losing characters. When the
+    FIFO reaches output_high_water bytes, on_output_high_water is called (if
+    set) so the front end can drain it early."""
+
+    def __init__(self,
+                 output_high_water: int = 4096,
+                 on_output_high_water: Optional[Callable[[], None]] = None):
+        self.input_queue: InputQueue = InputQueue()
+        self.output_buffer: bytearray = bytearray()
+        self.output_high_water: int = output_high_water
+        self.on_output_high_water: Optional[Callable[[], None]] = on_output_high_water
+
+    def put_output(self, value: int) -> None:
+        self.output_buffer.append(value)
+        self.input_queue.polls_since_io = 0
+        if (len(self.output_buffer) >= self.output_high_water
+                and self.on_output_high_water is not None):
+            self.on_output_high_water()
+
+    def input_polls(self) -> Tuple[int, int]:
+        return self.input_queue.empty_polls, self.input_queue.polls_since_io
+
+    def drain_output(self) -> bytes:
+        data = bytes(self.output_buffer)
+        self.output_buffer.clear()
+        return data
@@ -0,0 +1,113 @@
+# This is free and unencumbered software released into the public domain.
+#
+# Anyone is free to copy, modify, publish, use, compile, sell, or
+# distribute this software, either in source code form or as a compiled
+# binary, for any purpose, commercial or non-commercial, and by any
+# means.
+#
+# In jurisdictions that recognize copyright laws, the author or authors
+# of this software dedicate any and all copyright interest in the
+# software to the public domain. We make this dedication for the benefit
+# of the public at large and to the detriment of our heirs and
+# successors. We intend this dedication to be an overt act of
+# relinquishment in perpetuity of all present and future rights to this
+# software under copyright law.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# For more information, please refer to <https://unlicense.org>
+
+"""Getting through boot quickly.
+
+warp_until() runs a machine flat out, with nothing drawn, until its console
+shows a prompt. A snapshot of the machine at the prompt can be saved, so the
+next run with the same setup can start from it instead of booting."""
+
+
+import json
+import os
+import tempfile
+from typing import Any, Dict, List, Optional
+
+from virtual8080 import Virtual8080
+
+
+WARP_BATCH_SIZE = 100000    # Instructions to run between looks at the console
+WARP_MAX_STEPS = 5000000    # Give up on seeing the prompt after this many
+
+SNAPSHOT_VERSION = 1
+
+
+def warp_until(vm: Virtual8080, prompt: bytes, max_steps: int = WARP_MAX_STEPS) -> bool:
+    # Run until the console output ends with prompt (and any line ending),
+    # and the machine has printed nothing more for a batch since, so it's
+    # waiting at the prompt rather than passing through it. The output is
+    # left in vm.io's buffer for the front end. Returns False if the machine
+    # halts or max_steps pass first.
+    output = vm.io.output_buffer
+    steps = 0
+    at_prompt = False
+    while not vm.halted and steps < max_steps:
+        length = len(output)
+        steps += vm.run_for(WARP_BATCH_SIZE)
+        if at_prompt and len(output) == length:
+            return True
+        at_prompt = bytes(output[-len(prompt) - 8:]).rstrip(b'\r\n').endswith(prompt)
+    return False
+
+
+def file_fingerprint(path: str) -> List[Any]:
+    # Enough to tell if a file, or a directory and the files in it, has
+    # changed since.
+    if os.path.isdir(path):
+        return [[name] + file_fingerprint(os.path.join(path, name))
+                for name in sorted(os.listdir(path))]
+    if not os.path.exists(path):
+        return [None]
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def save_snapshot(filename: str, key: Any, vm: Virtual8080, output: bytes,
+                  device: Dict[str, Any]) -> None:
+    # key is anything JSON can hold that sums up what the machine was started
+    # from; the snapshot is only used by a machine started the same way.
+    # device is the state of vm.io.
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'key': key,
+        'memory': bytes(vm.memory).hex(),
+        'registers': vm.registers,
+        'output': output.hex(),
+        'device': device,
+    }
+    # Written beside the old one and renamed over it, so a machine starting
+    # meanwhile doesn't read half a snapshot
+    fd, new_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(new_file, filename)
+
+
+def load_snapshot(filename: str, key: Any, vm: Virtual8080) -> Optional[Dict[str, Any]]:
+    # Restore vm's memory and registers, put the console output from before
+    # the snapshot back in vm.io's buffer, and return the state of vm.io. None
+    # if there's no snapshot for key, leaving vm alone.
+    try:
+        with open(filename) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # Round trip key through JSON, so tuples compare equal to lists
+    if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('key') != json.loads(json.dumps(key)):
+        return None
+    vm.memory[:] = bytes.fromhex(snapshot['memory'])
+    vm.registers.update(snapshot['registers'])
+    vm.io.output_buffer += bytes.fromhex(snapshot['output'])
+    return snapshot['device']